@@ -0,0 +1,116 @@
+import os
+import json
+import numpy as np
+import faiss
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq8", "fp16")
+PARAMS_FILE = "index_params.json"
+MIN_POINTS_PER_CENTROID = 39  # faiss warns when IVF training has fewer points than this per list
+SEARCH_PARAMS = ("nprobe", "efSearch")  # query-time knobs: changing them needs no rebuild
+
+# Build and search settings per index type; overrides are merged on top
+DEFAULT_PARAMS = {
+    "flat": {},
+    "ivf_flat": {"nlist": 256, "nprobe": 16},
+    "ivf_pq": {"nlist": 256, "nprobe": 16, "m": 16, "nbits": 8},
+    "hnsw": {"M": 32, "efConstruction": 200, "efSearch": 64},
+    "sq8": {},
+    "fp16": {}
+}
+
+def resolve_params(index_type: str = "flat", overrides: dict = None, n_vectors: int = None) -> dict:
+    """Merge overrides into the defaults for index_type and clamp nlist to the corpus size."""
+    if index_type not in DEFAULT_PARAMS:
+        raise ValueError(f"Unknown index type '{index_type}'. Choose from: {', '.join(INDEX_TYPES)}")
+    params = {"index_type": index_type, **DEFAULT_PARAMS[index_type]}
+    params.update({key: value for key, value in (overrides or {}).items()
+                   if value is not None and key in DEFAULT_PARAMS[index_type]})
+    if "nlist" in params and n_vectors is not None:
+        params["nlist"] = max(1, min(params["nlist"], n_vectors // MIN_POINTS_PER_CENTROID))
+        params["nprobe"] = min(params["nprobe"], params["nlist"])
+    return params
+
+def make_index(dim: int, params: dict) -> faiss.Index:
+    """Create an empty (possibly untrained) index for the given parameters."""
+    index_type = params["index_type"]
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim)
+    if index_type == "ivf_flat":
+        return faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, params["nlist"], faiss.METRIC_L2)
+    if index_type == "ivf_pq":
+        if dim % params["m"] != 0:
+            raise ValueError(f"ivf_pq: m={params['m']} must divide the embedding dimension {dim}")
+        return faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, params["nlist"], params["m"], params["nbits"])
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params["M"])
+        index.hnsw.efConstruction = params["efConstruction"]
+        return index
+    if index_type == "sq8":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit)
+    if index_type == "fp16":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16)
+    raise ValueError(f"Unknown index type '{index_type}'")
+
+def with_ids(index: faiss.Index, params: dict) -> faiss.Index:
+    """
+    Make an index accept explicit ids (add_with_ids / remove_ids).
+    IVF indexes store ids natively; the others are wrapped in an IndexIDMap2.
+    """
+    if params["index_type"] in ("ivf_flat", "ivf_pq"):
+        return index
+    return faiss.IndexIDMap2(index)
+
+def supports_removal(params: dict) -> bool:
+    """HNSW graphs cannot delete vectors; every other type can."""
+    return params["index_type"] != "hnsw"
+
+def build_index(embeddings: np.ndarray, params: dict, ids: np.ndarray = None) -> faiss.Index:
+    """
+    Create, train (when the index type needs it) and fill an index.
+    When ids are given the index is id-mapped so it can be updated incrementally.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    index = make_index(embeddings.shape[1], params)
+    if not index.is_trained:
+        index.train(embeddings)
+    if ids is None:
+        index.add(embeddings)
+    else:
+        index = with_ids(index, params)
+        index.add_with_ids(embeddings, np.asarray(ids, dtype=np.int64))
+    apply_search_params(index, params)
+    return index
+
+def apply_search_params(index: faiss.Index, params: dict):
+    """Set query-time knobs (nprobe, efSearch) on an index, including wrapped ones."""
+    space = faiss.ParameterSpace()
+    if "nprobe" in params:
+        space.set_index_parameter(index, "nprobe", params["nprobe"])
+    if "efSearch" in params:
+        space.set_index_parameter(index, "efSearch", params["efSearch"])
+
+def search_parameters(params: dict, ids: np.ndarray):
+    """
+    Per-call search parameters that restrict results to the given ids (FAISS ids ==
+    passage store rows). IVF indexes need their nprobe restated, or the call would reset it.
+    """
+    sel = faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype=np.int64))
+    if "nprobe" in params:
+        return faiss.SearchParametersIVF(sel=sel, nprobe=params["nprobe"])
+    return faiss.SearchParameters(sel=sel)
+
+def save_params(out_dir: str, params: dict):
+    with open(os.path.join(out_dir, PARAMS_FILE), "w", encoding="utf-8") as f:
+        json.dump(params, f, indent=2)
+
+def load_params(index_dir: str) -> dict:
+    """Parameters saved next to kb.index; indexes built before they were recorded are flat."""
+    path = os.path.join(index_dir, PARAMS_FILE)
+    if not os.path.exists(path):
+        return {"index_type": "flat"}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    """Serialized size of the index, a close proxy for its resident memory."""
+    return int(faiss.serialize_index(index).size)
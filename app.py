@@ -1,26 +1,29 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory, stream_with_context
 import os
 import json
-import subprocess
-from retrieval_utils import Retriever
-import rag  # Import the RAGQA class from rag.py
+from scheduler import DeadlineExceeded, QueueFull, RequestCancelled
+from server_setup import (ADMIN_TOKEN, MAX_BATCH_QUESTIONS, answer_result, batch_result, rag_instance, request_filters,
+                          retriever, scheduler)
+import server_setup
+import metrics
 
 app = Flask(__name__, static_folder='front-end', template_folder='front-end')
 
-# Configuration
-MODEL_FILE = 'llama-3-8b-instruct-q4.gguf'
-LLAMA_FILE_EXE = 'llamafile.exe'
-TOP_K = 4
-MAX_NEW_TOKENS = 200
-TEMPERATURE = 0.5
-
-# Initialize RAGQA instance globally
-try:
-    retriever = Retriever()
-    rag_instance = rag.RAGQA(retriever)
-except FileNotFoundError as e:
-    print(f"Error initializing RAGQA: {e}")
-    exit(1)
+@app.errorhandler(QueueFull)
+def queue_full(e):
+    # 503 + Retry-After: the server is saturated, not the client over its quota
+    response = jsonify({"error": str(e), "retry_after": e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+@app.errorhandler(DeadlineExceeded)
+def deadline_exceeded(e):
+    return jsonify({"error": str(e)}), 504
+
+@app.errorhandler(RequestCancelled)
+def request_cancelled(e):
+    # 499 (client closed request): nobody is waiting for the answer, and it is not a server timeout
+    return jsonify({"error": str(e)}), 499
 
 @app.route('/')
 def index():
@@ -36,17 +39,118 @@ def ask():
     query = data.get('question', '').strip()
     if not query:
         return jsonify({"error": "No question provided"}), 400
+    try:
+        filters = request_filters(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
-        response = rag_instance.generate_answer(query)
-        return jsonify({
-            "question": response["question"],
-            "answer": response["answer"],
-            "sources": response["sources"],
-            "retrieval_count": response["retrieval_count"]
-        })
+        # {"timings": true} adds the per-stage breakdown of this request to the response
+        if data.get('timings'):
+            with metrics.breakdown() as timings:
+                response = rag_instance.generate_answer(query, filters=filters)
+        else:
+            timings, response = None, rag_instance.generate_answer(query, filters=filters)
+        return jsonify(answer_result(response, timings))
+    except (QueueFull, DeadlineExceeded, RequestCancelled):
+        raise
     except Exception as e:
         return jsonify({"error": f"Error processing question: {str(e)}"}), 500
 
+@app.route('/api/ask_batch', methods=['POST'])
+def ask_batch():
+    """Answer a list of questions; retrieval for all of them runs as one batch."""
+    data = request.get_json()
+    questions = data.get('questions')
+    if not isinstance(questions, list) or not questions:
+        return jsonify({"error": "No questions provided"}), 400
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        return jsonify({"error": f"At most {MAX_BATCH_QUESTIONS} questions per batch"}), 400
+    queries = [str(q).strip() for q in questions]
+    if not all(queries):
+        return jsonify({"error": "Empty question in batch"}), 400
+    try:
+        filters = request_filters(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        responses = rag_instance.generate_answers(queries, filters=filters)
+        return jsonify({"results": [batch_result(query, response) for query, response in zip(queries, responses)]})
+    except (QueueFull, DeadlineExceeded, RequestCancelled):
+        raise
+    except Exception as e:
+        return jsonify({"error": f"Error processing questions: {str(e)}"}), 500
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(server_setup.cache_stats())
+
+@app.route('/api/courses', methods=['GET'])
+def courses():
+    """Courses questions can be scoped to (send "course" / "lectures" with a question)."""
+    return jsonify({"courses": retriever.courses()})
+
+@app.route('/api/index', methods=['GET'])
+def index_info():
+    """The index version answers are currently served from."""
+    return jsonify(server_setup.index_info())
+
+@app.route('/api/admin/reload', methods=['POST'])
+def reload_index():
+    """Swap in the CURRENT index version now instead of waiting for the watcher ({"force": true} reloads the same version)."""
+    if ADMIN_TOKEN and request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({"error": "Forbidden"}), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(retriever.reload(force=bool(data.get('force'))))
+    except FileNotFoundError as e:
+        return jsonify({"error": f"Reload failed, still serving {retriever.version}: {str(e)}"}), 500
+
+@app.route('/api/gate/stats', methods=['GET'])
+def gate_stats():
+    """Confidence gate thresholds, questions skipped or shrunk, and the generation time saved."""
+    return jsonify(server_setup.gate_stats())
+
+@app.route('/api/scheduler/stats', methods=['GET'])
+def scheduler_stats():
+    """Generation slots in use, queue depth and queue wait percentiles."""
+    return jsonify(scheduler.stats())
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Stage latency histograms and scheduler gauges in the Prometheus text format."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/ask_stream', methods=['POST'])
+def ask_stream():
+    """Same contract as /api/ask, streamed as server-sent events (token events, then one done event)."""
+    data = request.get_json()
+    query = data.get('question', '').strip()
+    if not query:
+        return jsonify({"error": "No question provided"}), 400
+    try:
+        filters = request_filters(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Turn requests away before the stream starts, while a status code can still be sent
+    if scheduler.would_reject():
+        raise QueueFull(scheduler.retry_after())
+
+    def events():
+        try:
+            for event in rag_instance.stream_answer(query, filters=filters):
+                yield f"data: {json.dumps(event)}\n\n"
+        except QueueFull as e:
+            yield f"data: {json.dumps({'type': 'error', 'error': str(e), 'retry_after': e.retry_after})}\n\n"
+        except Exception as e:
+            yield f"data: {json.dumps({'type': 'error', 'error': f'Error processing question: {str(e)}'})}\n\n"
+
+    # If the client disconnects, Flask closes the generator, which cancels the generation and frees its slot
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # The reloader would start a second process and with it a second llamafile server.
+    # threaded: requests queue in the GenerationScheduler rather than behind each other in Flask.
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', use_reloader=False, threaded=True, host='0.0.0.0', port=5000)
\ No newline at end of file
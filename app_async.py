@@ -0,0 +1,193 @@
+import os
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from scheduler import DeadlineExceeded, QueueFull, RequestCancelled
+from micro_batcher import MAX_BATCH_SIZE
+from server_setup import (ADMIN_TOKEN, MAX_BATCH_QUESTIONS, answer_result, backend, batch_result, rag_instance,
+                          request_filters, retriever, scheduler, threads, watcher)
+import server_setup
+import metrics
+
+# asyncio entry point with the same routes and JSON contract as app.py (both build on server_setup.py).
+# One event loop holds the open requests; retrieval runs on a thread pool and generation is
+# awaited, so a slow answer ties up a scheduler slot but no thread.
+# Run: python app_async.py  (instead of python app.py)
+
+FRONT_END_DIR = 'front-end'
+HOST = '0.0.0.0'
+PORT = 5000
+
+# Retrieval, prompt packing and cache writes run here, never on the event loop. A retrieval mostly
+# waits in MicroBatcher.submit while the batcher thread embeds on the embedder's cores, so the pool
+# holds a full batch of waiters rather than one thread per core
+RETRIEVAL_WORKERS = max(threads["embed"], MAX_BATCH_SIZE)
+
+executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+def error(message: str, status: int, **extra) -> web.Response:
+    return web.json_response({"error": message, **extra}, status=status)
+
+def queue_full(e: QueueFull) -> web.Response:
+    return web.json_response({"error": str(e), "retry_after": e.retry_after}, status=503,
+                             headers={'Retry-After': str(e.retry_after)})
+
+async def read_json(request: web.Request) -> dict:
+    try:
+        data = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+async def index(request):
+    return web.FileResponse(os.path.join(FRONT_END_DIR, 'index.html'))
+
+async def ask(request):
+    data = await read_json(request)
+    query = str(data.get('question', '')).strip()
+    if not query:
+        return error("No question provided", 400)
+    try:
+        filters = request_filters(data)
+    except ValueError as e:
+        return error(str(e), 400)
+
+    try:
+        # {"timings": true} adds the per-stage breakdown of this request to the response
+        if data.get('timings'):
+            with metrics.breakdown() as timings:
+                response = await rag_instance.agenerate_answer(query, executor=executor, filters=filters)
+        else:
+            timings, response = None, await rag_instance.agenerate_answer(query, executor=executor, filters=filters)
+        return web.json_response(answer_result(response, timings))
+    except QueueFull as e:
+        return queue_full(e)
+    except DeadlineExceeded as e:
+        return error(str(e), 504)
+    except RequestCancelled as e:
+        return error(str(e), 499)  # client closed request, not a timeout
+    except Exception as e:
+        return error(f"Error processing question: {str(e)}", 500)
+
+async def ask_batch(request):
+    """Answer a list of questions; retrieval for all of them runs as one batch."""
+    data = await read_json(request)
+    questions = data.get('questions')
+    if not isinstance(questions, list) or not questions:
+        return error("No questions provided", 400)
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        return error(f"At most {MAX_BATCH_QUESTIONS} questions per batch", 400)
+    queries = [str(q).strip() for q in questions]
+    if not all(queries):
+        return error("Empty question in batch", 400)
+    try:
+        filters = request_filters(data)
+    except ValueError as e:
+        return error(str(e), 400)
+
+    try:
+        responses = await rag_instance.agenerate_answers(queries, executor=executor, filters=filters)
+        return web.json_response({"results": [batch_result(query, response) for query, response in zip(queries, responses)]})
+    except QueueFull as e:
+        return queue_full(e)
+    except DeadlineExceeded as e:
+        return error(str(e), 504)
+    except RequestCancelled as e:
+        return error(str(e), 499)  # client closed request, not a timeout
+    except Exception as e:
+        return error(f"Error processing questions: {str(e)}", 500)
+
+async def cache_stats(request):
+    return web.json_response(server_setup.cache_stats())
+
+async def courses(request):
+    """Courses questions can be scoped to (send "course" / "lectures" with a question)."""
+    return web.json_response({"courses": retriever.courses()})
+
+async def index_info(request):
+    """The index version answers are currently served from."""
+    return web.json_response(server_setup.index_info())
+
+async def reload_index(request):
+    """Swap in the CURRENT index version now instead of waiting for the watcher ({"force": true} reloads the same version)."""
+    if ADMIN_TOKEN and request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return error("Forbidden", 403)
+    data = await read_json(request)
+    try:
+        # Loading the new version is blocking work: it runs on the executor while the loop keeps serving
+        return web.json_response(await asyncio.get_running_loop().run_in_executor(executor, retriever.reload, bool(data.get('force'))))
+    except FileNotFoundError as e:
+        return error(f"Reload failed, still serving {retriever.version}: {str(e)}", 500)
+
+async def gate_stats(request):
+    """Confidence gate thresholds, questions skipped or shrunk, and the generation time saved."""
+    return web.json_response(server_setup.gate_stats())
+
+async def scheduler_stats(request):
+    """Generation slots in use, queue depth and queue wait percentiles."""
+    return web.json_response(scheduler.stats())
+
+async def prometheus_metrics(request):
+    """Stage latency histograms and scheduler gauges in the Prometheus text format."""
+    return web.Response(body=metrics.render().encode("utf-8"), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+async def ask_stream(request):
+    """Same contract as /api/ask, streamed as server-sent events (token events, then one done event)."""
+    data = await read_json(request)
+    query = str(data.get('question', '')).strip()
+    if not query:
+        return error("No question provided", 400)
+    try:
+        filters = request_filters(data)
+    except ValueError as e:
+        return error(str(e), 400)
+    # Turn requests away before the stream starts, while a status code can still be sent
+    if scheduler.would_reject():
+        return queue_full(QueueFull(scheduler.retry_after()))
+
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache',
+                                           'X-Accel-Buffering': 'no'})
+    await response.prepare(request)
+    events = rag_instance.astream_answer(query, executor=executor, filters=filters)
+    try:
+        try:
+            async for event in events:
+                await response.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        except QueueFull as e:
+            await response.write(f"data: {json.dumps({'type': 'error', 'error': str(e), 'retry_after': e.retry_after})}\n\n".encode("utf-8"))
+        except (ConnectionResetError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            await response.write(f"data: {json.dumps({'type': 'error', 'error': f'Error processing question: {str(e)}'})}\n\n".encode("utf-8"))
+    except ConnectionResetError:
+        pass  # client disconnected; closing the events below cancels the generation
+    finally:
+        await events.aclose()
+    return response
+
+async def on_cleanup(app):
+    watcher.stop()
+    await backend.aclose()
+    executor.shutdown(wait=False)
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get('/', index)
+    app.router.add_static('/static', FRONT_END_DIR)
+    app.router.add_post('/api/ask', ask)
+    app.router.add_post('/api/ask_batch', ask_batch)
+    app.router.add_get('/api/cache/stats', cache_stats)
+    app.router.add_get('/api/courses', courses)
+    app.router.add_get('/api/index', index_info)
+    app.router.add_post('/api/admin/reload', reload_index)
+    app.router.add_get('/api/gate/stats', gate_stats)
+    app.router.add_get('/api/scheduler/stats', scheduler_stats)
+    app.router.add_get('/metrics', prometheus_metrics)
+    app.router.add_post('/api/ask_stream', ask_stream)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+if __name__ == '__main__':
+    # handler_cancellation: a client that disconnects from /api/ask cancels its handler, and with it the generation
+    web.run_app(create_app(), host=HOST, port=PORT, handler_cancellation=True)
@@ -0,0 +1,133 @@
+import os
+import json
+import threading
+import numpy as np
+
+GATE_FILE = os.environ.get('RAG_GATE_FILE', 'data/gate.json')  # written by evaluate/calibrate_gate.py
+MIN_K = 1  # passages always kept when a question is answered
+ANSWER_QUANTILE = 0.98  # share of gold questions whose best distance must stay under the no-answer threshold
+MARGIN_QUANTILE = 0.9  # share of relevant passages (when retrieved) the adaptive k must still keep
+TIMING_ALPHA = 0.1  # weight of the newest generation in the running generation-time averages
+NO_ANSWER = "The lecture transcripts do not cover this question closely enough to answer it."
+
+# Gating works on dense L2 distances (lower is closer), which are comparable between
+# questions; BM25 and fused scores are not, so the gate is only used in dense mode.
+
+def best_and_gaps(retrieved: list):
+    """Best distance of a result list and the distance of every passage above it."""
+    scores = np.asarray([p["score"] for p in retrieved], dtype=np.float32)
+    return float(scores[0]), scores - scores[0]
+
+
+class ConfidenceGate:
+    """
+    Decides, from the distance curve of a question's retrieved passages, whether to
+    answer it and from how many passages. A question whose closest passage is further
+    than `max_distance` gets a no-answer response without calling the LLM; otherwise
+    only passages within `margin` of the closest one are kept (at least min_k).
+    Also estimates the generation time this saves, from the running average of real generations.
+    """
+    def __init__(self, max_distance: float, margin: float, min_k: int = MIN_K, model_name: str = None, encoder: str = None):
+        self.max_distance = max_distance
+        self.margin = margin
+        self.min_k = min_k
+        self.model_name = model_name
+        self.encoder = encoder  # torch, onnx or onnx-int8: quantized embeddings shift the distances too
+        self.answered = 0
+        self.skipped = 0
+        self.shrunk = 0
+        self.passages_dropped = 0
+        self.saved_s = 0.0
+        self._generate_s = None  # running mean of a whole generation
+        self._prefill_per_passage_s = None  # running mean of prefill time per passage in the prompt
+        self._lock = threading.Lock()
+
+    def decide(self, retrieved: list) -> dict:
+        """{"answer": bool, "k": passages to keep, "best_score": closest distance}."""
+        if not retrieved:
+            return {"answer": False, "k": 0, "best_score": None}
+        best, gaps = best_and_gaps(retrieved)
+        if best > self.max_distance:
+            return {"answer": False, "k": 0, "best_score": round(best, 4)}
+        k = max(min(self.min_k, len(retrieved)), int(np.count_nonzero(gaps <= self.margin)))
+        return {"answer": True, "k": k, "best_score": round(best, 4)}
+
+    def record(self, decision: dict, retrieved: int):
+        """Count a decision and add the generation time it saved (estimated) to the total."""
+        with self._lock:
+            if not decision["answer"]:
+                self.skipped += 1
+                self.saved_s += self._generate_s or 0.0
+                return
+            self.answered += 1
+            dropped = retrieved - decision["k"]
+            if dropped > 0:
+                self.shrunk += 1
+                self.passages_dropped += dropped
+                self.saved_s += dropped * (self._prefill_per_passage_s or 0.0)
+
+    def observe(self, generate_s: float, prefill_s: float, passages: int):
+        """Feed the timing of a generation that ran, for the savings estimates."""
+        with self._lock:
+            self._generate_s = generate_s if self._generate_s is None else \
+                (1 - TIMING_ALPHA) * self._generate_s + TIMING_ALPHA * generate_s
+            if prefill_s is not None and passages:
+                per_passage = prefill_s / passages
+                self._prefill_per_passage_s = per_passage if self._prefill_per_passage_s is None else \
+                    (1 - TIMING_ALPHA) * self._prefill_per_passage_s + TIMING_ALPHA * per_passage
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_distance": self.max_distance,
+                "margin": self.margin,
+                "answered": self.answered,
+                "skipped": self.skipped,
+                "shrunk": self.shrunk,
+                "passages_dropped": self.passages_dropped,
+                "saved_s": round(self.saved_s, 3),
+                "mean_generate_s": round(self._generate_s, 3) if self._generate_s is not None else None
+            }
+
+    def save(self, path: str = GATE_FILE, **extra):
+        """Write the calibrated thresholds (plus extra calibration figures) as JSON."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"max_distance": self.max_distance, "margin": self.margin, "min_k": self.min_k,
+                       "model_name": self.model_name, "encoder": self.encoder, **extra}, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str = GATE_FILE):
+        """The gate calibrated into path, or None when it has not been calibrated."""
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            params = json.load(f)
+        return cls(params["max_distance"], params["margin"], params.get("min_k", MIN_K), params.get("model_name"),
+                   params.get("encoder"))
+
+
+def calibrate(results: list, relevant: list, answer_quantile: float = ANSWER_QUANTILE,
+              margin_quantile: float = MARGIN_QUANTILE, min_k: int = MIN_K, model_name: str = None,
+              encoder: str = None) -> ConfidenceGate:
+    """
+    Fit a gate to dense retrieval results of gold questions (one result list per question,
+    and the set of relevant passage ids of each). The no-answer threshold is the
+    answer_quantile of the best distances, so that share of gold questions is still
+    answered; the margin is the margin_quantile of the distance between the best passage
+    and the first relevant one, over the questions whose relevant passage was retrieved.
+    """
+    best, gaps = [], []
+    for retrieved, ids in zip(results, relevant):
+        if not retrieved:
+            continue
+        top, above = best_and_gaps(retrieved)
+        best.append(top)
+        hits = [i for i, p in enumerate(retrieved) if p["id"] in ids]
+        if hits:
+            gaps.append(float(above[hits[0]]))
+    if not best:
+        raise ValueError("No retrieval results to calibrate on")
+    max_distance = float(np.quantile(best, answer_quantile))
+    margin = float(np.quantile(gaps, margin_quantile)) if gaps else float("inf")
+    return ConfidenceGate(round(max_distance, 4), round(margin, 4), min_k, model_name, encoder)
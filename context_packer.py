@@ -0,0 +1,94 @@
+import re
+from lexical_index import tokenize
+from llm_backend import estimate_tokens
+
+CONTEXT_TOKEN_BUDGET = 384  # tokens of passage text placed in the prompt
+MAX_SENTENCE_WORDS = 40  # longer runs without punctuation are split into pieces of this size
+SHINGLE_SIZE = 3  # words per shingle when detecting overlapping text
+MAX_OVERLAP = 0.6  # sentences whose shingles are this much covered already are dropped
+RANK_WEIGHT = 0.5  # how much a passage's retrieval rank adds to its sentences' scores
+MIN_FILL_TOKENS = 8  # stop looking for sentences once less than this much budget is left
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+STOPWORDS = frozenset("""a an and are as at be but by do does for from how i if in is it of on or so
+that the their them then there these they this to was we what when where which who why will with you""".split())
+
+def split_sentences(text: str) -> list:
+    """Split passage text into sentences; unpunctuated runs are cut every MAX_SENTENCE_WORDS words."""
+    sentences = []
+    for sentence in SENTENCE_END.split(text.strip()):
+        words = sentence.split()
+        for start in range(0, len(words), MAX_SENTENCE_WORDS):
+            sentences.append(" ".join(words[start:start + MAX_SENTENCE_WORDS]))
+    return sentences
+
+def shingles(words: list) -> set:
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def pack_context(query: str, passages: list, count_tokens=estimate_tokens, budget: int = CONTEXT_TOKEN_BUDGET) -> dict:
+    """
+    Choose the sentences of the retrieved passages (best first) that best answer the
+    query and fit in `budget` tokens, as counted by count_tokens.
+    A sentence scores by the share of query terms it contains plus a bonus for the
+    rank of its passage. Text repeated across passages (the chunk overlap) is kept
+    once. Selected sentences are returned in their original passage order.
+    Returns {"text", "tokens", "sentences", "passages"} where "passages" lists the
+    indices of passages that contributed text.
+    """
+    query_terms = {t for t in tokenize(query) if t not in STOPWORDS}
+    candidates = []  # (score, passage index, position, sentence)
+    for p_idx, passage in enumerate(passages):
+        rank_bonus = RANK_WEIGHT / (1 + p_idx)
+        for position, sentence in enumerate(split_sentences(passage["text"])):
+            terms = set(tokenize(sentence))
+            coverage = len(query_terms & terms) / len(query_terms) if query_terms else 0.0
+            candidates.append((coverage + rank_bonus, p_idx, position, sentence))
+    candidates.sort(key=lambda c: (-c[0], c[1], c[2]))
+
+    seen = set()
+    selected = []
+    used = 0
+    for score, p_idx, position, sentence in candidates:
+        if budget - used < MIN_FILL_TOKENS:
+            break
+        words = sentence.lower().split()
+        sentence_shingles = shingles(words)
+        if sentence_shingles and len(sentence_shingles & seen) / len(sentence_shingles) >= MAX_OVERLAP:
+            continue
+        tokens = count_tokens(sentence) + 1  # +1 for the joining space / newline
+        if used + tokens > budget:
+            continue  # a shorter sentence further down may still fit
+        seen |= sentence_shingles
+        selected.append((p_idx, position, sentence))
+        used += tokens
+
+    selected.sort()
+    blocks = []
+    for p_idx in sorted({p for p, _, _ in selected}):
+        blocks.append(f"Passage {len(blocks) + 1}: " + " ".join(s for p, _, s in selected if p == p_idx))
+    return {
+        "text": "\n\n".join(blocks),
+        "tokens": used,
+        "sentences": len(selected),
+        "passages": sorted({p for p, _, _ in selected})
+    }
+
+def fit_context(query: str, passages: list, count_tokens=estimate_tokens, budget: int = CONTEXT_TOKEN_BUDGET) -> dict:
+    """
+    pack_context with sentences sized by the cheap estimate_tokens, checked with
+    count_tokens (e.g. the llamafile server's /tokenize) once on the packed text rather
+    than once per candidate sentence. If the real count is over budget, the context is
+    re-packed with the budget scaled down by the overshoot (rare: the estimate runs
+    slightly above the Llama tokenizer). "tokens" is the real count.
+    """
+    target = budget
+    while True:
+        context = pack_context(query, passages, estimate_tokens, target)
+        tokens = count_tokens(context["text"]) if context["text"] else 0
+        if tokens <= budget or target <= 0:
+            break
+        target = min(target - 1, int(target * budget / tokens))
+    context["tokens"] = tokens
+    return context
@@ -0,0 +1,119 @@
+import os
+import json
+import numpy as np
+import faiss
+from passage_store import STORE_DIRNAME, PassageStore, convert_mapping
+from ann_index import apply_search_params, load_params, search_parameters
+from lexical_index import LexicalIndex, lexical_index_exists
+
+COURSES_DIRNAME = "courses"  # one index directory per course: <index_dir>/courses/<course>
+SHARDS_FILE = "shards.json"  # lists the course shards; without it the index directory is one unsharded index
+MANIFEST_FILE = "manifest.json"  # per index directory: file and passage hashes and the rows of each file
+FILTER_KEYS = {"course": "courses", "courses": "courses", "lecture": "lectures", "lectures": "lectures"}
+
+def save_shards(out_dir: str, model_name: str, manifests: dict):
+    """Write shards.json for the course shards whose manifests are given ({course: manifest}); atomic."""
+    courses = []
+    for course, manifest in manifests.items():
+        courses.append({
+            "course": course,
+            "dir": os.path.join(COURSES_DIRNAME, course),
+            "passages": sum(len(entry["passages"]) for entry in manifest["files"].values()),
+            "lectures": sorted(os.path.splitext(filename)[0] for filename in manifest["files"])
+        })
+    path = os.path.join(out_dir, SHARDS_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"model_name": model_name, "courses": courses}, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def load_shards(index_dir: str):
+    path = os.path.join(index_dir, SHARDS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def normalize_filters(filters: dict = None):
+    """
+    Canonical retrieval filter: {"courses": [...], "lectures": [...]} with sorted names
+    (either key may be missing), or None when nothing is filtered. Accepts "course" /
+    "courses" and "lecture" / "lectures", each a single name or a list of names.
+    """
+    if not filters:
+        return None
+    normalized = {}
+    for key, value in filters.items():
+        if key not in FILTER_KEYS:
+            raise ValueError(f"Unknown filter '{key}'. Use course or lectures.")
+        if value in (None, "", []):
+            continue
+        names = value if isinstance(value, (list, tuple, set)) else [value]
+        normalized.setdefault(FILTER_KEYS[key], set()).update(str(name) for name in names)
+    return {key: sorted(names) for key, names in normalized.items()} or None
+
+def filter_key(filters: dict = None) -> str:
+    """Cache key prefix for a (normalized) filter; empty when nothing is filtered."""
+    if not filters:
+        return ""
+    return ";".join(f"{key}={','.join(names)}" for key, names in sorted(filters.items())) + "|"
+
+
+class IndexShard:
+    """
+    One searchable index directory: a course shard, or the whole corpus of an unsharded
+    build. Holds the FAISS index, the passage store, the BM25 index (when built) and the
+    store rows of each lecture, read from the build manifest.
+    """
+    def __init__(self, index_dir: str, course: str = None, lexical: bool = False):
+        index_path = os.path.join(index_dir, "kb.index")
+        if not os.path.exists(index_path):
+            raise FileNotFoundError("FAISS index not found. Run knowledge_base.py first.")
+        self.index_dir = index_dir
+        self.course = course
+        self.index = faiss.read_index(index_path)
+        self.index_params = load_params(index_dir)
+        apply_search_params(self.index, self.index_params)
+
+        #Open passage store (memory-mapped); convert a legacy mapping.json on first use
+        store_dir = os.path.join(index_dir, STORE_DIRNAME)
+        mapping_path = os.path.join(index_dir, "mapping.json")
+        if not os.path.exists(os.path.join(store_dir, "text.off")) and os.path.exists(mapping_path):
+            convert_mapping(mapping_path, store_dir)
+        self.store = PassageStore(store_dir)
+
+        #lexical=True requires the BM25 index; otherwise it is opened only if it was built
+        self.lexical = LexicalIndex(index_dir) if lexical or lexical_index_exists(index_dir) else None
+
+        #Lecture -> sorted store rows, so lecture filters become FAISS id selectors
+        self.lectures = None
+        manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                files = json.load(f)["files"]
+            self.lectures = {os.path.splitext(filename)[0]: np.sort(np.asarray([row for _, row in entry["passages"]], dtype=np.int64))
+                             for filename, entry in files.items()}
+
+    def rows(self, lectures: list = None):
+        """Store rows of the given lectures (None: every row, no restriction)."""
+        if lectures is None:
+            return None
+        if self.lectures is None:
+            raise ValueError(f"{self.index_dir} has no lecture metadata. Rebuild it with knowledge_base.py.")
+        found = [self.lectures[name] for name in lectures if name in self.lectures]
+        return np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+    def search(self, query_vecs: np.ndarray, k: int, rows: np.ndarray = None) -> list:
+        """Dense top-k per query as (rows, L2 distances) pairs, restricted to `rows` when given."""
+        params = search_parameters(self.index_params, rows) if rows is not None else None
+        D, I = self.index.search(query_vecs, k, params=params)
+        return list(zip(I, D))
+
+    def search_lexical(self, queries: list, k: int, rows: np.ndarray = None) -> list:
+        """BM25 top-k per query as (rows, scores) pairs, restricted to `rows` when given."""
+        return [self.lexical.search(q, k, rows) for q in queries]
+
+    def close(self):
+        """Unmap the passage store and drop the index; only once no search uses this shard any more."""
+        self.store.close()
+        self.index = None
+        self.lexical = None
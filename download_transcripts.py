@@ -1,99 +1,235 @@
 import os
+import json
+import time
+import argparse
+import threading
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
-import time  # For rate limiting
 
 DATA_DIR = "data/raw"
+META_FILE = ".download_meta.json"  # ETag / Last-Modified per downloaded file, kept in save_dir
+NUM_WORKERS = 4
+REQUESTS_PER_SECOND = 2.0  # shared across all workers
+CHUNK_SIZE = 64 * 1024
+MAX_RETRIES = 4
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
 
-def download_file(url: str, save_dir: str = DATA_DIR) -> str:
+
+class TokenBucket:
+    """
+    Thread-safe token-bucket rate limiter: allows `rate` requests per second on
+    average with bursts of up to `capacity`. acquire() blocks until a token is free.
+    """
+    def __init__(self, rate: float = REQUESTS_PER_SECOND, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def make_session(pool_size: int = NUM_WORKERS, retries: int = MAX_RETRIES) -> requests.Session:
+    """Pooled session shared by all workers; retries with exponential backoff on errors and 429/5xx."""
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=["GET", "HEAD"], respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+_default_session = None
+_default_limiter = None
+
+def _defaults(session, limiter):
+    global _default_session, _default_limiter
+    if session is None:
+        if _default_session is None:
+            _default_session = make_session()
+        session = _default_session
+    if limiter is None:
+        if _default_limiter is None:
+            _default_limiter = TokenBucket()
+        limiter = _default_limiter
+    return session, limiter
+
+_meta_lock = threading.Lock()
+
+def _load_meta(save_dir: str) -> dict:
+    path = os.path.join(save_dir, META_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _update_meta(save_dir: str, filename: str, entry: dict):
+    with _meta_lock:
+        meta = _load_meta(save_dir)
+        meta[filename] = entry
+        path = os.path.join(save_dir, META_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+def download_file(url: str, save_dir: str = DATA_DIR, session: requests.Session = None, limiter: TokenBucket = None) -> str:
     """Downloads a PDF file from the given URL and saves it locally.
+    Files already on disk are skipped; if their ETag/Last-Modified are known a
+    conditional GET checks for a newer version first. The body is streamed to disk.
     Returns the saved file path."""
+    session, limiter = _defaults(session, limiter)
     os.makedirs(save_dir, exist_ok=True)
     filename = url.split("/")[-1].split("?")[0]  # Handle query params
     if not filename.endswith(".pdf"):
         filename += ".pdf"  # Ensure PDF extension
     file_path = os.path.join(save_dir, filename)
 
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
+    headers = {}
+    if os.path.exists(file_path):
+        with _meta_lock:
+            entry = _load_meta(save_dir).get(filename)
+        if not entry:
+            print(f"Already present: {file_path}")
+            return file_path
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    limiter.acquire()
+    with session.get(url, headers=headers, stream=True, timeout=60) as response:
+        if response.status_code == 304:
+            print(f"Not modified: {file_path}")
+            return file_path
+        response.raise_for_status()
+
+        tmp_path = file_path + ".part"
+        with open(tmp_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+        os.replace(tmp_path, file_path)
 
-    with open(file_path, "wb") as f:
-        f.write(response.content)
+        _update_meta(save_dir, filename, {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")
+        })
 
     print(f"Downloaded: {file_path}")
     return file_path
 
-def scrape_links(base_url: str, file_ext: str = ".pdf") -> list:
-    """Scrapes transcript PDF links from the Lecture Videos section of the course page."""
+def _fetch_soup(url: str, session: requests.Session, limiter: TokenBucket) -> BeautifulSoup:
+    limiter.acquire()
+    response = session.get(url, timeout=60)
+    response.raise_for_status()
+    return BeautifulSoup(response.text, "html.parser")
+
+def find_transcript_links(lecture_url: str, session: requests.Session, limiter: TokenBucket, file_ext: str = ".pdf") -> list:
+    """Visits one lecture page and returns its transcript PDF links."""
+    print(f"Visiting lecture page: {lecture_url}")  # Debug
+    lecture_soup = _fetch_soup(lecture_url, session, limiter)
+    links = []
+
+    # Primary: Look for "Download transcript" or similar link text
+    for lecture_a in lecture_soup.find_all("a", href=True):
+        link_text = lecture_a.text.strip().lower()
+        if "download transcript" in link_text or "transcript" in link_text:
+            transcript_href = urljoin(lecture_url.rstrip("/") + "/", lecture_a["href"])
+            print(f"Found potential transcript link: {transcript_href} (text: {lecture_a.text.strip()})")  # Debug
+            if transcript_href.endswith(".pdf"):
+                links.append(transcript_href)
+            else:
+                print(f"Transcript link found but not PDF: {transcript_href}")  # Debug
+
+    # Fallback: Search for any .pdf links on the page, especially those with "transcript" in the URL or text
+    if not links:
+        print(f"No exact 'Download transcript' found on {lecture_url}, checking for any PDFs...")  # Debug
+        for lecture_a in lecture_soup.find_all("a", href=True):
+            pdf_href = lecture_a["href"]
+            if pdf_href.endswith(file_ext) or "transcript" in pdf_href.lower():
+                pdf_href = urljoin(lecture_url.rstrip("/") + "/", pdf_href)
+                print(f"Found fallback PDF link: {pdf_href} (text: {lecture_a.text.strip()})")  # Debug
+                links.append(pdf_href)
+    return links
+
+def scrape_links(base_url: str, file_ext: str = ".pdf", session: requests.Session = None,
+                 limiter: TokenBucket = None, workers: int = NUM_WORKERS) -> list:
+    """Scrapes transcript PDF links from the Lecture Videos section of the course page.
+    Lecture pages are visited concurrently; duplicate links are dropped (first occurrence kept)."""
+    session, limiter = _defaults(session, limiter)
     # Use the video galleries URL for lecture videos list
     lecture_videos_url = base_url.rstrip("/") + "/video_galleries/lecture-videos/"
-    
+
     try:
-        response = requests.get(lecture_videos_url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
+        soup = _fetch_soup(lecture_videos_url, session, limiter)
 
-        links = []
         # Find links to individual lecture resource pages (e.g., /resources/lecture-1-...)
+        lecture_pages = []
         for a in soup.find_all("a", href=True):
             href = a["href"]
             # Flexible match for lecture resource pages
             if "/resources/lecture-" in href and href.count("/") > 2:  # Avoid malformed URLs
-                if not href.startswith("http"):
-                    full_href = "https://ocw.mit.edu" + href if href.startswith("/") else base_url.rstrip("/") + "/" + href
-                else:
-                    full_href = href
-                print(f"Visiting lecture page: {full_href}")  # Debug
-                
-                # Rate limiting to avoid redirects/issues
-                time.sleep(1)
-                
-                # Visit each lecture page to find transcript PDF link
-                headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-                lecture_response = requests.get(full_href, headers=headers)
-                lecture_response.raise_for_status()
-                lecture_soup = BeautifulSoup(lecture_response.text, "html.parser")
-                
-                # Primary: Look for "Download transcript" or similar link text
-                transcript_found = False
-                for lecture_a in lecture_soup.find_all("a", href=True):
-                    link_text = lecture_a.text.strip().lower()
-                    if "download transcript" in link_text or "transcript" in link_text:
-                        transcript_href = lecture_a["href"]
-                        if not transcript_href.startswith("http"):
-                            transcript_href = "https://ocw.mit.edu" + transcript_href if transcript_href.startswith("/") else full_href.rstrip("/") + "/" + transcript_href
-                        print(f"Found potential transcript link: {transcript_href} (text: {lecture_a.text.strip()})")  # Debug
-                        if transcript_href.endswith(".pdf"):
-                            links.append(transcript_href)
-                            transcript_found = True
-                        else:
-                            print(f"Transcript link found but not PDF: {transcript_href}")  # Debug
-
-                # Fallback: Search for any .pdf links on the page, especially those with "transcript" in the URL or text
-                if not transcript_found:
-                    print(f"No exact 'Download transcript' found on {full_href}, checking for any PDFs...")  # Debug
-                    for lecture_a in lecture_soup.find_all("a", href=True):
-                        pdf_href = lecture_a["href"]
-                        if pdf_href.endswith(file_ext) or "transcript" in pdf_href.lower():
-                            if not pdf_href.startswith("http"):
-                                pdf_href = "https://ocw.mit.edu" + pdf_href if pdf_href.startswith("/") else full_href.rstrip("/") + "/" + pdf_href
-                            print(f"Found fallback PDF link: {pdf_href} (text: {lecture_a.text.strip()})")  # Debug
-                            links.append(pdf_href)
-
-        print(f"Found {len(links)} {file_ext} links")
+                full_href = urljoin(base_url.rstrip("/") + "/", href)  # Absolute paths resolve against the course host
+                if full_href not in lecture_pages:
+                    lecture_pages.append(full_href)
+
+        # Visit each lecture page to find transcript PDF links
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            per_page = list(pool.map(lambda url: find_transcript_links(url, session, limiter, file_ext), lecture_pages))
+
+        links = list(dict.fromkeys(link for page_links in per_page for link in page_links))
+        print(f"Found {len(links)} {file_ext} links on {len(lecture_pages)} lecture pages")
         return links
 
     except requests.RequestException as e:
         print(f"Error accessing pages: {e}")
         return []
 
+def download_all(links: list, save_dir: str = DATA_DIR, session: requests.Session = None,
+                 limiter: TokenBucket = None, workers: int = NUM_WORKERS) -> list:
+    """Downloads links on a bounded worker pool. Returns the saved paths; failures are reported and skipped."""
+    session, limiter = _defaults(session, limiter)
+
+    def fetch(link):
+        try:
+            return download_file(link, save_dir, session, limiter)
+        except requests.RequestException as e:
+            print(f"Failed to download {link}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return [path for path in pool.map(fetch, links) if path]
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download lecture transcript PDFs from MIT OCW")
     # MIT OCW Computer Science & Programming in Python
-    base_url = "https://ocw.mit.edu/courses/6-0001-introduction-to-computer-science-and-programming-in-python-fall-2016/"
+    parser.add_argument("--base-url", default="https://ocw.mit.edu/courses/6-0001-introduction-to-computer-science-and-programming-in-python-fall-2016/", help="Course page URL; point it at a local server to test without hitting OCW.")
+    parser.add_argument("--out-dir", default=DATA_DIR, help="Where to save the PDFs.")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="Concurrent requests.")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="Maximum requests per second across all workers.")
+    args = parser.parse_args()
+
+    session = make_session(pool_size=args.workers)
+    limiter = TokenBucket(rate=args.rate)
 
     # Scrape transcript PDF links
-    pdf_links = scrape_links(base_url, ".pdf")
+    pdf_links = scrape_links(args.base_url, ".pdf", session, limiter, args.workers)
 
     # Download them
-    for link in pdf_links:
-        download_file(link)
\ No newline at end of file
+    download_all(pdf_links, args.out_dir, session, limiter, args.workers)
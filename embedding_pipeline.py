@@ -0,0 +1,126 @@
+import os
+import hashlib
+import multiprocessing
+from collections import deque
+import numpy as np
+
+BATCH_SIZE = 512  # passages per shard
+NUM_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+SHARD_DIRNAME = "embedding_shards"
+
+# Shards are written as shard_00000.npy plus a shard_00000.npy.sha1 file holding the
+# digest of the model name and passage texts. The digest file is written last, so a
+# shard counts as complete only if both exist and the digest still matches.
+
+_worker_model = None
+
+def _init_worker(model_name: str, threads: int):
+    #Runs once per worker process: pin its thread count and load the model
+    global _worker_model
+    import torch
+    torch.set_num_threads(threads)
+    from sentence_transformers import SentenceTransformer
+    _worker_model = SentenceTransformer(model_name, device="cpu")
+
+def _encode_shard(task: tuple) -> tuple:
+    shard_path, digest, texts = task
+    embeddings = _worker_model.encode(texts, convert_to_numpy=True)
+    save_shard(shard_path, digest, np.asarray(embeddings, dtype=np.float32))
+    return shard_path, len(texts)
+
+def save_shard(shard_path: str, digest: str, embeddings: np.ndarray):
+    tmp_path = shard_path[:-len(".npy")] + ".tmp.npy"
+    np.save(tmp_path, embeddings)
+    os.replace(tmp_path, shard_path)
+    with open(shard_path + ".sha1", "w", encoding="utf-8") as f:
+        f.write(digest)
+
+def shard_complete(shard_path: str, digest: str) -> bool:
+    if not (os.path.exists(shard_path) and os.path.exists(shard_path + ".sha1")):
+        return False
+    with open(shard_path + ".sha1", "r", encoding="utf-8") as f:
+        return f.read().strip() == digest
+
+def batch_digest(model_name: str, texts: list) -> str:
+    digest = hashlib.sha1(model_name.encode("utf-8"))
+    for text in texts:
+        digest.update(b"\0" + text.encode("utf-8"))
+    return digest.hexdigest()
+
+def batched(iterable, size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def encode_to_shards(passages, shard_dir: str, model_name: str, batch_size: int = BATCH_SIZE,
+                     workers: int = NUM_WORKERS, on_batch=None) -> list:
+    """
+    Encode an iterable of passages in fixed-size batches and write one .npy shard per batch.
+    Batches are spread over `workers` processes (0 encodes in this process); at most
+    2 * workers batches are in flight, so memory stays flat however large the corpus is.
+    Shards completed by an interrupted run are reused when their passages are unchanged.
+    on_batch(batch) is called for every batch in corpus order.
+    Returns the shard paths in order.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    shard_paths = []
+    reused = 0
+    pool = None
+    if workers > 0:
+        # spawn rather than fork: forking after torch has started its thread pools can deadlock
+        context = multiprocessing.get_context("spawn")
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        pool = context.Pool(workers, initializer=_init_worker, initargs=(model_name, threads))
+    pending = deque()
+
+    def finish_oldest():
+        path, n = pending.popleft().get()
+        print(f"Encoded {os.path.basename(path)} ({n} passages)")
+
+    try:
+        for i, batch in enumerate(batched(passages, batch_size)):
+            if on_batch:
+                on_batch(batch)
+            texts = [p["text"] for p in batch]
+            shard_path = os.path.join(shard_dir, f"shard_{i:05d}.npy")
+            digest = batch_digest(model_name, texts)
+            shard_paths.append(shard_path)
+            if shard_complete(shard_path, digest):
+                reused += 1
+                continue
+            if pool is None:
+                if _worker_model is None:
+                    _init_worker(model_name, os.cpu_count() or 1)
+                _encode_shard((shard_path, digest, texts))
+                print(f"Encoded {os.path.basename(shard_path)} ({len(texts)} passages)")
+                continue
+            pending.append(pool.apply_async(_encode_shard, ((shard_path, digest, texts),)))
+            while len(pending) >= 2 * workers:
+                finish_oldest()
+        while pending:
+            finish_oldest()
+    finally:
+        if pool is not None:
+            if pending:
+                pool.terminate()  # failed or interrupted: don't wait for queued batches
+            else:
+                pool.close()
+            pool.join()
+
+    print(f"Encoded {len(shard_paths) - reused} shards, reused {reused} from a previous run")
+    return shard_paths
+
+def iter_shards(shard_paths: list):
+    """Yield each shard as a read-only memory map."""
+    for shard_path in shard_paths:
+        yield np.load(shard_path, mmap_mode="r")
+
+def remove_shards(shard_dir: str):
+    for filename in os.listdir(shard_dir):
+        os.remove(os.path.join(shard_dir, filename))
+    os.rmdir(shard_dir)
@@ -0,0 +1,108 @@
+# benchmark_index.py
+
+import time
+import json
+import argparse
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from knowledge_base import PASSAGES_DIR, MODEL_NAME, load_passages
+from ann_index import INDEX_TYPES, build_index, resolve_params, index_memory_bytes
+
+def load_queries(gold_file: str, passages: list, n_queries: int) -> list:
+    """
+    Queries come from the gold set when given; otherwise a fixed sample of
+    passage texts is used so the benchmark runs without a gold file.
+    """
+    if gold_file:
+        with open(gold_file, "r", encoding="utf-8") as f:
+            return [item["question"] for item in json.load(f)][:n_queries]
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(passages), size=min(n_queries, len(passages)), replace=False)
+    return [passages[i]["text"][:300] for i in rows]
+
+def benchmark_config(embeddings: np.ndarray, query_vecs: np.ndarray, truth: np.ndarray, params: dict, k: int) -> dict:
+    """
+    Build one index configuration and measure it against the flat ground truth.
+    Latency is measured one query at a time, the way Retriever searches.
+    """
+    start = time.perf_counter()
+    index = build_index(embeddings, params)
+    build_s = time.perf_counter() - start
+
+    latencies = []
+    found = []
+    for q in query_vecs:
+        start = time.perf_counter()
+        _, I = index.search(q.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(I[0])
+
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+    return {
+        "params": params,
+        "recall_at_k": round(float(recall), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "memory_mb": round(index_memory_bytes(index) / 2**20, 2),
+        "build_s": round(build_s, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare FAISS index types: recall@k vs flat, query latency and memory")
+    parser.add_argument("--gold_file", type=str, default=None, help="Gold Q&A dataset (JSON) to take queries from.")
+    parser.add_argument("--passages_dir", type=str, default=PASSAGES_DIR, help="Passage directory (one subdirectory per course, or flat).")
+    parser.add_argument("--k", type=int, default=3, help="Top-k passages to retrieve.")
+    parser.add_argument("--n_queries", type=int, default=200, help="Number of queries to time.")
+    parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES), help="Index types to benchmark.")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64], help="IVF nprobe values to sweep.")
+    parser.add_argument("--ef_search", type=int, nargs="+", default=[16, 64, 256], help="HNSW efSearch values to sweep.")
+    parser.add_argument("--embeddings", type=str, default=None, help="Optional .npy cache of passage embeddings.")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    passages = load_passages(args.passages_dir)
+    if not passages:
+        raise SystemExit(f"No passages found in {args.passages_dir}. Run preprocess_passages.py first.")
+    model = SentenceTransformer(MODEL_NAME, device="cpu")
+    if args.embeddings:
+        try:
+            embeddings = np.load(args.embeddings)
+        except FileNotFoundError:
+            embeddings = model.encode([p["text"] for p in passages], convert_to_numpy=True, show_progress_bar=True)
+            np.save(args.embeddings, embeddings)
+    else:
+        embeddings = model.encode([p["text"] for p in passages], convert_to_numpy=True, show_progress_bar=True)
+    embeddings = embeddings.astype(np.float32)
+
+    queries = load_queries(args.gold_file, passages, args.n_queries)
+    query_vecs = model.encode(queries, convert_to_numpy=True).astype(np.float32)
+
+    # Ground truth: exact search over the same vectors
+    flat = build_index(embeddings, resolve_params("flat"))
+    _, truth = flat.search(query_vecs, args.k)
+
+    configs = []
+    for index_type in args.types:
+        if index_type in ("ivf_flat", "ivf_pq"):
+            configs += [resolve_params(index_type, {"nprobe": n}, len(embeddings)) for n in args.nprobe]
+        elif index_type == "hnsw":
+            configs += [resolve_params(index_type, {"efSearch": ef}) for ef in args.ef_search]
+        else:
+            configs.append(resolve_params(index_type))
+
+    results = []
+    print(f"\n📊 {len(passages)} passages, {len(queries)} queries, k={args.k}\n")
+    print(f"{'index':<44} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8} {'MB':>8} {'build s':>8}")
+    for params in configs:
+        r = benchmark_config(embeddings, query_vecs, truth, params, args.k)
+        results.append(r)
+        label = params["index_type"] + "".join(f" {key}={value}" for key, value in params.items() if key != "index_type")
+        print(f"{label:<44} {r['recall_at_k']:>9.3f} {r['p50_ms']:>8.3f} {r['p99_ms']:>8.3f} {r['memory_mb']:>8.2f} {r['build_s']:>8.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"k": args.k, "n_passages": len(passages), "n_queries": len(queries), "results": results}, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# benchmark_load.py
+
+import sys
+import time
+import json
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+import metrics
+from retrieval_utils import RETRIEVAL_MODES, Retriever
+from rag import RAGQA, TOP_K, BATCH_WAIT_MS
+from llm_backend import FakeBackend
+from scheduler import GenerationScheduler, SchedulerError
+
+TARGETS = ("retriever", "rag", "http")
+PERCENTILES = (50, 95, 99)
+REGRESSION_TOLERANCE = 0.10  # --compare fails when a p95 grows by more than this fraction
+
+def load_questions(gold_file: str) -> list:
+    with open(gold_file, "r", encoding="utf-8") as f:
+        return [item["question"] for item in json.load(f)]
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def retriever_target(retriever: Retriever, k: int, filters: dict = None):
+    def call(question: str) -> dict:
+        with metrics.breakdown() as timings:
+            with metrics.stage("total"):
+                retriever.get_top_k(question, k, filters=filters)
+        return timings
+    return call
+
+def rag_target(ragqa: RAGQA, k: int, filters: dict = None):
+    def call(question: str) -> dict:
+        with metrics.breakdown() as timings:
+            ragqa.generate_answer(question, k, filters)
+        return timings
+    return call
+
+def http_target(url: str, timeout: float, course: str = None):
+    local = threading.local()  # one keep-alive session per worker thread
+
+    def call(question: str) -> dict:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        body = {"question": question, "timings": True, **({"course": course} if course else {})}
+        response = local.session.post(url.rstrip("/") + "/api/ask", json=body, timeout=timeout)
+        response.raise_for_status()
+        result = response.json()
+        return {**result.get("timings", {}), "cached": result.get("cached", False)}
+    return call
+
+def server_cache_enabled(url: str, timeout: float) -> bool:
+    #Whether the server answers repeated questions from its caches (off when started with RAG_CACHE=0)
+    response = requests.get(url.rstrip("/") + "/api/cache/stats", timeout=timeout)
+    response.raise_for_status()
+    return response.json().get("enabled", True)
+
+def run_load(call, questions: list, n_requests: int, concurrency: int, rate: float = None, seed: int = 0) -> dict:
+    """
+    Replay questions (cycling through them) against call().
+    Without `rate` the load is closed-loop: `concurrency` workers each send the next
+    request as soon as the previous one returns. With `rate`, requests arrive as a
+    Poisson process of that many per second and up to `concurrency` run at once;
+    latency is then measured from the scheduled arrival, so time spent waiting for a
+    free worker counts (no coordinated omission).
+    Returns per-request client latencies, server-side stage timings and errors.
+    """
+    latencies, stage_samples, errors = [], [], []
+    lock = threading.Lock()
+
+    def one(i: int, arrival: float):
+        try:
+            timings = call(questions[i % len(questions)])
+        except (requests.RequestException, SchedulerError) as e:
+            with lock:
+                errors.append(type(e).__name__)
+            return
+        elapsed = (time.perf_counter() - arrival) * 1000
+        with lock:
+            latencies.append(elapsed)
+            stage_samples.append(timings or {})
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        if rate:
+            gaps = np.random.default_rng(seed).exponential(1 / rate, n_requests)
+            arrival = start
+            for i, gap in enumerate(gaps):
+                arrival += gap
+                delay = arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(one, i, arrival)
+        else:
+            counter = iter(range(n_requests))
+            next_lock = threading.Lock()
+
+            def worker():
+                while True:
+                    with next_lock:
+                        i = next(counter, None)
+                    if i is None:
+                        return
+                    one(i, time.perf_counter())
+            for _ in range(concurrency):
+                pool.submit(worker)
+    return {"latencies": latencies, "stages": stage_samples, "errors": errors, "wall_s": time.perf_counter() - start}
+
+def summarize(values: list) -> dict:
+    if not values:
+        return {}
+    summary = {f"p{p}_ms": round(float(np.percentile(values, p)), 3) for p in PERCENTILES}
+    summary["mean_ms"] = round(float(np.mean(values)), 3)
+    return summary
+
+def summarize_stages(samples: list) -> dict:
+    #Stage keys end in _ms (see metrics.py); decode_tokens_per_s is averaged separately
+    stages = {}
+    for timings in samples:
+        for key, value in timings.items():
+            if key.endswith("_ms"):
+                stages.setdefault(key[:-3], []).append(value)
+    result = {name: summarize(values) for name, values in sorted(stages.items())}
+    rates = [t["decode_tokens_per_s"] for t in samples if "decode_tokens_per_s" in t]
+    if rates:
+        result["decode_tokens_per_s"] = round(float(np.mean(rates)), 1)
+    return result
+
+def compare(results: dict, baseline_path: str, tolerance: float = REGRESSION_TOLERANCE) -> list:
+    """p95 latencies (end-to-end and per stage) that grew by more than `tolerance` over the baseline run."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    pairs = [("latency", baseline.get("latency", {}), results["latency"])]
+    pairs += [(name, baseline.get("stages", {}).get(name, {}), stats) for name, stats in results["stages"].items() if isinstance(stats, dict)]
+    regressions = []
+    for name, old, new in pairs:
+        if old.get("p95_ms") and new.get("p95_ms") and new["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append({"stage": name, "baseline_p95_ms": old["p95_ms"], "p95_ms": new["p95_ms"],
+                                "change": round(new["p95_ms"] / old["p95_ms"] - 1, 3)})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay gold questions under load and report throughput and per-stage latency")
+    parser.add_argument("gold_file", type=str, help="Gold Q&A dataset (JSON) to take questions from.")
+    parser.add_argument("--target", choices=TARGETS, default="rag", help="Retriever only, the full RAGQA pipeline, or a running server's /api/ask.")
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:5000", help="Server for --target http (start it with RAG_BACKEND=fake).")
+    parser.add_argument("--n_requests", type=int, default=200, help="Requests to send.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at once.")
+    parser.add_argument("--rate", type=float, default=None, help="Open-loop arrival rate in requests/s (default: closed loop).")
+    parser.add_argument("--k", type=int, default=TOP_K, help="Passages retrieved per question.")
+    parser.add_argument("--mode", choices=RETRIEVAL_MODES, default="dense", help="Retrieval mode.")
+    parser.add_argument("--course", type=str, default=None, help="Scope every question to this course (default: all courses).")
+    parser.add_argument("--gen_delay", type=float, default=0.0, help="Stub backend: seconds per answer before the first token.")
+    parser.add_argument("--token_delay", type=float, default=0.0, help="Stub backend: seconds per streamed word.")
+    parser.add_argument("--scheduler", action="store_true", help="rag target: run generation through a GenerationScheduler.")
+    parser.add_argument("--timeout", type=float, default=300, help="HTTP request timeout in seconds.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the arrival process.")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this path.")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline JSON from an earlier run; exit 1 on p95 regressions.")
+    args = parser.parse_args()
+
+    questions = load_questions(args.gold_file)
+    if args.target == "http":
+        call = http_target(args.url, args.timeout, args.course)
+        label = args.url
+        # The question list repeats, so with caches on most requests skip retrieval and generation
+        cache = server_cache_enabled(args.url, args.timeout)
+        if cache:
+            print("⚠️ The server's answer caches are on: repeated questions are served from them. "
+                  "Restart it with RAG_CACHE=0 to measure uncached latency.")
+    else:
+        # No query cache: repeated questions must pay for retrieval every time
+        cache = False
+        retriever = Retriever(mode=args.mode)
+        filters = {"course": args.course} if args.course else None
+        if args.target == "retriever":
+            call = retriever_target(retriever, args.k, filters)
+        else:
+            backend = FakeBackend(delay=args.gen_delay, token_delay=args.token_delay)
+            ragqa = RAGQA(retriever, backend=backend, batch_wait_ms=BATCH_WAIT_MS if args.concurrency > 1 else None,
+                          scheduler=GenerationScheduler() if args.scheduler else None)
+            call = rag_target(ragqa, args.k, filters)
+        label = f"{args.target} ({args.mode}{', ' + args.course if args.course else ''})"
+        call(questions[0])  # warm-up: model load, first FAISS search
+
+    load = "closed loop" if not args.rate else f"{args.rate:g} req/s"
+    print(f"\n📊 {label}: {args.n_requests} requests, concurrency {args.concurrency}, {load}\n")
+    run = run_load(call, questions, args.n_requests, args.concurrency, args.rate, args.seed)
+
+    results = {
+        "commit": git_commit(),
+        "target": args.target,
+        "mode": args.mode if args.target != "http" else None,
+        "n_requests": args.n_requests,
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "k": args.k,
+        "course": args.course,
+        "cache": cache,
+        "cached_responses": sum(bool(t.get("cached")) for t in run["stages"]),
+        "completed": len(run["latencies"]),
+        "errors": len(run["errors"]),
+        "throughput_rps": round(len(run["latencies"]) / run["wall_s"], 2),
+        "latency": summarize(run["latencies"]),
+        "stages": summarize_stages(run["stages"])
+    }
+
+    print(f"Throughput: {results['throughput_rps']} req/s ({results['completed']} ok, {results['errors']} errors, "
+          f"{results['cached_responses']} from cache)\n")
+    print(f"{'stage':<14} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'mean ms':>10}")
+    for name, s in [("end-to-end", results["latency"])] + list(results["stages"].items()):
+        if isinstance(s, dict) and s:
+            print(f"{name:<14} {s['p50_ms']:>10.2f} {s['p95_ms']:>10.2f} {s['p99_ms']:>10.2f} {s['mean_ms']:>10.2f}")
+    if "decode_tokens_per_s" in results["stages"]:
+        print(f"\nDecode: {results['stages']['decode_tokens_per_s']} tokens/s")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare)
+        for r in regressions:
+            print(f"⚠️ {r['stage']}: p95 {r['baseline_p95_ms']} -> {r['p95_ms']} ms (+{r['change']:.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"\nNo p95 regressions over {args.compare}")
+
+if __name__ == "__main__":
+    main()
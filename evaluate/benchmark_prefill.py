@@ -0,0 +1,83 @@
+# benchmark_prefill.py
+
+import time
+import json
+import argparse
+import numpy as np
+from retrieval_utils import Retriever
+from rag import PROMPT_PREFIX, RAGQA, TOP_K, render_prompt
+from llm_backend import BACKENDS, BACKEND_MODE, get_backend
+
+def truncated_prompt(query: str, passages: list) -> str:
+    """The previous prompt format: every passage cut to its first 200 characters."""
+    context_text = "\n\n".join([f"Passage {i+1}: {p['text'][:200]}..." for i, p in enumerate(passages)])
+    return render_prompt(context_text, query)
+
+def time_prefill(backend, prompt: str):
+    """
+    Milliseconds to process the prompt and produce one token, i.e. prefill plus a single
+    decode step. Also returns the backend's prefill stats (tokens saved by the prefix cache).
+    """
+    stats = {}
+    start = time.perf_counter()
+    backend.generate(prompt, max_tokens=1, stats=stats)
+    return (time.perf_counter() - start) * 1000, stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure prompt prefill latency against the context token budget")
+    parser.add_argument("gold_file", type=str, help="Gold Q&A dataset (JSON) to take questions from.")
+    parser.add_argument("--budgets", type=int, nargs="+", default=[128, 256, 384, 512, 768], help="Context token budgets to compare.")
+    parser.add_argument("--k", type=int, default=TOP_K, help="Passages retrieved per question.")
+    parser.add_argument("--n_queries", type=int, default=20, help="Questions timed per budget.")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=BACKEND_MODE, help="Generation backend.")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    with open(args.gold_file, "r", encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)][:args.n_queries]
+
+    retriever = Retriever()
+    backend = get_backend(args.backend)
+    ragqa = RAGQA(retriever, backend=backend)
+    retrieved = retriever.get_top_k_batch(questions, args.k)
+
+    # Warm-up so model load / first-request costs are not counted
+    time_prefill(backend, "Hello")
+    time_prefill(backend, PROMPT_PREFIX)
+
+    configs = [("truncate200", None)] + [(f"budget={b}", b) for b in args.budgets]
+    results = []
+    print(f"\n📊 {len(questions)} questions, k={args.k}, backend={backend.name}\n")
+    print(f"{'context':<14} {'prompt tokens':>14} {'saved':>7} {'p50 ms':>9} {'mean ms':>9} {'ms/token':>9}")
+    for label, budget in configs:
+        tokens, saved, latencies = [], [], []
+        for query, passages in zip(questions, retrieved):
+            if budget is None:
+                prompt = truncated_prompt(query, passages)
+                n_tokens = backend.count_tokens(prompt)
+            else:
+                ragqa.context_budget = budget
+                prompt, n_tokens = ragqa.build_prompt(query, passages)
+            ms, stats = time_prefill(backend, prompt)
+            tokens.append(n_tokens)
+            saved.append(stats.get("prefill_tokens_saved", 0))
+            latencies.append(ms)
+        r = {
+            "context": label,
+            "budget": budget,
+            "mean_prompt_tokens": round(float(np.mean(tokens)), 1),
+            "mean_tokens_saved": round(float(np.mean(saved)), 1),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+            "mean_ms": round(float(np.mean(latencies)), 1),
+            "ms_per_token": round(float(np.sum(latencies) / max(1, np.sum(tokens) - np.sum(saved))), 3)
+        }
+        results.append(r)
+        print(f"{label:<14} {r['mean_prompt_tokens']:>14.1f} {r['mean_tokens_saved']:>7.1f} {r['p50_ms']:>9.1f} {r['mean_ms']:>9.1f} {r['ms_per_token']:>9.3f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"k": args.k, "backend": backend.name, "n_queries": len(questions), "results": results}, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
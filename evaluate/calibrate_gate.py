@@ -0,0 +1,72 @@
+# calibrate_gate.py
+
+import json
+import argparse
+import numpy as np
+from retrieval_utils import Retriever
+from rag import TOP_K
+from confidence_gate import ANSWER_QUANTILE, GATE_FILE, MARGIN_QUANTILE, MIN_K, calibrate
+from evaluate_retrieval import BATCH_SIZE, load_gold
+
+def retrieve_all(retriever: Retriever, questions: list, k: int, batch_size: int = BATCH_SIZE) -> list:
+    results = []
+    for start in range(0, len(questions), batch_size):
+        results += retriever.get_top_k_batch(questions[start:start + batch_size], k=k)
+    return results
+
+def gate_report(gate, results: list, relevant: list) -> dict:
+    """Recall with the full k and with the gate's adaptive k, mean k, and share of questions gated."""
+    fixed = adaptive = gated = 0
+    kept = []
+    for retrieved, ids in zip(results, relevant):
+        decision = gate.decide(retrieved)
+        fixed += any(p["id"] in ids for p in retrieved)
+        if not decision["answer"]:
+            gated += 1
+            continue
+        kept.append(decision["k"])
+        adaptive += any(p["id"] in ids for p in retrieved[:decision["k"]])
+    n = max(1, len(results))
+    return {
+        "recall_fixed": round(fixed / n, 4),
+        "recall_adaptive": round(adaptive / n, 4),
+        "mean_k": round(float(np.mean(kept)), 2) if kept else 0.0,
+        "gated": round(gated / n, 4)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the retrieval confidence gate (no-answer threshold, adaptive k) on a gold dataset")
+    parser.add_argument("gold_file", type=str, help="Path to gold Q&A dataset (JSON).")
+    parser.add_argument("--k", type=int, default=TOP_K, help="Passages retrieved per question; the adaptive k never exceeds it.")
+    parser.add_argument("--answer_quantile", type=float, default=ANSWER_QUANTILE, help="Share of gold questions that must still be answered.")
+    parser.add_argument("--margin_quantile", type=float, default=MARGIN_QUANTILE, help="Share of retrieved relevant passages the adaptive k must keep.")
+    parser.add_argument("--min_k", type=int, default=MIN_K, help="Passages always kept for an answered question.")
+    parser.add_argument("--negatives", type=str, default=None, help="JSON list of off-topic questions (or gold-format items) to check the no-answer threshold on.")
+    parser.add_argument("--output", type=str, default=GATE_FILE, help="Where to write the gate (read by the web app and rag.py).")
+    args = parser.parse_args()
+
+    gold_data = load_gold(args.gold_file)
+    questions = [item["question"] for item in gold_data]
+    relevant = [set(item.get("relevant_ids", [])) for item in gold_data]
+
+    # Distances are only comparable in dense mode, which is what the gate is calibrated on
+    retriever = Retriever(mode="dense")
+    results = retrieve_all(retriever, questions, args.k)
+    gate = calibrate(results, relevant, args.answer_quantile, args.margin_quantile, args.min_k,
+                     retriever.model_name, retriever.encoder)
+    report = {"k": args.k, "n_questions": len(questions), **gate_report(gate, results, relevant)}
+
+    if args.negatives:
+        negatives = load_gold(args.negatives)
+        negatives = [item["question"] if isinstance(item, dict) else item for item in negatives]
+        decisions = [gate.decide(found) for found in retrieve_all(retriever, negatives, args.k)]
+        report["negatives_gated"] = round(sum(not d["answer"] for d in decisions) / max(1, len(decisions)), 4)
+
+    gate.save(args.output, **report)
+    print(f"\n📊 Gate calibrated on {len(questions)} questions, k={args.k}\n")
+    print(f"no-answer above distance {gate.max_distance}, keep passages within {gate.margin} of the best")
+    print(json.dumps(report, indent=2))
+    print(f"\nSaved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# check_encoder_parity.py
+
+import sys
+import time
+import json
+import argparse
+import numpy as np
+from retrieval_utils import Retriever
+from onnx_encoder import ONNX_DIR, load_encoder
+from evaluate_retrieval import evaluate_retrieval, load_gold
+
+MAX_RECALL_DROP = 0.01  # an ONNX encoder fails the check if recall@k falls by more than this
+LATENCY_QUERIES = 100  # single-query encodes timed per encoder
+
+def per_query_ms(model, questions: list) -> float:
+    """Mean latency of encoding one query at a time, the way the web app does."""
+    model.encode(questions[:1], convert_to_numpy=True)  # warm-up
+    start = time.perf_counter()
+    for q in questions:
+        model.encode([q], convert_to_numpy=True)
+    return (time.perf_counter() - start) * 1000 / max(1, len(questions))
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the ONNX (int8) query encoder keeps recall@k of the torch encoder")
+    parser.add_argument("gold_file", type=str, help="Path to gold Q&A dataset (JSON).")
+    parser.add_argument("--k", type=int, default=3, help="Top-k passages to retrieve.")
+    parser.add_argument("--encoders", nargs="+", choices=["onnx", "onnx-int8"], default=["onnx", "onnx-int8"], help="ONNX variants to compare against torch.")
+    parser.add_argument("--onnx_dir", type=str, default=ONNX_DIR, help="Directory written by onnx_encoder.py export.")
+    parser.add_argument("--max_drop", type=float, default=MAX_RECALL_DROP, help="Largest acceptable recall@k drop.")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    gold_data = load_gold(args.gold_file)
+    questions = [item["question"] for item in gold_data]
+    timed = questions[:LATENCY_QUERIES]
+
+    # One retriever (index, passage store) shared by all encoders; only the model is swapped
+    retriever = Retriever(encoder="torch")
+    reference_model = retriever.model
+    reference = reference_model.encode(questions, convert_to_numpy=True, normalize_embeddings=True)
+
+    results = []
+    for name in ["torch"] + args.encoders:
+        if name == "torch":
+            model, load_s = reference_model, None
+        else:
+            start = time.perf_counter()
+            model = load_encoder(retriever.model_name, name, args.onnx_dir)
+            load_s = time.perf_counter() - start
+        retriever.model, retriever.encoder = model, name
+        recall, _ = evaluate_retrieval(gold_data, retriever, k=args.k)
+        vecs = model.encode(questions, convert_to_numpy=True, normalize_embeddings=True)
+        cosine = np.sum(vecs * reference, axis=1)
+        results.append({
+            "encoder": name,
+            "recall_at_k": round(recall, 4),
+            "cosine_to_torch_mean": round(float(cosine.mean()), 5),
+            "cosine_to_torch_min": round(float(cosine.min()), 5),
+            "ms_per_query": round(per_query_ms(model, timed), 3),
+            "load_s": round(load_s, 2) if load_s is not None else None
+        })
+
+    baseline = results[0]["recall_at_k"]
+    print(f"\n📊 {len(gold_data)} questions, k={args.k}\n")
+    print(f"{'encoder':<10} {'recall@k':>9} {'cos mean':>9} {'cos min':>9} {'ms/query':>9} {'load s':>7}")
+    for r in results:
+        load = f"{r['load_s']:>7.2f}" if r["load_s"] is not None else f"{'-':>7}"
+        print(f"{r['encoder']:<10} {r['recall_at_k']:>9.3f} {r['cosine_to_torch_mean']:>9.4f} {r['cosine_to_torch_min']:>9.4f} {r['ms_per_query']:>9.2f} {load}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"k": args.k, "n_queries": len(gold_data), "results": results}, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+
+    failed = [r["encoder"] for r in results[1:] if baseline - r["recall_at_k"] > args.max_drop]
+    if failed:
+        print(f"\n⚠️ recall@{args.k} dropped by more than {args.max_drop} for: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"\nAll encoders within {args.max_drop} of torch recall@{args.k}")
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,18 @@
 # evaluate_rag.py
 
+import os
 import json
 import argparse
-from sentence_transformers import SentenceTransformer, util
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 from retrieval_utils import Retriever
-from rag import RAGQA   # <-- uses your existing local rag.py pipeline
+from rag import RAGQA, BATCH_WAIT_MS   # <-- uses your existing local rag.py pipeline
+from llm_backend import BACKENDS, BACKEND_MODE, get_backend
+from confidence_gate import GATE_FILE, ConfidenceGate
 
-# Load semantic similarity model once
-sim_model = SentenceTransformer("all-MiniLM-L6-v2")
+NUM_WORKERS = 4  # questions generated concurrently
+SIM_BATCH_SIZE = 64  # answers per forward pass when scoring
 
 def load_gold(path: str):
     """
@@ -18,59 +23,150 @@ def load_gold(path: str):
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def score_answer(gold_answer: str, generated_answer: str) -> float:
+def run_config(ragqa: RAGQA) -> dict:
+    """What the answers depend on besides question and k; checkpoint records from another configuration are not reused."""
+    gate = ragqa.gate
+    return {"backend": ragqa.backend.name,
+            "gate": None if gate is None else {"max_distance": gate.max_distance, "margin": gate.margin, "min_k": gate.min_k}}
+
+def load_checkpoint(path: str, config: dict = None) -> dict:
+    """
+    Results already written by an earlier (possibly interrupted) run with the same
+    config, keyed by (question, k). Records of other configurations are skipped.
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    skipped = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # last line cut short by the interruption
+            if config is not None and record.get("config") != config:
+                skipped += 1
+                continue
+            done[(record["question"], record["k"])] = record
+    if skipped:
+        print(f"Skipped {skipped} answers in {path} generated with a different configuration than {json.dumps(config)}")
+    return done
+
+def score_answers(model, gold_answers: list, generated_answers: list, batch_size: int = SIM_BATCH_SIZE) -> np.ndarray:
+    """
+    Semantic similarity of each gold / generated answer pair, in [-1, 1].
+    All answers are encoded together in one batched pass.
+    """
+    if not gold_answers:
+        return np.zeros(0)
+    emb = model.encode(gold_answers + generated_answers, convert_to_numpy=True, batch_size=batch_size, normalize_embeddings=True)
+    n = len(gold_answers)
+    return np.sum(emb[:n] * emb[n:], axis=1)
+
+def score_answer(model, gold_answer: str, generated_answer: str) -> float:
     """
     Compute semantic similarity between gold and generated answers.
     Returns cosine similarity in [0,1].
     """
-    emb_gold = sim_model.encode(gold_answer, convert_to_tensor=True)
-    emb_gen = sim_model.encode(generated_answer, convert_to_tensor=True)
-    sim = util.cos_sim(emb_gold, emb_gen).item()
-    return sim
-
-def evaluate_rag(gold_data, ragqa: RAGQA, k: int = 3):
-    results = []
-    sims = []
-
-    for item in gold_data:
-        q = item["question"]
-        gold_ans = item["answer"]
+    return float(score_answers(model, [gold_answer], [generated_answer])[0])
 
-        # Run your local RAG pipeline
-        result = ragqa.generate_answer(q, k=k)
-        gen_ans = result["answer"]
+def generate_all(gold_data, ragqa: RAGQA, k: int, checkpoint: str, workers: int = NUM_WORKERS) -> dict:
+    """
+    Generate answers for every gold question not already in the checkpoint, `workers`
+    at a time. Each finished answer is appended to the checkpoint file right away, so
+    an interrupted run resumes where it stopped. Failed generations are not written and
+    are retried on the next run. Returns all records keyed by (question, k).
+    """
+    config = run_config(ragqa)
+    done = load_checkpoint(checkpoint, config)
+    todo = list(dict.fromkeys(item["question"] for item in gold_data if (item["question"], k) not in done))
+    print(f"{len(done)} answers loaded from {checkpoint}, {len(todo)} to generate")
+    if not todo:
+        return done
+
+    lock = threading.Lock()
+    failed = 0
+    with open(checkpoint, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(ragqa.generate_answer, q, k): q for q in todo}
+        for n, future in enumerate(as_completed(futures), 1):
+            q = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Failed on '{q}': {e}")  # left out of the checkpoint, retried on the next run
+                failed += 1
+                continue
+            if result.get("failed"):
+                print(f"Generation failed on '{q}'")  # the backend errored; retried on the next run
+                failed += 1
+                continue
+            record = {
+                "question": q,
+                "k": k,
+                "config": config,
+                "generated_answer": result["answer"],
+                "retrieved_ids": [s["id"] for s in result["sources"]],
+                "gate": result.get("gate")
+            }
+            with lock:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                done[(q, k)] = record
+            print(f"[{n}/{len(todo)}] {q}")
+    if failed:
+        print(f"{failed} of {len(todo)} questions failed; rerun to retry them")
+    return done
+
+def evaluate_rag(gold_data, ragqa: RAGQA, k: int = 3, checkpoint: str = None, workers: int = NUM_WORKERS):
+    """
+    Generate (or resume) answers for the gold set and score them against the gold
+    answers with the retriever's own embedding model.
+    """
+    checkpoint = checkpoint or "rag_eval.checkpoint.jsonl"
+    done = generate_all(gold_data, ragqa, k, checkpoint, workers)
 
-        sim = score_answer(gold_ans, gen_ans)
-        sims.append(sim)
+    items = [item for item in gold_data if (item["question"], k) in done]
+    generated = [done[(item["question"], k)] for item in items]
+    sims = score_answers(ragqa.retriever.model, [item["answer"] for item in items], [g["generated_answer"] for g in generated])
 
+    results = []
+    for item, gen, sim in zip(items, generated, sims):
         results.append({
-            "question": q,
-            "gold_answer": gold_ans,
-            "generated_answer": gen_ans,
-            "similarity": round(sim, 3),
-            "retrieved_ids": [s["id"] for s in result["sources"]]
+            "question": item["question"],
+            "gold_answer": item["answer"],
+            "generated_answer": gen["generated_answer"],
+            "similarity": round(float(sim), 3),
+            "retrieved_ids": gen["retrieved_ids"]
         })
 
-    avg_sim = sum(sims) / len(sims) if sims else 0.0
+    avg_sim = float(np.mean(sims)) if len(sims) else 0.0
     return avg_sim, results
 
 def main():
     parser = argparse.ArgumentParser(description="Evaluate local RAG (llamafile) answers vs gold dataset")
     parser.add_argument("gold_file", type=str, help="Path to gold Q&A dataset (JSON).")
     parser.add_argument("--k", type=int, default=3, help="Top-k passages to retrieve.")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=BACKEND_MODE, help="Generation backend (cli, server or fake).")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="Questions generated concurrently.")
+    parser.add_argument("--gate", nargs="?", const=GATE_FILE, default=None, help="Use the confidence gate calibrated by calibrate_gate.py (optionally its path).")
+    parser.add_argument("--checkpoint", type=str, default=None, help="JSONL file answers are appended to; a rerun skips questions already in it (default: <gold_file>.answers.jsonl).")
     args = parser.parse_args()
 
-    # Init retriever + RAG pipeline
+    # Init retriever + RAG pipeline; concurrent retrievals are micro-batched
     retriever = Retriever()
-    ragqa = RAGQA(retriever)
+    gate = ConfidenceGate.load(args.gate) if args.gate else None
+    if args.gate and gate is None:
+        print(f"No gate found at {args.gate}; run evaluate/calibrate_gate.py first")
+    ragqa = RAGQA(retriever, backend=get_backend(args.backend), batch_wait_ms=BATCH_WAIT_MS if args.workers > 1 else None, gate=gate)
 
     # Load gold dataset
     gold_data = load_gold(args.gold_file)
 
     # Run evaluation
-    avg_sim, results = evaluate_rag(gold_data, ragqa, k=args.k)
+    checkpoint = args.checkpoint or os.path.splitext(args.gold_file)[0] + ".answers.jsonl"
+    avg_sim, results = evaluate_rag(gold_data, ragqa, k=args.k, checkpoint=checkpoint, workers=args.workers)
 
-    print(f"\n📊 Average Semantic Similarity: {avg_sim:.3f}\n")
+    print(f"\n📊 Average Semantic Similarity: {avg_sim:.3f} ({len(results)} of {len(gold_data)} questions)\n")
 
     for r in results:
         print(f"Q: {r['question']}")
@@ -80,5 +176,9 @@ def main():
         print(f"Retrieved IDs: {r['retrieved_ids']}")
         print("---")
 
+    if ragqa.gate is not None:
+        # Counts cover this run's generations only, not answers loaded from the checkpoint
+        print(f"Gate: {json.dumps(ragqa.gate.stats())}")
+
 if __name__ == "__main__":
     main()
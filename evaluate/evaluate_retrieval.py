@@ -1,8 +1,11 @@
 # evaluate_retrieval.py
 
 import json
+import time
 import argparse
-from retrieval_utils import Retriever
+from retrieval_utils import RETRIEVAL_MODES, Retriever
+
+BATCH_SIZE = 256  # questions per embedding pass / FAISS search
 
 def load_gold(path: str):
     """
@@ -15,20 +18,26 @@ def load_gold(path: str):
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def evaluate_retrieval(gold_data, retriever, k: int = 3):
+def evaluate_retrieval(gold_data, retriever, k: int = 3, batch_size: int = BATCH_SIZE, mode: str = None):
     """
     For each gold question, retrieve top-k passages and check if
     any relevant_ids appear in retrieved results.
+    Questions are embedded and searched batch_size at a time.
+    mode ("dense", "lexical" or "hybrid") overrides the retriever's own.
     Returns recall@k and detailed results.
     """
     total = len(gold_data)
     hits = 0
     detailed_results = []
 
-    for item in gold_data:
+    questions = [item["question"] for item in gold_data]
+    retrieved_lists = []
+    for start in range(0, total, batch_size):
+        retrieved_lists += retriever.get_top_k_batch(questions[start:start + batch_size], k=k, mode=mode)
+
+    for item, retrieved in zip(gold_data, retrieved_lists):
         q = item["question"]
         relevant_ids = set(item.get("relevant_ids", []))
-        retrieved = retriever.get_top_k(q, k=k)
         retrieved_ids = {r["id"] for r in retrieved}
 
         hit = len(relevant_ids & retrieved_ids) > 0
@@ -49,25 +58,38 @@ def main():
     parser = argparse.ArgumentParser(description="Evaluate FAISS retrieval using gold dataset")
     parser.add_argument("gold_file", type=str, help="Path to gold Q&A dataset (JSON).")
     parser.add_argument("--k", type=int, default=3, help="Top-k passages to retrieve.")
+    parser.add_argument("--batch_size", type=int, default=BATCH_SIZE, help="Questions embedded and searched per batch.")
+    parser.add_argument("--modes", nargs="+", choices=RETRIEVAL_MODES, default=["dense"], help="Retrieval modes to compare.")
     args = parser.parse_args()
 
     # Load dataset
     gold_data = load_gold(args.gold_file)
 
-    # Init retriever
-    retriever = Retriever()
+    # Init retriever (lexical modes need the BM25 index built by knowledge_base.py)
+    retriever = Retriever(mode="dense" if args.modes == ["dense"] else "hybrid")
 
     # Run evaluation
-    recall, details = evaluate_retrieval(gold_data, retriever, k=args.k)
+    summary = []
+    for mode in args.modes:
+        start = time.perf_counter()
+        recall, details = evaluate_retrieval(gold_data, retriever, k=args.k, batch_size=args.batch_size, mode=mode)
+        ms_per_query = (time.perf_counter() - start) * 1000 / max(1, len(gold_data))
+        summary.append((mode, recall, ms_per_query))
 
-    print(f"\n📊 Recall@{args.k}: {recall:.2f} ({int(recall*100)}%)\n")
+    if len(args.modes) == 1:
+        print(f"\n📊 Recall@{args.k}: {recall:.2f} ({int(recall*100)}%)\n")
 
-    for d in details:
-        print(f"Q: {d['question']}")
-        print(f"Relevant: {d['relevant_ids']}")
-        print(f"Retrieved: {d['retrieved_ids']}")
-        print(f"Hit: {d['hit']}")
-        print("---")
+        for d in details:
+            print(f"Q: {d['question']}")
+            print(f"Relevant: {d['relevant_ids']}")
+            print(f"Retrieved: {d['retrieved_ids']}")
+            print(f"Hit: {d['hit']}")
+            print("---")
+    else:
+        print(f"\n📊 {len(gold_data)} questions, k={args.k}\n")
+        print(f"{'mode':<10} {'recall@k':>9} {'ms/query':>9}")
+        for mode, recall, ms_per_query in summary:
+            print(f"{mode:<10} {recall:>9.3f} {ms_per_query:>9.2f}")
 
 if __name__ == "__main__":
     main()
@@ -42,24 +42,67 @@ sendBtn.addEventListener("click", (e) => {
   addMessage(text, "user");
   chatInput.value = "";
 
-  //Send to backend
-  fetch('/api/ask', {
-    method: 'POST',
-    headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ question: text})
-  })
-  .then(response => response.json())
-  .then(data => {
-    if (data.error) {
-      addMessage("Error: " + data.error, "bot");
-    } else {
-      addMessage(data.answer, "bot");
-      // addMessage(`Retrieved ${data.retrieval_count} passages.`, "bot");
-    }
-  })
-  .catch(error => addMessage("Error: Failed to get response.", "bot"));
+  //Send to backend, streaming tokens into the bot message as they arrive
+  askStreaming(text);
 });
 
+// Stream an answer from /api/ask_stream (server-sent events)
+async function askStreaming(question) {
+  const msg = document.createElement("div");
+  msg.classList.add("message", "bot");
+  chatContainer.appendChild(msg);
+
+  const finish = (text) => {
+    msg.innerText = text;
+    chatContainer.scrollTop = chatContainer.scrollHeight;
+    currentChat.push({ text, type: "bot" });
+  };
+
+  try {
+    const response = await fetch('/api/ask_stream', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ question: question })
+    });
+    if (!response.ok) {
+      const data = await response.json();
+      finish("Error: " + (data.error || "Failed to get response."));
+      return;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      // Events are separated by a blank line
+      let sep;
+      while ((sep = buffer.indexOf("\n\n")) >= 0) {
+        const line = buffer.slice(0, sep).trim();
+        buffer = buffer.slice(sep + 2);
+        if (!line.startsWith("data: ")) continue;
+        const event = JSON.parse(line.slice(6));
+        if (event.type === "token") {
+          msg.innerText += event.text;
+          chatContainer.scrollTop = chatContainer.scrollHeight;
+        } else if (event.type === "done") {
+          finish(event.answer);  // replace the raw stream with the cleaned-up answer
+          return;
+        } else if (event.type === "error") {
+          finish("Error: " + event.error);
+          return;
+        }
+      }
+    }
+    finish(msg.innerText || "Error: Failed to get response.");
+  } catch (error) {
+    finish("Error: Failed to get response.");
+  }
+}
+
 // New Chat
 newChatBtn.addEventListener("click", () => {
   if (currentChat.length > 0) {
@@ -0,0 +1,131 @@
+import os
+import sys
+import time
+import shutil
+import threading
+
+CURRENT_FILE = "CURRENT"  # name of the live version, replaced atomically when a build is published
+VERSIONS_DIRNAME = "versions"  # one complete index per version: <index_dir>/versions/<version>
+BUILDING_FILE = ".building"  # marks a version directory whose build has not finished
+KEEP_VERSIONS = 3  # published versions kept on disk: the current one and earlier ones to roll back to
+WATCH_INTERVAL = float(os.environ.get('RAG_INDEX_WATCH', 10))  # seconds between checks for a new version; 0 disables
+
+# Layout: builds write to versions/<version>/ (a single index or course shards, see knowledge_base.py)
+# and CURRENT is switched to the new name only once the build is complete. Readers resolve
+# CURRENT once per load, so they never see a half-written index. Without a CURRENT file the
+# index directory itself holds an unversioned index, as built before versions existed.
+
+def current_version(index_dir: str):
+    path = os.path.join(index_dir, CURRENT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().strip() or None
+
+def resolve_index(index_dir: str) -> tuple:
+    """(directory holding the live index, its version name or None when unversioned)."""
+    version = current_version(index_dir)
+    if version is None:
+        return index_dir, None
+    return os.path.join(index_dir, VERSIONS_DIRNAME, version), version
+
+def list_versions(index_dir: str, building: bool = False) -> list:
+    """Version names, oldest first; published ones only unless building=True."""
+    versions_dir = os.path.join(index_dir, VERSIONS_DIRNAME)
+    if not os.path.isdir(versions_dir):
+        return []
+    return sorted(name for name in os.listdir(versions_dir)
+                  if os.path.isdir(os.path.join(versions_dir, name))
+                  and os.path.exists(os.path.join(versions_dir, name, BUILDING_FILE)) == building)
+
+def start_version(index_dir: str, resume: bool = True) -> tuple:
+    """
+    Directory for a new build: (version, path). With resume, an unfinished build is
+    picked up again (its embedding shards are reused); otherwise unfinished builds are removed.
+    """
+    versions_dir = os.path.join(index_dir, VERSIONS_DIRNAME)
+    unfinished = list_versions(index_dir, building=True)
+    if resume and unfinished:
+        return unfinished[-1], os.path.join(versions_dir, unfinished[-1])
+    for name in unfinished:
+        shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+    version = base = time.strftime("%Y%m%d-%H%M%S")
+    n = 0
+    while os.path.exists(os.path.join(versions_dir, version)):
+        n += 1
+        version = f"{base}-{n}"
+    path = os.path.join(versions_dir, version)
+    os.makedirs(path)
+    open(os.path.join(path, BUILDING_FILE), "w").close()
+    return version, path
+
+def publish_version(index_dir: str, version: str):
+    """Make a finished version the live one: CURRENT is replaced in one atomic rename."""
+    path = os.path.join(index_dir, VERSIONS_DIRNAME, version)
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"Index version {version} not found in {os.path.join(index_dir, VERSIONS_DIRNAME)}")
+    marker = os.path.join(path, BUILDING_FILE)
+    if os.path.exists(marker):
+        os.remove(marker)
+    pointer = os.path.join(index_dir, CURRENT_FILE)
+    with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+    os.replace(pointer + ".tmp", pointer)
+
+def prune_versions(index_dir: str, keep: int = KEEP_VERSIONS) -> list:
+    """
+    Delete published versions older than the newest `keep`, never the current one.
+    A server still on a removed version keeps working from memory until its next reload.
+    """
+    current = current_version(index_dir)
+    removed = []
+    for name in list_versions(index_dir)[:-keep or None]:
+        if name != current:
+            shutil.rmtree(os.path.join(index_dir, VERSIONS_DIRNAME, name), ignore_errors=True)
+            removed.append(name)
+    return removed
+
+
+class IndexWatcher:
+    """
+    Background thread that calls reload() every `interval` seconds; reload is expected to
+    be cheap when nothing changed (Retriever.reload only compares the CURRENT pointer).
+    """
+    def __init__(self, reload, interval: float = WATCH_INTERVAL):
+        self.reload = reload
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="index-watcher", daemon=True)
+
+    def start(self):
+        if self.interval > 0:
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.reload()
+            except Exception as e:
+                print(f"Index reload failed: {e}")  # keep serving the loaded version
+
+    def stop(self):
+        self._stop.set()
+
+if __name__ == "__main__":
+    # Usage: python index_versions.py list | use <version> [index_dir]
+    # `use` points CURRENT at an earlier version (rollback); running servers pick it up on their next reload.
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "use":
+        index_dir = sys.argv[3] if len(sys.argv) > 3 else "data/index"
+        if sys.argv[2] in list_versions(index_dir, building=True):
+            sys.exit(f"Index version {sys.argv[2]} is an unfinished build")
+        publish_version(index_dir, sys.argv[2])
+        print(f"CURRENT -> {sys.argv[2]}")
+    else:
+        index_dir = sys.argv[2] if len(sys.argv) > 2 else "data/index"
+        current = current_version(index_dir)
+        for name in list_versions(index_dir):
+            print(f"{'*' if name == current else ' '} {name}")
+        for name in list_versions(index_dir, building=True):
+            print(f"  {name} (unfinished)")
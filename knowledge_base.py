@@ -1,52 +1,323 @@
 import os
 import json
+import shutil
+import hashlib
+import argparse
 import numpy as np
 from sentence_transformers import SentenceTransformer
 import faiss
+from passage_store import STORE_DIRNAME, PassageStore, PassageStoreWriter, mark_deleted
+from ann_index import INDEX_TYPES, SEARCH_PARAMS, apply_search_params, load_params, make_index, resolve_params, save_params, supports_removal, with_ids
+from lexical_index import build_lexical_index, lexical_index_exists
+from embedding_pipeline import BATCH_SIZE, NUM_WORKERS, SHARD_DIRNAME, encode_to_shards, iter_shards, remove_shards
+from course_shards import COURSES_DIRNAME, MANIFEST_FILE, load_shards, save_shards
+from index_versions import CURRENT_FILE, VERSIONS_DIRNAME, prune_versions, publish_version, resolve_index, start_version
 
 PASSAGES_DIR = "data/passages"
 INDEX_DIR = "data/index"
 MODEL_NAME = 'all-MiniLM-L6-V2'
+INDEX_TYPE = "flat"  # for new builds; incremental builds keep the type of the existing index unless one is given
+TRAIN_SAMPLE = 100000  # vectors used to train IVF / SQ8 quantizers
+PASSAGE_EXTENSIONS = (".jsonl", ".json")  # JSONL from preprocess_passages.py; JSON lists from earlier versions
+
+def passage_files(passages_dir: str = PASSAGES_DIR) -> list:
+    #Passage filenames (JSONL or JSON) in a stable order, so rows are assigned the same way on every build
+    return sorted(f for f in os.listdir(passages_dir) if f.endswith(PASSAGE_EXTENSIONS))
+
+def course_dirs(passages_dir: str = PASSAGES_DIR) -> list:
+    #Course subdirectories written by preprocess_passages.py; empty for a flat, single-index layout
+    return sorted(name for name in os.listdir(passages_dir)
+                  if os.path.isdir(os.path.join(passages_dir, name)) and passage_files(os.path.join(passages_dir, name)))
+
+def load_passage_file(filepath: str) -> list:
+    with open(filepath, "r", encoding="utf-8") as f:
+        if filepath.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+def iter_passages(passages_dir: str = PASSAGES_DIR, files: dict = None):
+    #Yields passages one file at a time. When `files` is given, the manifest entry
+    #(file hash, per-passage hashes and rows) of each file is recorded into it.
+    row = 0
+    for filename in passage_files(passages_dir):
+        filepath = os.path.join(passages_dir, filename)
+        data = load_passage_file(filepath)
+        if files is not None:
+            files[filename] = {"hash": file_hash(filepath), "passages": [[passage_hash(p), row + i] for i, p in enumerate(data)]}
+        row += len(data)
+        yield from data
 
 def load_passages(passages_dir: str = PASSAGES_DIR) -> list:
-    #Loads all JSON passage files and returns a list of dicts {id, text}.
-    passages = []
-    for filename in os.listdir(passages_dir):
-        if filename.endswith(".json"):
-            filepath = os.path.join(passages_dir, filename)
-            with open(filepath, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                passages.extend(data)
+    #Loads all passage files, of every course directory (or of a flat directory), and returns a list of dicts {id, text}.
+    dirs = [os.path.join(passages_dir, course) for course in course_dirs(passages_dir)] or [passages_dir]
+    passages = [passage for directory in dirs for passage in iter_passages(directory)]
     print(f'Loaded {len(passages)} passages')
     return passages
 
-def build_faiss_index(passages: list, model_name: str = MODEL_NAME, out_dir: str = INDEX_DIR):
-    #Creates embeddings for passages and stores them in FAISS index. 
-    #Saves both the index and the ID -> text mapping
+def file_hash(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def passage_hash(passage: dict) -> str:
+    return hashlib.sha1(json.dumps(passage, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def load_manifest(out_dir: str = INDEX_DIR):
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(out_dir: str, manifest: dict):
+    #Written last and atomically: a crash mid-update leaves the previous manifest in place
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+def write_index(index: faiss.Index, out_dir: str):
+    path = os.path.join(out_dir, "kb.index")
+    faiss.write_index(index, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+def write_lexical_index(out_dir: str):
+    #BM25 inverted index over the live rows of the passage store, for lexical and hybrid retrieval.
+    #Rebuilt whole on every change: it needs no embeddings and its idf / length statistics are global.
+    store = PassageStore(os.path.join(out_dir, STORE_DIRNAME))
+    try:
+        build_lexical_index(store, out_dir)
+    finally:
+        store.close()
+
+def index_from_shards(shard_paths: list, index_type: str = INDEX_TYPE, index_params: dict = None):
+    #Trains the index (if its type needs it) on a sample drawn evenly from all shards,
+    #then adds the shards one at a time from memory maps. Row ids follow shard order.
+    n_vectors = sum(len(shard) for shard in iter_shards(shard_paths))
+    params = resolve_params(index_type, index_params, n_vectors=n_vectors)
+    dim = next(iter_shards(shard_paths)).shape[1]
+    index = make_index(dim, params)
+
+    if not index.is_trained:
+        per_shard = max(1, TRAIN_SAMPLE // len(shard_paths))
+        sample = np.concatenate([np.asarray(shard[:per_shard], dtype=np.float32) for shard in iter_shards(shard_paths)])
+        index.train(sample)
+
+    index = with_ids(index, params)
+    row = 0
+    for shard in iter_shards(shard_paths):
+        index.add_with_ids(np.ascontiguousarray(shard, dtype=np.float32), np.arange(row, row + len(shard), dtype=np.int64))
+        row += len(shard)
+    apply_search_params(index, params)
+    return index, params
+
+def build_faiss_index(passages, model_name: str = MODEL_NAME, out_dir: str = INDEX_DIR,
+                      index_type: str = INDEX_TYPE, index_params: dict = None,
+                      batch_size: int = BATCH_SIZE, workers: int = NUM_WORKERS):
+    #Creates embeddings for passages (any iterable, consumed as a stream) and stores them in FAISS index.
+    #Saves the index, its build/search parameters and the row -> passage store.
+    #Embeddings go to on-disk shards first, so an interrupted build resumes where it stopped.
     os.makedirs(out_dir, exist_ok=True)
+    shard_dir = os.path.join(out_dir, SHARD_DIRNAME)
+
+    #Embed in batches across worker processes; passages are written to the store as they stream past
+    with PassageStoreWriter(os.path.join(out_dir, STORE_DIRNAME)) as writer:
+        shard_paths = encode_to_shards(passages, shard_dir, model_name, batch_size, workers,
+                                       on_batch=lambda batch: [writer.add(p) for p in batch])
+    if not shard_paths:
+        raise ValueError("No passages to index")
+    print(f'Embedded {writer.count} passages')
 
-    #Load Model
-    model = SentenceTransformer(model_name)
+    #FAISS index (flat, IVF, HNSW or scalar-quantized; see ann_index.py), id-mapped so
+    #incremental builds can add and remove passages by store row
+    index, params = index_from_shards(shard_paths, index_type, index_params)
 
-    #Complete embeddings
-    texts = [p["text"] for p in passages]
-    embeddings = model.encode(texts, convert_to_numpy=True, show_progress_bar = True)
+    #Save Index and the parameters Retriever needs to search it the same way
+    write_index(index, out_dir)
+    save_params(out_dir, params)
+    remove_shards(shard_dir)
+    write_lexical_index(out_dir)
 
-    #FAISS index
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)
+    print(f'Saved FAISS index and passage store to {out_dir}')
 
-    #Save Index
-    faiss.write_index(index, os.path.join(out_dir, "kb.index"))
+def build_index_dir(passages_dir: str = PASSAGES_DIR, model_name: str = MODEL_NAME, out_dir: str = INDEX_DIR,
+                    index_type: str = None, index_params: dict = None,
+                    batch_size: int = BATCH_SIZE, workers: int = NUM_WORKERS):
+    #Full build of one index directory: embeds every passage and records a manifest of per-file and per-passage hashes
+    files = {}
+    build_faiss_index(iter_passages(passages_dir, files), model_name, out_dir, index_type or INDEX_TYPE, index_params, batch_size, workers)
+    save_manifest(out_dir, {"model_name": model_name, "index_params": load_params(out_dir), "files": files})
 
-    #Save Mapping
-    mapping = {i: passages[i] for i in range(len(passages))}
-    with open(os.path.join(out_dir, "mapping.json"), "w", encoding='utf-8') as f:
-        json.dump(mapping, f, indent=2, ensure_ascii=False)
+def update_index_dir(passages_dir: str = PASSAGES_DIR, model_name: str = MODEL_NAME, out_dir: str = INDEX_DIR,
+                     index_type: str = None, index_params: dict = None,
+                     batch_size: int = BATCH_SIZE, workers: int = NUM_WORKERS):
+    """
+    Incremental build of one index directory: only passages that are new or changed
+    since the last build are embedded. Passages from deleted or edited files are removed from the index by id,
+    and new passages are appended to the passage store. Falls back to a full build
+    when there is no manifest or the model/index settings changed. index_type None keeps the
+    type of the built index; index_params only changing search-time knobs (nprobe, efSearch)
+    are applied without a rebuild.
+    Untrained index types (flat, fp16) give exactly the results of a full build; trained
+    ones (IVF, SQ8) keep the quantizer from the last full build until the next one.
+    """
+    manifest = load_manifest(out_dir)
+    if manifest is None or manifest["model_name"] != model_name:
+        print("No compatible manifest found, running a full build")
+        return build_index_dir(passages_dir, model_name, out_dir, index_type, index_params, batch_size, workers)
+    params = manifest["index_params"]
+    changed = {key: value for key, value in (index_params or {}).items()
+               if value is not None and key in params and params[key] != value}
+    if index_type not in (None, params["index_type"]) or any(key not in SEARCH_PARAMS for key in changed) or not supports_removal(params):
+        print(f"Index type or build parameters changed, or '{params['index_type']}' does not support removal, running a full build")
+        if index_type in (None, params["index_type"]):
+            #Same type: rebuild with the existing parameters, updated by the ones given
+            index_params = {**{key: value for key, value in params.items() if key != "index_type"},
+                            **{key: value for key, value in (index_params or {}).items() if value is not None}}
+        return build_index_dir(passages_dir, model_name, out_dir, index_type or params["index_type"], index_params, batch_size, workers)
+    params = {**params, **changed}
+    if "nlist" in params:
+        params["nprobe"] = min(params["nprobe"], params["nlist"])
 
-    print(f'Saved FAISS index and mapping to {out_dir}')
+    old_files = manifest["files"]
+    files = {}
+    removed_rows = []
+    new_passages = []  # (filename, position in file, passage)
+    current = passage_files(passages_dir)
+
+    for filename in set(old_files) - set(current):
+        removed_rows += [row for _, row in old_files[filename]["passages"]]
+
+    for filename in current:
+        filepath = os.path.join(passages_dir, filename)
+        digest = file_hash(filepath)
+        old = old_files.get(filename)
+        if old is not None and old["hash"] == digest:
+            files[filename] = old
+            continue
+
+        #Changed or new file: keep rows whose passage is unchanged, embed the rest
+        reusable = {}
+        for h, row in (old["passages"] if old else []):
+            reusable.setdefault(h, []).append(row)
+        entries = []
+        for position, passage in enumerate(load_passage_file(filepath)):
+            h = passage_hash(passage)
+            if reusable.get(h):
+                entries.append([h, reusable[h].pop(0)])
+            else:
+                entries.append([h, None])
+                new_passages.append((filename, position, passage))
+        removed_rows += [row for rows in reusable.values() for row in rows]
+        files[filename] = {"hash": digest, "passages": entries}
+
+    if not new_passages and not removed_rows:
+        if not lexical_index_exists(out_dir):
+            write_lexical_index(out_dir)  # built before the lexical index existed
+        print("Knowledge base is up to date")
+        return
+
+    index = faiss.read_index(os.path.join(out_dir, "kb.index"))
+    store_dir = os.path.join(out_dir, STORE_DIRNAME)
+
+    if new_passages:
+        model = SentenceTransformer(model_name)
+        embeddings = model.encode([p["text"] for _, _, p in new_passages], convert_to_numpy=True, show_progress_bar=True, batch_size=batch_size)
+        with PassageStoreWriter(store_dir, append=True) as writer:
+            rows = [writer.add(p) for _, _, p in new_passages]
+        index.add_with_ids(np.ascontiguousarray(embeddings, dtype=np.float32), np.asarray(rows, dtype=np.int64))
+        for (filename, position, _), row in zip(new_passages, rows):
+            files[filename]["passages"][position][1] = row
+
+    if removed_rows:
+        index.remove_ids(np.asarray(removed_rows, dtype=np.int64))
+        mark_deleted(store_dir, removed_rows)
+
+    apply_search_params(index, params)
+    write_index(index, out_dir)
+    write_lexical_index(out_dir)
+    save_manifest(out_dir, {"model_name": model_name, "index_params": params, "files": files})
+    print(f'Embedded {len(new_passages)} new passages, removed {len(removed_rows)}; index now holds {index.ntotal} vectors')
+
+def build_knowledge_base(passages_dir: str = PASSAGES_DIR, model_name: str = MODEL_NAME, out_dir: str = INDEX_DIR,
+                         index_type: str = None, index_params: dict = None,
+                         batch_size: int = BATCH_SIZE, workers: int = NUM_WORKERS, update: bool = False):
+    """
+    Build the knowledge base (incrementally with update=True, see update_index_dir).
+    With one passage directory per course (preprocess_passages.py), each course gets its
+    own index shard in out_dir/courses/<course>, listed in shards.json, so a question
+    scoped to a course only searches that shard. A flat passages directory is built as
+    a single index in out_dir.
+    """
+    build = update_index_dir if update else build_index_dir
+    courses = course_dirs(passages_dir)
+    if not courses:
+        return build(passages_dir, model_name, out_dir, index_type, index_params, batch_size, workers)
+
+    for course in courses:
+        print(f"Course '{course}':")
+        build(os.path.join(passages_dir, course), model_name, os.path.join(out_dir, COURSES_DIRNAME, course),
+              index_type, index_params, batch_size, workers)
+    previous = load_shards(out_dir)
+    save_shards(out_dir, model_name, {course: load_manifest(os.path.join(out_dir, COURSES_DIRNAME, course)) for course in courses})
+
+    #Shards of courses that no longer exist are dropped once shards.json stops listing them
+    for entry in (previous or {}).get("courses", []):
+        if entry["course"] not in courses:
+            shutil.rmtree(os.path.join(out_dir, entry["dir"]), ignore_errors=True)
+            print(f"Removed shard of course '{entry['course']}'")
+
+def update_knowledge_base(passages_dir: str = PASSAGES_DIR, model_name: str = MODEL_NAME, out_dir: str = INDEX_DIR,
+                          index_type: str = None, index_params: dict = None,
+                          batch_size: int = BATCH_SIZE, workers: int = NUM_WORKERS):
+    #Incremental build of every course shard (or of the single index)
+    build_knowledge_base(passages_dir, model_name, out_dir, index_type, index_params, batch_size, workers, update=True)
+
+def build_version(passages_dir: str = PASSAGES_DIR, model_name: str = MODEL_NAME, out_dir: str = INDEX_DIR,
+                  index_type: str = None, index_params: dict = None,
+                  batch_size: int = BATCH_SIZE, workers: int = NUM_WORKERS, update: bool = False) -> str:
+    """
+    Build into a new version directory (out_dir/versions/<version>) and point out_dir/CURRENT
+    at it once it is complete, so a running server can swap it in without restarting
+    (see Retriever.reload). Incremental builds start from a copy of the current index;
+    an interrupted full build is resumed by the next run. Returns the version name.
+    """
+    version, version_dir = start_version(out_dir, resume=not update)
+    source, _ = resolve_index(out_dir)
+    if update and (os.path.exists(os.path.join(source, "kb.index")) or load_shards(source) is not None):
+        shutil.copytree(source, version_dir, dirs_exist_ok=True,
+                        ignore=shutil.ignore_patterns(VERSIONS_DIRNAME, CURRENT_FILE, SHARD_DIRNAME))
+    build_knowledge_base(passages_dir, model_name, version_dir, index_type, index_params, batch_size, workers, update=update)
+    publish_version(out_dir, version)
+    removed = prune_versions(out_dir)
+    print(f"Published index version {version}" + (f" (removed {', '.join(removed)})" if removed else ""))
+    return version
 
 if __name__ == "__main__":
-    passages = load_passages()
-    build_faiss_index(passages)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Embed passages and build the FAISS knowledge base")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=None, help=f"FAISS index type (default: {INDEX_TYPE}; --incremental keeps the built index's type).")
+    parser.add_argument("--nlist", type=int, help="IVF: number of inverted lists.")
+    parser.add_argument("--nprobe", type=int, help="IVF: lists visited per query.")
+    parser.add_argument("--pq-m", type=int, help="IVF-PQ: number of sub-quantizers (must divide the dimension).")
+    parser.add_argument("--pq-nbits", type=int, help="IVF-PQ: bits per sub-quantizer code.")
+    parser.add_argument("--hnsw-m", type=int, help="HNSW: neighbours per node.")
+    parser.add_argument("--ef-construction", type=int, help="HNSW: build-time search depth.")
+    parser.add_argument("--ef-search", type=int, help="HNSW: query-time search depth.")
+    parser.add_argument("--incremental", action="store_true", help="Only embed passages added or changed since the last build.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Passages per embedding shard.")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="Embedding worker processes (0 = encode in this process).")
+    parser.add_argument("--unversioned", action="store_true", help="Build in place in the index directory instead of a new version (needs a server restart).")
+    args = parser.parse_args()
+
+    overrides = {
+        "nlist": args.nlist, "nprobe": args.nprobe, "m": args.pq_m, "nbits": args.pq_nbits,
+        "M": args.hnsw_m, "efConstruction": args.ef_construction, "efSearch": args.ef_search
+    }
+    if args.unversioned:
+        build = update_knowledge_base if args.incremental else build_knowledge_base
+        build(index_type=args.index_type, index_params=overrides, batch_size=args.batch_size, workers=args.workers)
+    else:
+        build_version(index_type=args.index_type, index_params=overrides, batch_size=args.batch_size, workers=args.workers,
+                      update=args.incremental)
\ No newline at end of file
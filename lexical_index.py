@@ -0,0 +1,137 @@
+import os
+import re
+import json
+import numpy as np
+
+LEXICAL_DIRNAME = "lexical_index"
+BM25_K1 = 1.2
+BM25_B = 0.75
+ROWS_PER_CHUNK = 50000  # passages tokenized before their postings are packed into arrays
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+")
+
+# On-disk layout (inside the index directory):
+#   lexical_index/vocab.json   sorted list of terms; term id = position
+#   lexical_index/indptr.npy   int64, n_terms + 1; postings of term t are [indptr[t], indptr[t+1])
+#   lexical_index/rows.npy     int32 passage store rows (== FAISS ids), ascending within a term
+#   lexical_index/weights.npy  float32 BM25 impact of the term in that row (idf and length norm folded in)
+#   lexical_index/params.json  k1, b, passage count and average length
+# A query score is the sum of its terms' impacts, so search only touches the postings
+# of the query terms, never the whole corpus.
+
+def tokenize(text: str) -> list:
+    """Lowercased alphanumeric/underscore tokens, so identifiers like `append` or `n_log_n` survive intact."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+def build_lexical_index(store, out_dir: str, k1: float = BM25_K1, b: float = BM25_B) -> int:
+    """
+    Build the BM25 inverted index over every live row of a PassageStore and save it
+    to out_dir/lexical_index. Returns the number of terms.
+    """
+    vocab = {}
+    n_rows = len(store)
+    doc_len = np.zeros(n_rows, dtype=np.int32)
+    term_chunks, row_chunks, tf_chunks = [], [], []
+    terms, rows, tfs = [], [], []
+
+    def pack():
+        if terms:
+            term_chunks.append(np.asarray(terms, dtype=np.int32))
+            row_chunks.append(np.asarray(rows, dtype=np.int32))
+            tf_chunks.append(np.asarray(tfs, dtype=np.float32))
+            terms.clear()
+            rows.clear()
+            tfs.clear()
+
+    for row in range(n_rows):
+        if row in store.deleted:
+            continue
+        tokens = tokenize(store.text(row))
+        doc_len[row] = len(tokens)
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            terms.append(vocab.setdefault(token, len(vocab)))
+            rows.append(row)
+            tfs.append(count)
+        if row % ROWS_PER_CHUNK == ROWS_PER_CHUNK - 1:
+            pack()
+    pack()
+
+    # Renumber terms alphabetically and group postings by term (CSR layout)
+    words = sorted(vocab)
+    new_id = np.empty(len(vocab), dtype=np.int32)
+    for i, word in enumerate(words):
+        new_id[vocab[word]] = i
+    term_ids = new_id[np.concatenate(term_chunks)] if term_chunks else np.zeros(0, dtype=np.int32)
+    row_ids = np.concatenate(row_chunks) if row_chunks else np.zeros(0, dtype=np.int32)
+    tf = np.concatenate(tf_chunks) if tf_chunks else np.zeros(0, dtype=np.float32)
+    order = np.lexsort((row_ids, term_ids))
+    term_ids, row_ids, tf = term_ids[order], row_ids[order], tf[order]
+    indptr = np.zeros(len(words) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_ids, minlength=len(words)), out=indptr[1:])
+
+    n_docs = n_rows - len(store.deleted)
+    avgdl = float(doc_len.sum()) / max(1, n_docs)
+    df = np.diff(indptr).astype(np.float32)
+    idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+    norm = k1 * (1 - b + b * doc_len[row_ids] / max(avgdl, 1e-9))
+    weights = (idf[term_ids] * tf * (k1 + 1) / (tf + norm)).astype(np.float32)
+
+    lex_dir = os.path.join(out_dir, LEXICAL_DIRNAME)
+    os.makedirs(lex_dir, exist_ok=True)
+    for name, array in (("indptr", indptr), ("rows", row_ids), ("weights", weights)):
+        np.save(os.path.join(lex_dir, name + ".tmp.npy"), array)
+    with open(os.path.join(lex_dir, "vocab.tmp.json"), "w", encoding="utf-8") as f:
+        json.dump(words, f, ensure_ascii=False)
+    with open(os.path.join(lex_dir, "params.tmp.json"), "w", encoding="utf-8") as f:
+        json.dump({"k1": k1, "b": b, "n_docs": n_docs, "avgdl": avgdl}, f, indent=2)
+    # params.json is moved last; its presence marks a complete index
+    for name in ("indptr.npy", "rows.npy", "weights.npy", "vocab.json", "params.json"):
+        stem, ext = os.path.splitext(name)
+        os.replace(os.path.join(lex_dir, stem + ".tmp" + ext), os.path.join(lex_dir, name))
+    print(f"Built BM25 index: {len(words)} terms, {len(row_ids)} postings")
+    return len(words)
+
+def lexical_index_exists(index_dir: str) -> bool:
+    return os.path.exists(os.path.join(index_dir, LEXICAL_DIRNAME, "params.json"))
+
+class LexicalIndex:
+    """Read-only BM25 index; posting arrays are memory-mapped."""
+    def __init__(self, index_dir: str):
+        lex_dir = os.path.join(index_dir, LEXICAL_DIRNAME)
+        if not os.path.exists(os.path.join(lex_dir, "params.json")):
+            raise FileNotFoundError("Lexical index not found. Run knowledge_base.py first.")
+        with open(os.path.join(lex_dir, "vocab.json"), "r", encoding="utf-8") as f:
+            self.vocab = {term: i for i, term in enumerate(json.load(f))}
+        with open(os.path.join(lex_dir, "params.json"), "r", encoding="utf-8") as f:
+            self.params = json.load(f)
+        self.indptr = np.load(os.path.join(lex_dir, "indptr.npy"), mmap_mode="r")
+        self.rows = np.load(os.path.join(lex_dir, "rows.npy"), mmap_mode="r")
+        self.weights = np.load(os.path.join(lex_dir, "weights.npy"), mmap_mode="r")
+
+    def search(self, query: str, k: int, allowed: np.ndarray = None):
+        """
+        BM25 top-k for one query. Returns (rows, scores) as arrays, best first;
+        higher scores are better. Fewer than k rows come back when few passages match.
+        `allowed` (an array of rows) restricts the search to those passages.
+        """
+        term_ids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not term_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        spans = [(int(self.indptr[t]), int(self.indptr[t + 1])) for t in term_ids]
+        rows = np.concatenate([self.rows[start:end] for start, end in spans])
+        weights = np.concatenate([self.weights[start:end] for start, end in spans])
+        if allowed is not None:
+            keep = np.isin(rows, allowed)
+            rows, weights = rows[keep], weights[keep]
+            if not len(rows):
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        candidates, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return candidates[top].astype(np.int64), scores[top].astype(np.float32)
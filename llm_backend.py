@@ -0,0 +1,646 @@
+import os
+import re
+import json
+import asyncio
+import hashlib
+import time
+import codecs
+import atexit
+import tempfile
+import threading
+import subprocess
+import requests
+import aiohttp
+
+# Configuration
+MODEL_FILE = 'llama-3-8b-instruct-q4.gguf'
+LLAMA_FILE_EXE = 'llamafile-0.9.3.exe'
+MAX_NEW_TOKENS = 200
+TEMPERATURE = 0.5
+SAMPLING_TOP_K = 50
+LLM_THREADS = 4
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8080
+SERVER_LOG = 'llamafile-server.log'
+STARTUP_TIMEOUT = 300  # seconds to wait for the model to load
+HEALTH_CHECK_INTERVAL = 10  # seconds between background health checks
+BACKEND_MODE = os.environ.get('RAG_BACKEND', 'server')  # cli | server | fake
+TOKEN_COUNT_CACHE_SIZE = 20000  # texts whose server token counts are remembered
+TOKEN_PIECE = re.compile(r"\w{1,4}|[^\w\s]")
+GENERATION_TIMEOUT = 300  # seconds a single generation may take before it is abandoned
+STREAM_READ_TIMEOUT = 60  # seconds without a streamed token before the server is considered hung
+PROMPT_CACHE_FILE = 'prompt-prefix.cache'  # CLI backend: saved KV state of the shared prompt prefix
+PROMPT_EVAL_TIMING = re.compile(r"prompt eval time =\s*([\d.]+) ms /\s*(\d+) (?:tokens|runs)")
+
+
+class GenerationError(RuntimeError):
+    """Raised when a backend fails to produce a completion."""
+
+
+def check_model_files(exe: str = LLAMA_FILE_EXE, model: str = MODEL_FILE):
+    if not os.path.exists(exe):
+        raise FileNotFoundError(f"{exe} not found. Download from https://github.com/Mozilla-Ocho/llamafile/releases and rename to llamafile.exe.")
+    if not os.path.exists(model):
+        raise FileNotFoundError(f"{model} not found. Download with: huggingface-cli download bartowski/Meta-Llama-3.1-8B-Instruct-GGUF Meta-Llama-3.1-8B-Instruct-Q4_K_M.gguf --local-dir . and rename to {model}.")
+
+
+class CancelToken:
+    """
+    Lets another thread stop a running generation (deadline watchdog, client disconnect).
+    Backends register a callback that aborts their blocking read; callbacks registered
+    after cancel() run immediately.
+    """
+    def __init__(self):
+        self.cancelled = False
+        self.reason = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self, reason: str = "cancelled"):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancel callback failed: {e}")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Tokenizer-free estimate of the Llama 3 token count: words are split into pieces of
+    up to four characters and each punctuation mark counts once. Close to (slightly
+    above) the real count for English transcripts, so budgets are not overrun.
+    """
+    return len(TOKEN_PIECE.findall(text))
+
+
+class GenerationBackend:
+    """
+    Base class for generation backends.
+    Subclasses implement generate() and, where the backend supports it, stream().
+    start() and close() are optional lifecycle hooks.
+    generate() and stream() fill the optional `stats` dict with prefill figures:
+    prompt_tokens, prefill_tokens_saved (served from the prefix KV cache) and,
+    when the backend reports them, prefill_ms. A CancelToken passed as `cancel`
+    aborts the generation from another thread; the call then raises GenerationError.
+    """
+    name = "base"
+    prefix = None  # shared prompt prefix whose KV state is kept warm, see cache_prefix()
+
+    def start(self):
+        pass
+
+    def cache_prefix(self, prefix: str):
+        """
+        Precompute the KV state of a prompt prefix shared by every request, so only the
+        rest of each prompt needs prefill. Backends without a prompt cache just record it.
+        """
+        self.prefix = prefix
+
+    def generate(self, prompt: str, max_tokens: int = MAX_NEW_TOKENS, temperature: float = TEMPERATURE,
+                 stop: list = None, stats: dict = None, cancel: CancelToken = None) -> str:
+        raise NotImplementedError
+
+    def stream(self, prompt: str, max_tokens: int = MAX_NEW_TOKENS, temperature: float = TEMPERATURE,
+               stop: list = None, stats: dict = None, cancel: CancelToken = None):
+        """
+        Yield the completion in pieces as they are produced.
+        Closing the generator early must stop generation on the backend.
+        """
+        yield self.generate(prompt, max_tokens, temperature, stop, stats, cancel)
+
+    async def astream(self, prompt: str, max_tokens: int = MAX_NEW_TOKENS, temperature: float = TEMPERATURE,
+                      stop: list = None, stats: dict = None, cancel: CancelToken = None):
+        """
+        Async form of stream() for the asyncio server: pieces are awaited without blocking
+        the event loop. This default drives stream() on a worker thread; backends with
+        non-blocking I/O override it.
+        """
+        loop = asyncio.get_running_loop()
+        pieces = asyncio.Queue()
+        finished = object()
+        closed = threading.Event()
+
+        def produce():
+            stream = self.stream(prompt, max_tokens, temperature, stop, stats, cancel)
+            try:
+                for piece in stream:
+                    if closed.is_set():
+                        break
+                    loop.call_soon_threadsafe(pieces.put_nowait, piece)
+            except Exception as e:
+                loop.call_soon_threadsafe(pieces.put_nowait, e)
+            finally:
+                stream.close()
+                loop.call_soon_threadsafe(pieces.put_nowait, finished)
+
+        loop.run_in_executor(None, produce)
+        try:
+            while True:
+                piece = await pieces.get()
+                if piece is finished:
+                    break
+                if isinstance(piece, Exception):
+                    raise piece
+                yield piece
+        finally:
+            closed.set()  # the worker stops at its next piece, which closes the backend stream
+
+    async def aclose(self):
+        """Release resources tied to the event loop (async HTTP sessions)."""
+        pass
+
+    def count_tokens(self, text: str) -> int:
+        """Number of model tokens in text; backends without a tokenizer estimate it."""
+        return estimate_tokens(text)
+
+    def _prefix_stats(self, prompt: str, stats: dict):
+        """Prefill figures implied by the cached prefix, for backends that report none."""
+        if stats is None:
+            return
+        stats["prompt_tokens"] = self.count_tokens(prompt)
+        stats["prefill_tokens_saved"] = self.count_tokens(self.prefix) if self.prefix and prompt.startswith(self.prefix) else 0
+
+    def close(self):
+        pass
+
+
+class CLIBackend(GenerationBackend):
+    """
+    One-shot mode: spawns `llamafile --cli` for every prompt.
+    The model is reloaded from disk on each call. With cache_prefix(), the shared
+    prompt prefix is evaluated once into a --prompt-cache file that every later call
+    loads read-only, so only the rest of the prompt is prefilled.
+    """
+    name = "cli"
+
+    def __init__(self, exe: str = LLAMA_FILE_EXE, model: str = MODEL_FILE, threads: int = LLM_THREADS,
+                 prompt_cache: str = PROMPT_CACHE_FILE, timeout: float = GENERATION_TIMEOUT):
+        check_model_files(exe, model)
+        self.exe = exe
+        self.model = model
+        self.threads = threads
+        self.prompt_cache = prompt_cache
+        self.timeout = timeout
+
+    def _command(self, prompt: str, max_tokens: int, temperature: float) -> list:
+        cmd = [
+            self.exe,
+            '--cli',
+            '-m', self.model,
+            '--prompt', prompt,
+            '--n-predict', str(max_tokens),
+            '--temp', str(temperature),
+            '--top-k', str(SAMPLING_TOP_K),
+            '--no-display-prompt',
+            '--threads', str(self.threads)
+        ]
+        if self.prefix and prompt.startswith(self.prefix):
+            cmd += ['--prompt-cache', self.prompt_cache, '--prompt-cache-ro']
+        return cmd
+
+    def cache_prefix(self, prefix: str):
+        # The cache file is tied to the model and prefix text; a .sha1 sidecar records which
+        digest = hashlib.sha1((self.model + "\0" + prefix).encode("utf-8")).hexdigest()
+        digest_path = self.prompt_cache + ".sha1"
+        if os.path.exists(self.prompt_cache) and os.path.exists(digest_path):
+            with open(digest_path, "r", encoding="utf-8") as f:
+                if f.read().strip() == digest:
+                    self.prefix = prefix
+                    return
+        cmd = [self.exe, '--cli', '-m', self.model, '--prompt', prefix, '--n-predict', '1',
+               '--prompt-cache', self.prompt_cache, '--no-display-prompt', '--threads', str(self.threads)]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=None)
+        if result.returncode != 0:
+            raise GenerationError(f"prompt cache build failed, return code {result.returncode}: {result.stderr}")
+        with open(digest_path, "w", encoding="utf-8") as f:
+            f.write(digest)
+        self.prefix = prefix
+        print(f"Saved prompt prefix cache to {self.prompt_cache}")
+
+    def _parse_stats(self, prompt: str, stderr: str, stats: dict):
+        #llama.cpp prints "prompt eval time = X ms / N tokens" for the tokens it actually evaluated
+        if stats is None:
+            return
+        self._prefix_stats(prompt, stats)
+        match = PROMPT_EVAL_TIMING.search(stderr)
+        if match:
+            stats["prefill_ms"] = float(match.group(1))
+            stats["prefill_tokens_saved"] = max(0, stats["prompt_tokens"] - int(match.group(2)))
+
+    def generate(self, prompt: str, max_tokens: int = MAX_NEW_TOKENS, temperature: float = TEMPERATURE,
+                 stop: list = None, stats: dict = None, cancel: CancelToken = None) -> str:
+        return "".join(self.stream(prompt, max_tokens, temperature, stop, stats, cancel))
+
+    def stream(self, prompt: str, max_tokens: int = MAX_NEW_TOKENS, temperature: float = TEMPERATURE,
+               stop: list = None, stats: dict = None, cancel: CancelToken = None):
+        # stderr goes to a temp file: llamafile logs heavily there and an undrained pipe would block it
+        with tempfile.TemporaryFile() as err:
+            process = subprocess.Popen(self._command(prompt, max_tokens, temperature), stdout=subprocess.PIPE,
+                                       stderr=err, bufsize=0)
+            # A hung child never closes stdout; killing it (on cancel or timeout) ends the read loop
+            timer = threading.Timer(self.timeout, process.kill)
+            timer.daemon = True
+            timer.start()
+            if cancel is not None:
+                cancel.on_cancel(process.kill)
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            try:
+                while True:
+                    chunk = os.read(process.stdout.fileno(), 256)
+                    if not chunk:
+                        break
+                    text = decoder.decode(chunk)
+                    if text:
+                        yield text
+                tail = decoder.decode(b"", final=True)
+                if tail:
+                    yield tail
+                returncode = process.wait()
+                if cancel is not None and cancel.cancelled:
+                    raise GenerationError(f"generation {cancel.reason}")
+                if not timer.is_alive():
+                    raise GenerationError(f"generation exceeded {self.timeout}s")
+                err.seek(0)
+                err_text = err.read().decode('utf-8', 'replace')
+                if returncode != 0:
+                    raise GenerationError(f"return code {returncode}: {err_text}")
+                self._parse_stats(prompt, err_text, stats)
+            finally:
+                timer.cancel()
+                # Reached early when the consumer stops reading; kill the child so it stops generating
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+                process.stdout.close()
+
+
+class ServerBackend(GenerationBackend):
+    """
+    Resident mode: starts `llamafile --server` once and keeps the model loaded.
+    Prompts are sent to the /completion endpoint. A background thread
+    health-checks the server and restarts it if the process dies.
+    Requests set cache_prompt, so the server keeps the KV state of the previous
+    prompt and only prefills from the first token that differs; cache_prefix()
+    warms that state with the shared prefix (again after every restart).
+    """
+    name = "server"
+
+    def __init__(self, exe: str = LLAMA_FILE_EXE, model: str = MODEL_FILE, host: str = SERVER_HOST,
+                 port: int = SERVER_PORT, threads: int = LLM_THREADS, startup_timeout: float = STARTUP_TIMEOUT,
+                 health_interval: float = HEALTH_CHECK_INTERVAL, log_path: str = SERVER_LOG, parallel: int = 1,
+                 timeout: float = GENERATION_TIMEOUT):
+        check_model_files(exe, model)
+        self.exe = exe
+        self.model = model
+        self.host = host
+        self.port = port
+        self.threads = threads
+        self.parallel = parallel  # sequences the server decodes at once (its slots)
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.health_interval = health_interval
+        self.log_path = log_path
+        self.base_url = f"http://{host}:{port}"
+        self.session = requests.Session()
+        self.process = None
+        self._token_counts = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._monitor = None
+        self._aio_session = None  # aiohttp session for astream(), bound to the serving event loop
+
+    def _launch(self):
+        cmd = [
+            self.exe,
+            '--server',
+            '--nobrowser',
+            '-m', self.model,
+            '--host', self.host,
+            '--port', str(self.port),
+            '--threads', str(self.threads),
+            '--parallel', str(self.parallel)
+        ]
+        log = open(self.log_path, "ab")
+        self.process = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+        log.close()
+        print(f"Started llamafile server (pid {self.process.pid}) on {self.base_url}")
+
+        deadline = time.time() + self.startup_timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise GenerationError(f"llamafile server exited during startup (code {self.process.returncode}). See {self.log_path}.")
+            if self.is_healthy():
+                return
+            time.sleep(0.5)
+        self._terminate()
+        raise GenerationError(f"llamafile server did not become healthy within {self.startup_timeout}s")
+
+    def _terminate(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+    def is_healthy(self) -> bool:
+        try:
+            response = self.session.get(self.base_url + "/health", timeout=2)
+            return response.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def ensure_running(self):
+        """Start the server if needed, or restart it if it crashed or stopped answering."""
+        with self._lock:
+            if self.process is not None and self.process.poll() is None and self.is_healthy():
+                return
+            if self.process is None and self.is_healthy():
+                return  # a server we did not spawn is already listening
+            if self.process is not None:
+                print(f"llamafile server unhealthy (exit code {self.process.poll()}), restarting")
+                self._terminate()
+            self._launch()
+            if self.prefix:
+                self._warm_prefix()
+
+    def _warm_prefix(self):
+        try:
+            self._completion(self._payload(self.prefix, 1, TEMPERATURE, None, stream=False))
+        except requests.RequestException as e:
+            print(f"Could not warm the prompt prefix cache: {e}")
+
+    def cache_prefix(self, prefix: str):
+        self.prefix = prefix
+        self.ensure_running()
+        with self._lock:
+            self._warm_prefix()
+
+    def _monitor_loop(self):
+        while not self._stop.wait(self.health_interval):
+            try:
+                self.ensure_running()
+            except GenerationError as e:
+                print(f"Health check failed: {e}")
+
+    def start(self):
+        self.ensure_running()
+        if self._monitor is None:
+            self._monitor = threading.Thread(target=self._monitor_loop, name="llamafile-monitor", daemon=True)
+            self._monitor.start()
+
+    def tokenize(self, text: str) -> list:
+        """Token ids from the model's own tokenizer (the server's /tokenize endpoint)."""
+        response = self.session.post(self.base_url + "/tokenize", json={"content": text}, timeout=10)
+        response.raise_for_status()
+        return response.json()["tokens"]
+
+    def count_tokens(self, text: str) -> int:
+        count = self._token_counts.get(text)
+        if count is not None:
+            return count
+        try:
+            count = len(self.tokenize(text))
+        except requests.RequestException:
+            return estimate_tokens(text)  # server restarting; don't cache the estimate
+        if len(self._token_counts) >= TOKEN_COUNT_CACHE_SIZE:
+            self._token_counts.clear()
+        self._token_counts[text] = count
+        return count
+
+    def _completion(self, payload: dict) -> dict:
+        response = self.session.post(self.base_url + "/completion", json=payload, timeout=(10, self.timeout))
+        response.raise_for_status()
+        return response.json()
+
+    def _payload(self, prompt: str, max_tokens: int, temperature: float, stop: list, stream: bool) -> dict:
+        payload = {
+            "prompt": prompt,
+            "n_predict": max_tokens,
+            "temperature": temperature,
+            "top_k": SAMPLING_TOP_K,
+            "stream": stream,
+            "cache_prompt": True
+        }
+        if stop:
+            payload["stop"] = stop
+        return payload
+
+    def _record_stats(self, prompt: str, data: dict, stats: dict):
+        #tokens_evaluated is the whole prompt; timings.prompt_n only the tokens actually prefilled
+        if stats is None:
+            return
+        if "prompt_tokens" not in stats:
+            self._prefix_stats(prompt, stats)
+        timings = data.get("timings") or {}
+        if "tokens_evaluated" in data and "prompt_n" in timings:
+            stats["prompt_tokens"] = data["tokens_evaluated"]
+            stats["prefill_tokens_saved"] = max(0, data["tokens_evaluated"] - timings["prompt_n"])
+            stats["prefill_ms"] = timings.get("prompt_ms")
+
+    def generate(self, prompt: str, max_tokens: int = MAX_NEW_TOKENS, temperature: float = TEMPERATURE,
+                 stop: list = None, stats: dict = None, cancel: CancelToken = None) -> str:
+        if cancel is not None:
+            # A blocking non-streamed request cannot be interrupted; stream it instead
+            return "".join(self.stream(prompt, max_tokens, temperature, stop, stats, cancel))
+        payload = self._payload(prompt, max_tokens, temperature, stop, stream=False)
+        self.ensure_running()
+        try:
+            data = self._completion(payload)
+        except requests.ConnectionError:
+            # Server died between the health check and the request; restart and retry once
+            self.ensure_running()
+            try:
+                data = self._completion(payload)
+            except requests.RequestException as e:
+                raise GenerationError(str(e)) from e
+        except requests.RequestException as e:
+            raise GenerationError(str(e)) from e
+        self._record_stats(prompt, data, stats)
+        return data["content"]
+
+    def stream(self, prompt: str, max_tokens: int = MAX_NEW_TOKENS, temperature: float = TEMPERATURE,
+               stop: list = None, stats: dict = None, cancel: CancelToken = None):
+        payload = self._payload(prompt, max_tokens, temperature, stop, stream=True)
+        self.ensure_running()
+        try:
+            # The read timeout applies between streamed tokens, so a hung server is detected
+            response = self.session.post(self.base_url + "/completion", json=payload, stream=True,
+                                         timeout=(10, STREAM_READ_TIMEOUT))
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise GenerationError(str(e)) from e
+        if cancel is not None:
+            # Closing the connection from another thread ends the read loop below
+            cancel.on_cancel(response.close)
+        # Estimated from the cached prefix until the final event brings the server's timings
+        self._prefix_stats(prompt, stats)
+        try:
+            # Server-sent events: one `data: {...}` line per generated token
+            for line in response.iter_lines(chunk_size=None):
+                if cancel is not None and cancel.cancelled:
+                    break
+                if not line.startswith(b"data: "):
+                    continue
+                data = json.loads(line[6:])
+                if data.get("content"):
+                    yield data["content"]
+                if data.get("stop"):
+                    self._record_stats(prompt, data, stats)
+                    break
+        except (requests.RequestException, OSError, AttributeError) as e:
+            # OSError / AttributeError come from the connection being closed under the reader by a cancel
+            if cancel is not None and cancel.cancelled:
+                raise GenerationError(f"generation {cancel.reason}") from e
+            raise GenerationError(str(e)) from e
+        finally:
+            # Dropping the connection makes llamafile abandon the rest of the generation
+            response.close()
+        if cancel is not None and cancel.cancelled:
+            raise GenerationError(f"generation {cancel.reason}")
+
+    async def astream(self, prompt: str, max_tokens: int = MAX_NEW_TOKENS, temperature: float = TEMPERATURE,
+                      stop: list = None, stats: dict = None, cancel: CancelToken = None):
+        """Non-blocking stream(): the /completion events are read with aiohttp on the event loop."""
+        payload = self._payload(prompt, max_tokens, temperature, stop, stream=True)
+        # Health check and token counts use the blocking session; keep them off the event loop
+        await asyncio.to_thread(self.ensure_running)
+        await asyncio.to_thread(self._prefix_stats, prompt, stats)
+        if self._aio_session is None:
+            self._aio_session = aiohttp.ClientSession()
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=STREAM_READ_TIMEOUT)
+        try:
+            # Leaving the block early (stop sequence, cancel, client gone) drops the
+            # connection, which makes llamafile abandon the rest of the generation
+            async with self._aio_session.post(self.base_url + "/completion", json=payload, timeout=timeout) as response:
+                response.raise_for_status()
+                async for line in response.content:
+                    if cancel is not None and cancel.cancelled:
+                        break
+                    if not line.startswith(b"data: "):
+                        continue
+                    data = json.loads(line[6:])
+                    if data.get("content"):
+                        yield data["content"]
+                    if data.get("stop"):
+                        self._record_stats(prompt, data, stats)
+                        break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise GenerationError(str(e) or type(e).__name__) from e
+        if cancel is not None and cancel.cancelled:
+            raise GenerationError(f"generation {cancel.reason}")
+
+    async def aclose(self):
+        if self._aio_session is not None:
+            await self._aio_session.close()
+            self._aio_session = None
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            self._terminate()
+
+
+class FakeBackend(GenerationBackend):
+    """
+    Deterministic local backend for tests and benchmarks; no model required.
+    Returns a fixed bullet answer built from the question in the prompt.
+    `delay` is paid once per call, `token_delay` for every streamed word.
+    """
+    name = "fake"
+
+    def __init__(self, delay: float = 0.0, response: str = None, token_delay: float = 0.0):
+        self.delay = delay
+        self.response = response
+        self.token_delay = token_delay
+
+    def generate(self, prompt: str, max_tokens: int = MAX_NEW_TOKENS, temperature: float = TEMPERATURE,
+                 stop: list = None, stats: dict = None, cancel: CancelToken = None) -> str:
+        self._prefix_stats(prompt, stats)
+        if self.delay:
+            if cancel is None:
+                time.sleep(self.delay)
+            else:
+                aborted = threading.Event()
+                cancel.on_cancel(aborted.set)
+                if aborted.wait(self.delay):
+                    raise GenerationError(f"generation {cancel.reason}")
+        return self._text(prompt)
+
+    def _text(self, prompt: str) -> str:
+        if self.response is not None:
+            return self.response
+        question = prompt.rsplit("Question:", 1)[-1].split("Answer:", 1)[0].strip()
+        return (
+            "Answer:\n"
+            f"- This is a stub answer to: {question}\n"
+            "- It is generated locally without loading the language model.\n"
+            "- Use it to test retrieval, prompting and serving code paths."
+        )
+
+    def stream(self, prompt: str, max_tokens: int = MAX_NEW_TOKENS, temperature: float = TEMPERATURE,
+               stop: list = None, stats: dict = None, cancel: CancelToken = None):
+        text = self.generate(prompt, max_tokens, temperature, stop, stats, cancel)
+        for piece in text.split(" "):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            if cancel is not None and cancel.cancelled:
+                raise GenerationError(f"generation {cancel.reason}")
+            yield piece + " "
+
+    async def astream(self, prompt: str, max_tokens: int = MAX_NEW_TOKENS, temperature: float = TEMPERATURE,
+                      stop: list = None, stats: dict = None, cancel: CancelToken = None):
+        # Delays are awaited, so one event loop can hold many simulated generations at once
+        self._prefix_stats(prompt, stats)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        for piece in self._text(prompt).split(" "):
+            if cancel is not None and cancel.cancelled:
+                raise GenerationError(f"generation {cancel.reason}")
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield piece + " "
+
+
+BACKENDS = {
+    "cli": CLIBackend,
+    "server": ServerBackend,
+    "fake": FakeBackend
+}
+
+_shared_backend = None
+_shared_lock = threading.Lock()
+
+def create_backend(mode: str = BACKEND_MODE, **kwargs) -> GenerationBackend:
+    if mode not in BACKENDS:
+        raise ValueError(f"Unknown backend '{mode}'. Choose from: {', '.join(BACKENDS)}")
+    return BACKENDS[mode](**kwargs)
+
+def get_backend(mode: str = None, **kwargs) -> GenerationBackend:
+    """
+    Return the process-wide backend, creating and starting it on first use.
+    app.py and the evaluate scripts share this single instance.
+    """
+    global _shared_backend
+    with _shared_lock:
+        if _shared_backend is None:
+            _shared_backend = create_backend(mode or BACKEND_MODE, **kwargs)
+            _shared_backend.start()
+            atexit.register(_shared_backend.close)
+        elif mode is not None and mode != _shared_backend.name:
+            raise ValueError(f"Shared backend already initialized as '{_shared_backend.name}'")
+        return _shared_backend
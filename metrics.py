@@ -0,0 +1,158 @@
+import os
+import time
+import bisect
+import threading
+import contextvars
+
+ENABLED = os.environ.get('RAG_METRICS', '1') != '0'  # RAG_METRICS=0 turns histogram recording off
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)  # seconds
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200)  # tokens per second
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Stages of one answer, in request order:
+#   retrieve (embed, search, lexical, lookup inside it), gate, prompt, queue, prefill, decode, postprocess, total
+_breakdown = contextvars.ContextVar("stage_breakdown", default=None)
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, optionally split by one label. Thread-safe."""
+    def __init__(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS, label: str = None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._series = {}  # label value -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, label_value: str = ""):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for label_value, counts in sorted(series.items()):
+            labels = f'{self.label}="{label_value}"' if self.label else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                sep = "," if labels else ""
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {counts[-1]:.6f}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """A value read from a callback at scrape time (queue depth, busy slots...)."""
+    def __init__(self, name: str, help: str, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {float(self.read())}"]
+
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Time spent in each stage of answering a question.", label="stage")
+DECODE_RATE = Histogram("rag_decode_tokens_per_second", "Generation speed after the first token.", RATE_BUCKETS)
+_registry = [STAGE_SECONDS, DECODE_RATE]
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.name, time.perf_counter() - self.start)
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+
+NULL_STAGE = _NullStage()
+
+def stage(name: str):
+    """
+    `with stage("embed"):` times the block into rag_stage_seconds and the current
+    request's breakdown. With metrics off and no breakdown requested it is a no-op.
+    """
+    if not ENABLED and _breakdown.get() is None:
+        return NULL_STAGE
+    return _Stage(name)
+
+def record(name: str, seconds: float):
+    """Record a stage measured elsewhere (e.g. prefill, split off a streamed generation)."""
+    if ENABLED:
+        STAGE_SECONDS.observe(seconds, name)
+    timings = _breakdown.get()
+    if timings is not None:
+        key = name + "_ms"
+        timings[key] = round(timings.get(key, 0.0) + seconds * 1000, 2)
+
+def record_rate(tokens: int, seconds: float):
+    if seconds <= 0 or tokens <= 0:
+        return
+    rate = tokens / seconds
+    if ENABLED:
+        DECODE_RATE.observe(rate)
+    timings = _breakdown.get()
+    if timings is not None:
+        timings["decode_tokens_per_s"] = round(rate, 1)
+
+def timing() -> bool:
+    """True when stage timings are being collected at all (histograms or a breakdown)."""
+    return ENABLED or _breakdown.get() is not None
+
+def current_breakdown():
+    return _breakdown.get()
+
+def merge(timings: dict):
+    """Add stage timings collected in another context (a batch thread) to the current breakdown."""
+    current = _breakdown.get()
+    if current is not None and timings:
+        for key, value in timings.items():
+            current[key] = value if not key.endswith("_ms") else round(current.get(key, 0.0) + value, 2)
+
+
+class breakdown:
+    """
+    `with breakdown() as timings:` collects per-stage milliseconds for one request into
+    the `timings` dict, in this context and in threads that run a copy of it.
+    """
+    def __enter__(self) -> dict:
+        self.timings = {}
+        self._token = _breakdown.set(self.timings)
+        return self.timings
+
+    def __exit__(self, exc_type, exc, tb):
+        _breakdown.reset(self._token)
@@ -0,0 +1,74 @@
+import time
+import threading
+import queue
+from concurrent.futures import Future
+
+MAX_BATCH_SIZE = 32
+MAX_WAIT_MS = 5  # how long the first request in a batch waits for company
+
+class MicroBatcher:
+    """
+    Groups items submitted concurrently from many threads into batches for one handler call.
+    A background thread takes the first waiting item, collects whatever else arrives
+    within max_wait_ms (up to max_batch_size items) and calls handler(items), which must
+    return one result per item in order. submit() blocks until its item's result is ready.
+    """
+    def __init__(self, handler, max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: float = MAX_WAIT_MS, name: str = "micro-batcher"):
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._batches = 0
+        self._items = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Queue an item and wait for its result; exceptions from the handler are re-raised here."""
+        future = Future()
+        self._queue.put((item, future))
+        return future.result()
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while batch[-1] is not None and len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            stop = batch[-1] is None
+            batch = [entry for entry in batch if entry is not None]
+            if batch:
+                items = [item for item, _ in batch]
+                try:
+                    results = self.handler(items)
+                    for (_, future), result in zip(batch, results):
+                        future.set_result(result)
+                except Exception as e:
+                    for _, future in batch:
+                        future.set_exception(e)
+                self._batches += 1
+                self._items += len(batch)
+            if stop:
+                return
+
+    def close(self):
+        """Finish queued items, then stop the background thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self) -> dict:
+        return {
+            "batches": self._batches,
+            "items": self._items,
+            "mean_batch_size": round(self._items / self._batches, 2) if self._batches else 0.0
+        }
@@ -0,0 +1,70 @@
+import zlib
+import hashlib
+import numpy as np
+from lexical_index import tokenize
+
+NUM_PERMUTATIONS = 64  # MinHash signature length
+LSH_BANDS = 16  # signature bands; two passages become candidates if any band matches exactly
+SHINGLE_WORDS = 5  # passages are compared as sets of overlapping 5-word shingles
+DUPLICATE_THRESHOLD = 0.8  # estimated Jaccard similarity at which a passage counts as a near duplicate
+MERSENNE_PRIME = (1 << 61) - 1
+SEED = 1  # fixed, so the same passages are dropped on every run
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> set:
+    #Case and punctuation are ignored; texts shorter than one shingle are a single shingle
+    words = tokenize(text)
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class NearDuplicateFilter:
+    """
+    Streaming filter for exact and near-duplicate texts, sentences or passages (repeated licensing
+    boilerplate, re-recorded segments). Exact copies are caught by a hash of the
+    normalized text; near copies by MinHash signatures bucketed with LSH, so each new
+    passage is only compared against the few earlier ones sharing a band.
+    add() returns True for a passage to keep, False for a duplicate of an earlier one.
+    """
+    def __init__(self, threshold: float = DUPLICATE_THRESHOLD, num_perm: int = NUM_PERMUTATIONS, bands: int = LSH_BANDS):
+        if num_perm % bands != 0:
+            raise ValueError(f"num_perm={num_perm} must be a multiple of bands={bands}")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = np.random.RandomState(SEED)
+        #a < 2^29 and 32-bit shingle hashes keep a*x + b below 2^62, so uint64 never overflows
+        self._a = rng.randint(1, 1 << 29, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=num_perm).astype(np.uint64)
+        self._exact = set()
+        self._signatures = []
+        self._buckets = {}
+        self.kept = 0
+        self.exact = 0
+        self.near = 0
+
+    def signature(self, text: str) -> np.ndarray:
+        x = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles(text)), dtype=np.uint64)
+        return ((self._a[:, None] * x[None, :] + self._b[:, None]) % np.uint64(MERSENNE_PRIME)).min(axis=1)
+
+    def add(self, text: str) -> bool:
+        digest = hashlib.sha1(" ".join(tokenize(text)).encode("utf-8")).digest()
+        if digest in self._exact:
+            self.exact += 1
+            return False
+        sig = self.signature(text)
+        keys = [(band, sig[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+        candidates = {i for key in keys for i in self._buckets.get(key, ())}
+        for i in candidates:
+            if np.mean(self._signatures[i] == sig) >= self.threshold:
+                self.near += 1
+                return False
+        self._exact.add(digest)
+        for key in keys:
+            self._buckets.setdefault(key, []).append(len(self._signatures))
+        self._signatures.append(sig)
+        self.kept += 1
+        return True
+
+    def stats(self) -> dict:
+        return {"kept": self.kept, "exact_duplicates": self.exact, "near_duplicates": self.near}
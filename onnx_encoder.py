@@ -0,0 +1,186 @@
+import os
+import json
+import argparse
+import numpy as np
+
+ONNX_DIR = "data/onnx"
+MODEL_NAME = 'all-MiniLM-L6-v2'
+ONNX_FILE = "model.onnx"
+QUANTIZED_FILE = "model.int8.onnx"  # int8 dynamic quantization of ONNX_FILE
+TOKENIZER_FILE = "tokenizer.json"
+CONFIG_FILE = "encoder.json"
+OPSET = 14
+ENCODERS = ("auto", "torch", "onnx", "onnx-int8")
+ENCODER = os.environ.get('RAG_ENCODER', 'auto')  # auto: onnx-int8, then onnx, if exported for the model; else torch
+ENCODE_BATCH_SIZE = 32
+
+def export_onnx(model_name: str = MODEL_NAME, out_dir: str = ONNX_DIR, quantize: bool = True):
+    """
+    Export the transformer of a SentenceTransformer model to ONNX, together with its
+    fast tokenizer and pooling settings, so queries can be encoded without torch.
+    With quantize, an int8 dynamically quantized copy is written next to it.
+    Needs torch and sentence_transformers (only here, not at query time).
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0]
+    pooling = next((m for m in st_model if type(m).__name__ == "Pooling"), None)
+    #sentence-transformers < 6 exposes the mode through get_pooling_mode_str(), later versions as an attribute
+    pooling_mode = pooling.get_pooling_mode_str() if hasattr(pooling, "get_pooling_mode_str") else getattr(pooling, "pooling_mode", None)
+    if pooling_mode not in ("mean", "cls"):
+        raise ValueError(f"{model_name}: only mean or cls pooling can be exported")
+    tokenizer = transformer.tokenizer
+    if not getattr(tokenizer, "is_fast", False):
+        raise ValueError(f"{model_name}: a fast (Rust) tokenizer is needed for the ONNX encoder")
+
+    os.makedirs(out_dir, exist_ok=True)
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in tokenizer.model_input_names]
+    auto_model = transformer.auto_model.eval()
+
+    class TokenEmbeddings(torch.nn.Module):
+        #Positional inputs in input_names order -> last hidden state (pooling happens in numpy)
+        def __init__(self):
+            super().__init__()
+            self.auto_model = auto_model  # a submodule, so tracing sees its weights as parameters
+
+        def forward(self, *inputs):
+            return self.auto_model(**dict(zip(input_names, inputs)), return_dict=False)[0]
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    with torch.no_grad():
+        torch.onnx.export(
+            TokenEmbeddings(), tuple(sample[name] for name in input_names), os.path.join(out_dir, ONNX_FILE),
+            input_names=input_names, output_names=["token_embeddings"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in input_names + ["token_embeddings"]},
+            opset_version=OPSET, dynamo=False
+        )
+    tokenizer.backend_tokenizer.save(os.path.join(out_dir, TOKENIZER_FILE))
+
+    config = {
+        "model_name": model_name,
+        "input_names": input_names,
+        "max_seq_length": st_model.max_seq_length,
+        "pad_token": tokenizer.pad_token,
+        "pad_id": tokenizer.pad_token_id,
+        "pooling": pooling_mode,
+        "normalize": any(type(m).__name__ == "Normalize" for m in st_model),
+        "dim": getattr(st_model, "get_embedding_dimension", st_model.get_sentence_embedding_dimension)(),
+        "quantized": False
+    }
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(os.path.join(out_dir, ONNX_FILE), os.path.join(out_dir, QUANTIZED_FILE), weight_type=QuantType.QInt8)
+        config["quantized"] = True
+
+    #Written last: the export counts as complete only once its config exists
+    with open(os.path.join(out_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    sizes = {name: os.path.getsize(os.path.join(out_dir, name)) / 2**20 for name in (ONNX_FILE, QUANTIZED_FILE) if os.path.exists(os.path.join(out_dir, name))}
+    print(f"Exported {model_name} to {out_dir}: " + ", ".join(f"{name} {mb:.1f} MB" for name, mb in sizes.items()))
+
+def load_config(onnx_dir: str = ONNX_DIR):
+    path = os.path.join(onnx_dir, CONFIG_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class OnnxEncoder:
+    """
+    Query encoder on onnxruntime and the `tokenizers` fast tokenizer; torch is never
+    imported. encode() takes the SentenceTransformer arguments Retriever and the
+    evaluate scripts use and returns the same float32 embeddings (up to quantization).
+    """
+    def __init__(self, onnx_dir: str = ONNX_DIR, quantized: bool = True, threads: int = None):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.config = load_config(onnx_dir)
+        if self.config is None:
+            raise FileNotFoundError(f"No ONNX encoder in {onnx_dir}. Run: python onnx_encoder.py export")
+        if quantized and not self.config["quantized"]:
+            raise FileNotFoundError(f"No quantized ONNX encoder in {onnx_dir}. Export without --no-quantize.")
+        self.variant = "onnx-int8" if quantized else "onnx"
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        model_path = os.path.join(onnx_dir, QUANTIZED_FILE if quantized else ONNX_FILE)
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(onnx_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_id"], pad_token=self.config["pad_token"])
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dim"]
+
+    def _encode_batch(self, texts: list) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": mask,
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64)
+        }
+        tokens = self.session.run(None, {name: inputs[name] for name in self.config["input_names"]})[0]
+        if self.config["pooling"] == "cls":
+            return tokens[:, 0]
+        weights = mask[:, :, None].astype(np.float32)
+        return (tokens * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+
+    def encode(self, sentences, batch_size: int = ENCODE_BATCH_SIZE, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.config["dim"]), dtype=np.float32)
+        #Longest first, like SentenceTransformer, so batches pad to similar lengths
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        out = np.empty((len(texts), self.config["dim"]), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            out[rows] = self._encode_batch([texts[i] for i in rows])
+        if self.config["normalize"] or normalize_embeddings:
+            out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out[0] if single else out
+
+
+def load_encoder(model_name: str = MODEL_NAME, encoder: str = ENCODER, onnx_dir: str = ONNX_DIR, threads: int = None):
+    """
+    Query encoder for `model_name`: an OnnxEncoder when one was exported for this model
+    (or explicitly requested), otherwise the torch SentenceTransformer.
+    `threads` caps the encoder's intra-op threads.
+    """
+    if encoder not in ENCODERS:
+        raise ValueError(f"Unknown encoder '{encoder}'. Choose from: {', '.join(ENCODERS)}")
+    if encoder != "torch":
+        config = load_config(onnx_dir)
+        matches = config is not None and config["model_name"].lower() == model_name.lower()
+        if encoder == "auto" and matches:
+            try:
+                return OnnxEncoder(onnx_dir, quantized=config["quantized"], threads=threads)
+            except ImportError as e:
+                print(f"ONNX encoder unavailable ({e}), falling back to torch")
+        elif encoder != "auto":
+            if not matches:
+                raise FileNotFoundError(f"No ONNX export of {model_name} in {onnx_dir}. Run: python onnx_encoder.py export")
+            return OnnxEncoder(onnx_dir, quantized=encoder == "onnx-int8", threads=threads)
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+    if threads:
+        torch.set_num_threads(threads)
+    return SentenceTransformer(model_name, device='cpu')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the query encoder to ONNX (optionally int8-quantized)")
+    parser.add_argument("command", choices=["export"], help="export: convert the SentenceTransformer model.")
+    parser.add_argument("--model-name", type=str, default=MODEL_NAME, help="SentenceTransformer model to export.")
+    parser.add_argument("--out-dir", type=str, default=ONNX_DIR, help="Directory for the ONNX model and tokenizer.")
+    parser.add_argument("--no-quantize", action="store_true", help="Skip the int8 quantized copy.")
+    args = parser.parse_args()
+    export_onnx(args.model_name, args.out_dir, quantize=not args.no_quantize)
@@ -1,33 +1,154 @@
 import os
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pdfplumber
 
 RAW_DIR = "data/raw"
 PREPROCESSED_DIR = "data/processed"
+MANIFEST_FILE = ".extract_manifest.json"  # kept in the output directory
+NUM_WORKERS = os.cpu_count() or 1
 
 def extract_text_from_pdf(pdf_path: str) -> str:
     #extracts texts from a pdf file using pdfplumber
-    text = ""
+    pages = []
     with pdfplumber.open(pdf_path) as pdf:
         for page in pdf.pages:
             page_text = page.extract_text()
             if page_text:
-                text += page_text + "\n"
-    return text.strip()
+                pages.append(page_text)
+    return "\n".join(pages).strip()
 
-def preprocess_pdfs(raw_dir: str = RAW_DIR, out_dir: str = PREPROCESSED_DIR):
-    #Converts all pdfs in raw_dir into plain text files inside out_dir
+def extract_pdf_to_file(pdf_path: str, txt_path: str) -> int:
+    """
+    Extract a pdf page by page, writing each page to txt_path as soon as it is read,
+    so only one page is held in memory. Output matches extract_text_from_pdf.
+    Returns the number of pages.
+    """
+    tmp_path = txt_path + ".tmp"
+    with pdfplumber.open(pdf_path) as pdf, open(tmp_path, "w", encoding="utf-8") as out:
+        previous = None  # held back one page so the last one can be right-stripped
+        for page in pdf.pages:
+            page_text = page.extract_text()
+            if not page_text:
+                continue
+            if previous is None:
+                page_text = page_text.lstrip()
+            else:
+                out.write(previous + "\n")
+            previous = page_text
+        if previous is not None:
+            out.write(previous.rstrip())
+        n_pages = len(pdf.pages)
+    os.replace(tmp_path, txt_path)
+    return n_pages
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(out_dir: str) -> dict:
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(out_dir: str, manifest: dict):
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def is_unchanged(pdf_path: str, txt_path: str, entry: dict) -> bool:
+    #Cheap size/mtime check first; only hash when the mtime moved but the size did not
+    if entry is None or not os.path.exists(txt_path):
+        return False
+    stat = os.stat(pdf_path)
+    if stat.st_size != entry["size"]:
+        return False
+    if stat.st_mtime_ns == entry["mtime_ns"]:
+        return True
+    if file_hash(pdf_path) != entry["sha256"]:
+        return False
+    entry["mtime_ns"] = stat.st_mtime_ns  # touched but identical: skip the hash next time
+    return True
+
+def _extract_job(pdf_path: str, txt_path: str) -> dict:
+    #Runs in a worker process: extract one pdf and return its manifest entry and timing
+    start = time.perf_counter()
+    n_pages = extract_pdf_to_file(pdf_path, txt_path)
+    stat = os.stat(pdf_path)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": file_hash(pdf_path),
+        "pages": n_pages,
+        "seconds": round(time.perf_counter() - start, 3)
+    }
+
+def preprocess_pdfs(raw_dir: str = RAW_DIR, out_dir: str = PREPROCESSED_DIR, workers: int = NUM_WORKERS, force: bool = False):
+    #Converts all pdfs in raw_dir into plain text files inside out_dir.
+    #Pdfs unchanged since the last run (size/mtime/hash in the manifest) are skipped
+    #unless force is set; the rest are extracted in parallel across worker processes.
     os.makedirs(out_dir, exist_ok=True)
-    for filename in os.listdir(raw_dir):
+    manifest = {} if force else load_manifest(out_dir)
+
+    jobs = {}
+    skipped = 0
+    for filename in sorted(os.listdir(raw_dir)):
         if filename.lower().endswith(".pdf"):
             pdf_path = os.path.join(raw_dir, filename)
             txt_filename = os.path.splitext(filename)[0] + ".txt"
             txt_path = os.path.join(out_dir, txt_filename)
-            
-            text = extract_text_from_pdf(pdf_path)
+            if is_unchanged(pdf_path, txt_path, manifest.get(filename)):
+                skipped += 1
+                continue
+            jobs[filename] = (pdf_path, txt_path)
+
+    if skipped:
+        save_manifest(out_dir, manifest)
+    print(f"{len(jobs)} pdfs to extract, {skipped} unchanged")
+    start = time.perf_counter()
+    timings = []
+
+    def record(filename, entry):
+        manifest[filename] = entry
+        save_manifest(out_dir, manifest)  # after every file, so an interrupted run resumes
+        timings.append((filename, entry["pages"], entry["seconds"]))
+        print(f"Processed {filename} -> {jobs[filename][1]} ({entry['pages']} pages, {entry['seconds']:.2f}s)")
+
+    if workers <= 1:
+        for filename, (pdf_path, txt_path) in jobs.items():
+            try:
+                record(filename, _extract_job(pdf_path, txt_path))
+            except Exception as e:
+                print(f"Failed to extract {filename}: {e}")
+    elif jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_extract_job, *paths): filename for filename, paths in jobs.items()}
+            for future in as_completed(futures):
+                filename = futures[future]
+                try:
+                    record(filename, future.result())
+                except Exception as e:
+                    print(f"Failed to extract {filename}: {e}")
 
-            with open(txt_path, "w", encoding="utf-8") as f:
-                f.write(text)
+    #Per-file timing report, slowest first
+    if timings:
+        print(f"\n{'file':<50} {'pages':>6} {'seconds':>8}")
+        for filename, pages, seconds in sorted(timings, key=lambda t: -t[2]):
+            print(f"{filename:<50} {pages:>6} {seconds:>8.2f}")
+    print(f"\nExtracted {len(timings)} pdfs in {time.perf_counter() - start:.2f}s wall time ({skipped} skipped)")
 
-            print(f"Processed {filename} -> {txt_path}")
 if __name__ == "__main__":
-    preprocess_pdfs()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extract text from lecture transcript pdfs")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="Extraction processes (1 = no pool).")
+    parser.add_argument("--force", action="store_true", help="Re-extract every pdf, ignoring the manifest.")
+    args = parser.parse_args()
+    preprocess_pdfs(workers=args.workers, force=args.force)
@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import numpy as np
+
+STORE_DIRNAME = "passage_store"
+OFFSET_DTYPE = np.dtype("<u8")
+
+# On-disk layout (one directory per store):
+#   text.bin / text.off  UTF-8 passage texts, concatenated; offsets array of n+1 uint64
+#   meta.bin / meta.off  one compact JSON object per passage (every field except "text")
+#   deleted.ids          uint64 rows removed by incremental updates (optional)
+# Row i spans [off[i], off[i+1]) in the matching .bin file. FAISS id i == store row i.
+
+def _map(path: str):
+    """Read-only mmap of a file; empty files map to an empty bytes object."""
+    if os.path.getsize(path) == 0:
+        return b""
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class PassageStoreWriter:
+    """
+    Streams passages into a new store. Files are written under temporary names
+    and moved into place on close(), so readers never see a half-written store.
+    With append=True, passages are added to the end of an existing store in place;
+    existing rows keep their numbers.
+    """
+    def __init__(self, store_dir: str, append: bool = False):
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.append = append
+        self.count = 0
+        self._files = {}
+        self._offset_files = {}
+        self._ends = {}
+        suffix = "" if append else ".tmp"
+        for column in ("text", "meta"):
+            off_path = os.path.join(store_dir, column + ".off")
+            if append:
+                offsets = np.fromfile(off_path, dtype=OFFSET_DTYPE)
+                self.count = len(offsets) - 1
+                self._ends[column] = int(offsets[-1])
+            self._files[column] = open(os.path.join(store_dir, column + ".bin" + suffix), "ab" if append else "wb")
+            self._offset_files[column] = open(off_path + suffix, "ab" if append else "wb")
+            if not append:
+                self._offset_files[column].write(struct.pack("<Q", 0))
+                self._ends[column] = 0
+
+    def add(self, passage: dict) -> int:
+        """Append one passage ({id, text, ...}) and return its row number."""
+        meta = {key: value for key, value in passage.items() if key != "text"}
+        values = {
+            "text": passage["text"].encode("utf-8"),
+            "meta": json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        }
+        for column, data in values.items():
+            self._files[column].write(data)
+            self._ends[column] += len(data)
+            self._offset_files[column].write(struct.pack("<Q", self._ends[column]))
+        self.count += 1
+        return self.count - 1
+
+    def _close_files(self):
+        for f in list(self._files.values()) + list(self._offset_files.values()):
+            f.close()
+
+    def close(self):
+        self._close_files()
+        if self.append:
+            return
+        for column in self._files:
+            for suffix in (".bin", ".off"):
+                path = os.path.join(self.store_dir, column + suffix)
+                os.replace(path + ".tmp", path)
+        #A new store starts without deletions; rows removed from the old one are not this store's rows
+        deleted_path = os.path.join(self.store_dir, "deleted.ids")
+        if os.path.exists(deleted_path):
+            os.remove(deleted_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._close_files()
+
+
+class PassageStore:
+    """
+    Read-only, memory-mapped passage store.
+    Lookup by row is O(1); text is decoded only for the rows actually requested.
+    """
+    def __init__(self, store_dir: str):
+        if not os.path.exists(os.path.join(store_dir, "text.off")):
+            raise FileNotFoundError(f"Passage store not found in {store_dir}. Run knowledge_base.py first.")
+        self.store_dir = store_dir
+        self._offsets = {}
+        self._data = {}
+        for column in ("text", "meta"):
+            self._offsets[column] = np.memmap(os.path.join(store_dir, column + ".off"), dtype=OFFSET_DTYPE, mode="r")
+            self._data[column] = _map(os.path.join(store_dir, column + ".bin"))
+        self.count = len(self._offsets["text"]) - 1
+        deleted_path = os.path.join(store_dir, "deleted.ids")
+        self.deleted = set()
+        if os.path.exists(deleted_path):
+            self.deleted = set(np.fromfile(deleted_path, dtype=OFFSET_DTYPE).tolist())
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _read(self, column: str, row: int) -> str:
+        offsets = self._offsets[column]
+        start, end = int(offsets[row]), int(offsets[row + 1])
+        return str(memoryview(self._data[column])[start:end], "utf-8")
+
+    def text(self, row: int) -> str:
+        return self._read("text", row)
+
+    def meta(self, row: int) -> dict:
+        return json.loads(self._read("meta", row))
+
+    def get(self, row: int) -> dict:
+        """Return the passage dict stored at a FAISS row: {id, text, ...}."""
+        if row < 0 or row >= self.count:
+            raise IndexError(f"Passage row {row} out of range (store has {self.count})")
+        passage = self.meta(row)
+        passage["text"] = self.text(row)
+        return passage
+
+    def __iter__(self):
+        for row in range(self.count):
+            if row not in self.deleted:
+                yield self.get(row)
+
+    def close(self):
+        for data in self._data.values():
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+
+def write_store(passages, store_dir: str) -> int:
+    """Write an iterable of passage dicts to a new store. Returns the passage count."""
+    with PassageStoreWriter(store_dir) as writer:
+        for passage in passages:
+            writer.add(passage)
+    return writer.count
+
+def mark_deleted(store_dir: str, rows: list):
+    """Record rows removed from the index; their bytes stay until the next full build."""
+    if len(rows):
+        with open(os.path.join(store_dir, "deleted.ids"), "ab") as f:
+            np.asarray(rows, dtype=OFFSET_DTYPE).tofile(f)
+
+def convert_mapping(mapping_path: str, store_dir: str) -> int:
+    """Convert a legacy mapping.json ({"0": {id, text}, ...}) into a passage store."""
+    with open(mapping_path, "r", encoding="utf-8") as f:
+        mapping = json.load(f)
+    count = write_store((mapping[key] for key in sorted(mapping, key=int)), store_dir)
+    print(f"Converted {count} passages from {mapping_path} -> {store_dir}")
+    return count
+
+if __name__ == "__main__":
+    # Usage: python passage_store.py [data/index/mapping.json] [data/index/passage_store]
+    mapping_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join("data/index", "mapping.json")
+    store_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.path.dirname(mapping_path), STORE_DIRNAME)
+    convert_mapping(mapping_path, store_dir)
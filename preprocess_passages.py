@@ -1,53 +1,182 @@
 import os
 import json
+import argparse
+from collections import deque
+from onnx_encoder import MODEL_NAME, ONNX_DIR, TOKENIZER_FILE, load_config
+from near_duplicates import NearDuplicateFilter
 
 PREPROCESSED_DIR = "data/processed"
 PASSAGES_DIR = "data/passages"
+DEFAULT_COURSE = "default"  # course of transcripts placed directly in the processed directory
+CHUNK_TOKENS = 224  # tokens per passage; MiniLM truncates at 256 including its special tokens
+OVERLAP_TOKENS = 48  # tokens repeated from the end of the previous passage
+READ_BLOCK = 1 << 16  # characters read from a transcript at a time
+WORD_BATCH = 1024  # words tokenized per call
+MAX_SENTENCE_WORDS = 40  # unpunctuated runs are cut into sentences of this many words
+MIN_DEDUPE_WORDS = 8  # shorter sentences ("OK.", "Any questions?") are never dropped as duplicates
+SENTENCE_END = (".", "!", "?")
 
-def split_into_passages(text: str, chunk_size: int=250, overlap: int = 50) -> list:
+def load_tokenizer(model_name: str = MODEL_NAME, onnx_dir: str = ONNX_DIR):
     """
-    Splits text into overlapping passages. 
-    Example: 250 words per chunk with 50 words overlap
+    Fast tokenizer of the embedding model, used to size passages: the one saved by
+    onnx_encoder.py export when it matches the model, otherwise from the Hugging Face hub.
+    Padding and truncation are turned off, since they would distort the token counts.
     """
-    words = text.split()
-    passages = []
+    from tokenizers import Tokenizer
+    config = load_config(onnx_dir)
+    if config is not None and config["model_name"].lower() == model_name.lower():
+        tokenizer = Tokenizer.from_file(os.path.join(onnx_dir, TOKENIZER_FILE))
+    else:
+        tokenizer = Tokenizer.from_pretrained(model_name if "/" in model_name else f"sentence-transformers/{model_name}")
+    tokenizer.no_padding()
+    tokenizer.no_truncation()
+    return tokenizer
 
-    start = 0
-    idx = 1
-    while start < len(words):
-        end = start + chunk_size 
-        chunk = words[start:end]
-        if not chunk:
-            break
-        passages.append(" ".join(chunk))
-        start += chunk_size - overlap
-        idx += 1
+def iter_words(filepath: str, block_size: int = READ_BLOCK):
+    #Yields the words of a text file, reading it block by block; a word cut by a block boundary is carried over
+    carry = ""
+    with open(filepath, "r", encoding="utf-8") as f:
+        for block in iter(lambda: f.read(block_size), ""):
+            words = (carry + block).split()
+            carry = "" if block[-1].isspace() or not words else words.pop()
+            yield from words
+    if carry:
+        yield carry
 
-    return passages
+def iter_sentences(words, max_words: int = MAX_SENTENCE_WORDS):
+    #Groups a word stream into sentences (lists of words): a word ending in . ! or ? closes one
+    sentence = []
+    for word in words:
+        sentence.append(word)
+        if word.rstrip("\"')").endswith(SENTENCE_END) or len(sentence) == max_words:
+            yield sentence
+            sentence = []
+    if sentence:
+        yield sentence
 
-def process_text_files(in_dir: str = PREPROCESSED_DIR, out_dir: str = PASSAGES_DIR):
-    #Reads all .txt files, splits into passages, and saves as JSON
-    os.makedirs(out_dir, exist_ok=True)
+def drop_duplicate_sentences(words, duplicates: NearDuplicateFilter, min_words: int = MIN_DEDUPE_WORDS):
+    """
+    The words of every sentence `duplicates` has not seen (exactly or nearly) before.
+    Deduplicating sentences before they are chunked removes repeated boilerplate even
+    when it shares a passage with lecture text. Sentences under min_words are always kept.
+    """
+    for sentence in iter_sentences(words):
+        if len(sentence) < min_words or duplicates.add(" ".join(sentence)):
+            yield from sentence
+
+def iter_token_counts(words, tokenizer, batch_size: int = WORD_BATCH):
+    #(word, tokens) pairs; words are tokenized in batches, without special tokens.
+    #BERT-style tokenizers split on whitespace first, so the counts add up to the count of the joined text.
+    batch = []
+    for word in words:
+        batch.append(word)
+        if len(batch) == batch_size:
+            yield from zip(batch, (len(e.ids) for e in tokenizer.encode_batch(batch, add_special_tokens=False)))
+            batch = []
+    if batch:
+        yield from zip(batch, (len(e.ids) for e in tokenizer.encode_batch(batch, add_special_tokens=False)))
+
+def split_into_passages(words, tokenizer, chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = OVERLAP_TOKENS):
+    """
+    Yields overlapping passages of at most chunk_tokens model tokens (whole words only),
+    each starting with the last ~overlap_tokens tokens of the previous one.
+    `words` is any iterable of words (see iter_words) or a string; nothing beyond the
+    current window is held in memory.
+    """
+    if isinstance(words, str):
+        words = words.split()
+    window = deque()  # (word, tokens)
+    total = 0
+    for word, count in iter_token_counts(words, tokenizer):
+        if window and total + count > chunk_tokens:
+            yield " ".join(w for w, _ in window)
+            #Keep the tail as the overlap, always dropping at least the first word
+            tail = deque()
+            kept = 0
+            for w, c in reversed(window):
+                if len(tail) == len(window) - 1 or kept + c > overlap_tokens:
+                    break
+                tail.appendleft((w, c))
+                kept += c
+            window, total = tail, kept
+            while window and total + count > chunk_tokens:
+                total -= window.popleft()[1]
+        window.append((word, count))
+        total += count
+    if window:
+        yield " ".join(w for w, _ in window)
+
+def course_sources(in_dir: str = PREPROCESSED_DIR, course: str = None) -> list:
+    """
+    (course, directory) pairs to read transcripts from: each subdirectory of in_dir is
+    a course, and .txt files directly in in_dir belong to `course` (DEFAULT_COURSE).
+    """
+    sources = [(name, os.path.join(in_dir, name)) for name in sorted(os.listdir(in_dir)) if os.path.isdir(os.path.join(in_dir, name))]
+    if any(f.endswith(".txt") for f in os.listdir(in_dir)):
+        sources.insert(0, (course or DEFAULT_COURSE, in_dir))
+    return sources
+
+def write_jsonl(passages, outpath: str) -> int:
+    #One passage per line, written to a temporary file that replaces outpath once complete
+    count = 0
+    with open(outpath + ".tmp", "w", encoding="utf-8") as f:
+        for passage in passages:
+            f.write(json.dumps(passage, ensure_ascii=False) + "\n")
+            count += 1
+    os.replace(outpath + ".tmp", outpath)
+    return count
+
+def process_text_files(in_dir: str = PREPROCESSED_DIR, out_dir: str = PASSAGES_DIR, course: str = None,
+                       tokenizer=None, chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = OVERLAP_TOKENS,
+                       dedupe: bool = True) -> dict:
+    #Streams every .txt file through the duplicate sentence filter and the token chunker into JSONL, one directory per course.
+    #Each passage records its course, lecture and position in the lecture; ids are unique across courses.
+    #Duplicates are dropped within a course, so every course shard still holds all of its own content.
+    tokenizer = tokenizer or load_tokenizer()
+    totals = {"files": 0, "passages": 0, "exact_duplicates": 0, "near_duplicates": 0}
+    for course_name, course_dir in course_sources(in_dir, course):
+        course_out = os.path.join(out_dir, course_name)
+        os.makedirs(course_out, exist_ok=True)
+        duplicates = NearDuplicateFilter() if dedupe else None
 
-    for filename in os.listdir(in_dir):
-        if filename.endswith(".txt"):
-            filepath = os.path.join(in_dir, filename)
-            lecture_name = os.path.splitext(filename)[0]
+        for filename in sorted(os.listdir(course_dir)):
+            if filename.endswith(".txt"):
+                filepath = os.path.join(course_dir, filename)
+                lecture_name = os.path.splitext(filename)[0]
 
-            with open(filepath, "r", encoding="utf-8") as f:
-                text = f.read()
+                words = iter_words(filepath)
+                if duplicates is not None:
+                    words = drop_duplicate_sentences(words, duplicates)
+                passages = (
+                    {"id": f"{course_name}/{lecture_name}_{i+1}", "text": p,
+                     "course": course_name, "lecture": lecture_name, "position": i}
+                    for i, p in enumerate(split_into_passages(words, tokenizer, chunk_tokens, overlap_tokens))
+                )
 
-            passages = split_into_passages(text)
+                outpath = os.path.join(course_out, lecture_name + ".jsonl")
+                count = write_jsonl(passages, outpath)
+                legacy = os.path.join(course_out, lecture_name + ".json")
+                if os.path.exists(legacy):
+                    os.remove(legacy)  # written by earlier versions; would be indexed twice
 
-            json_data = [
-                {"id": f"lecture_name_{i+1}", "text": p}
-                for i, p in enumerate(passages)
-            ]
+                totals["files"] += 1
+                totals["passages"] += count
+                print(f"Processed {filename} -> {outpath} ({count} passages)")
 
-            outpath = os.path.join(out_dir, lecture_name + ".json")
-            with open(outpath, "w", encoding="utf-8") as f:
-                json.dump(json_data, f, indent=2, ensure_ascii=False)
+        if duplicates is not None:
+            totals["exact_duplicates"] += duplicates.exact
+            totals["near_duplicates"] += duplicates.near
+    print(f"{totals['passages']} passages from {totals['files']} files; dropped {totals['exact_duplicates']} exact "
+          f"and {totals['near_duplicates']} near duplicate sentences")
+    return totals
 
-            print(f"Processed {filename} -> {outpath}")
 if __name__ == "__main__":
-    process_text_files()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Split transcripts into passages, one directory per course")
+    parser.add_argument("--course", type=str, default=DEFAULT_COURSE, help="Course of the .txt files directly in the processed directory (subdirectories name their own course).")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS, help="Maximum model tokens per passage.")
+    parser.add_argument("--overlap-tokens", type=int, default=OVERLAP_TOKENS, help="Tokens repeated from the end of the previous passage.")
+    parser.add_argument("--model", type=str, default=MODEL_NAME, help="Embedding model whose tokenizer sizes the passages.")
+    parser.add_argument("--no-dedupe", action="store_true", help="Keep exact and near-duplicate sentences.")
+    args = parser.parse_args()
+    process_text_files(course=args.course, tokenizer=load_tokenizer(args.model), chunk_tokens=args.chunk_tokens,
+                       overlap_tokens=args.overlap_tokens, dedupe=not args.no_dedupe)
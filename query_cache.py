@@ -0,0 +1,154 @@
+import os
+import re
+import time
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+
+CACHE_DIR = "data/cache"
+EMBEDDING_CACHE_SIZE = 4096
+RETRIEVAL_CACHE_SIZE = 2048
+ANSWER_CACHE_SIZE = 1024
+ANSWER_CACHE_TTL = 24 * 3600  # seconds; None keeps entries until evicted
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation so trivial variants share a key."""
+    return re.sub(r"\s+", " ", query.strip().lower()).rstrip("?.! ")
+
+
+class LRUCache:
+    """
+    Bounded LRU cache with optional TTL and an optional SQLite backing store.
+    Memory misses fall through to disk, so entries survive a restart.
+    Thread-safe; values must be picklable when a backing store is used.
+    """
+    def __init__(self, name: str, max_size: int, ttl: float = None, path: str = None):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()  # key -> (created, value)
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, created REAL, value BLOB)")
+            self._db.commit()
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _load(self, key: str):
+        row = self._db.execute("SELECT created, value FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if self._expired(row[0]):
+            self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._db.commit()
+            return None
+        return row[0], pickle.loads(row[1])
+
+    def _remember(self, key: str, created: float, value):
+        self._items[key] = (created, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def get(self, key: str):
+        """Return the cached value or None."""
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and self._expired(entry[0]):
+                del self._items[key]
+                entry = None
+            if entry is None and self._db is not None:
+                entry = self._load(key)
+                if entry is not None:
+                    self._remember(key, *entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, value):
+        with self._lock:
+            created = time.time()
+            self._remember(key, created, value)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO cache (key, created, value) VALUES (?, ?, ?)",
+                                 (key, created, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+                # Keep the backing store bounded as well: drop the oldest rows
+                self._db.execute("DELETE FROM cache WHERE key NOT IN (SELECT key FROM cache ORDER BY created DESC LIMIT ?)",
+                                 (self.max_size,))
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class QueryCache:
+    """
+    Three cache levels around the RAG pipeline:
+    - embeddings: normalized query -> query vector (independent of the index)
+    - retrieval:  (index version, k, normalized query) -> retrieved passages
+    - answers:    (index version, k, normalized query) -> generate_answer response
+    When the index version changes, the retrieval and answer levels are cleared.
+    Pass cache_dir=None for a memory-only cache.
+    """
+    def __init__(self, cache_dir: str = CACHE_DIR, embedding_size: int = EMBEDDING_CACHE_SIZE,
+                 retrieval_size: int = RETRIEVAL_CACHE_SIZE, answer_size: int = ANSWER_CACHE_SIZE,
+                 answer_ttl: float = ANSWER_CACHE_TTL):
+        self.cache_dir = cache_dir
+        def path(name):
+            return os.path.join(cache_dir, name + ".sqlite") if cache_dir else None
+        self.embeddings = LRUCache("embeddings", embedding_size, path=path("embeddings"))
+        self.retrieval = LRUCache("retrieval", retrieval_size, path=path("retrieval"))
+        self.answers = LRUCache("answers", answer_size, ttl=answer_ttl, path=path("answers"))
+        self.index_version = None
+
+    def set_index_version(self, version: str):
+        """Bind the cache to an index build; entries from any other build are dropped."""
+        if version == self.index_version:
+            return
+        stored = None
+        version_path = os.path.join(self.cache_dir, "index_version") if self.cache_dir else None
+        if self.index_version is None and version_path and os.path.exists(version_path):
+            with open(version_path, "r", encoding="utf-8") as f:
+                stored = f.read().strip()
+        if stored != version:
+            self.retrieval.clear()
+            self.answers.clear()
+        self.index_version = version
+        if version_path:
+            with open(version_path, "w", encoding="utf-8") as f:
+                f.write(version)
+
+    def key(self, query: str, k: int) -> str:
+        return f"{self.index_version}|{k}|{normalize_query(query)}"
+
+    def stats(self) -> dict:
+        return {
+            "index_version": self.index_version,
+            "embeddings": self.embeddings.stats(),
+            "retrieval": self.retrieval.stats(),
+            "answers": self.answers.stats()
+        }
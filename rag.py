@@ -1,78 +1,584 @@
-import os
-import json
-import subprocess
+import time
+import asyncio
 from retrieval_utils import Retriever
+from course_shards import filter_key, normalize_filters
+import contextvars
+from llm_backend import GenerationBackend, GenerationError, estimate_tokens, get_backend
+from query_cache import QueryCache
+from semantic_cache import SemanticCache
+from micro_batcher import MicroBatcher
+from context_packer import CONTEXT_TOKEN_BUDGET, fit_context
+from scheduler import DeadlineExceeded, GenerationScheduler
+from confidence_gate import NO_ANSWER, ConfidenceGate
+import metrics
 
 # Configuration
-MODEL_FILE = 'llama-3-8b-instruct-q4.gguf'  
-LLAMA_FILE_EXE = 'llamafile-0.9.3.exe'  
 TOP_K = 4  
-MAX_NEW_TOKENS = 200 
-TEMPERATURE = 0.5  
+MAX_BULLETS = 5  # answers are cut to this many lines, so generation stops once they are written
+STOP_SEQUENCES = ["Question:", "Context:", "<|eot_id|>"]
+BATCH_WAIT_MS = 5  # window for grouping concurrent retrievals in the web app
 
-class RAGQA:
-    def __init__(self, retriever: Retriever):
-        self.retriever = retriever
-        if not os.path.exists(LLAMA_FILE_EXE):
-            raise FileNotFoundError(f"{LLAMA_FILE_EXE} not found. Download from https://github.com/Mozilla-Ocho/llamafile/releases and rename to llamafile.exe.")
-        if not os.path.exists(MODEL_FILE):
-            raise FileNotFoundError(f"{MODEL_FILE} not found. Download with: huggingface-cli download bartowski/Meta-Llama-3.1-8B-Instruct-GGUF Meta-Llama-3.1-8B-Instruct-Q4_K_M.gguf --local-dir . and rename to {MODEL_FILE}.")
+def answer_end(text: str) -> int:
+    """
+    Index just past the newline that terminates the MAX_BULLETS-th non-empty line
+    after the last 'Answer:', or -1 if the answer is not complete yet.
+    """
+    pos = text.rfind("Answer:")
+    pos = 0 if pos < 0 else pos + len("Answer:")
+    finished = 0
+    while True:
+        newline = text.find('\n', pos)
+        if newline < 0:
+            return -1
+        if text[pos:newline].strip():
+            finished += 1
+            if finished >= MAX_BULLETS:
+                return newline + 1
+        pos = newline + 1
 
-    def format_prompt(self, query: str, passages: list) -> str:
-        """Format the prompt with shortened retrieved passages as context to reduce length."""
-        context_text = "\n\n".join([f"Passage {i+1}: {p['text'][:200]}..." for i, p in enumerate(passages)])  # Shorten each passage to 200 characters
-        prompt = f"""Using the following context from MIT OCW lecture transcripts, provide a concise answer in bullet points (max 4-5 points) that is crisp and understandable, fully addressing the question. Start with 'Answer:' followed by the bullet points prefixed with '- ' (e.g., - 1st Point, - 2nd Point). Each bullet point in a new line. Synthesize key insights from all provided passages without repeating the question or context verbatim. If relevant information is insufficient, include a bullet explaining the limitation.Ensure the Answer is complete with no loose ending.
+def stop_prefix_len(text: str) -> int:
+    """Length of the longest tail of text that could still grow into a stop sequence."""
+    for n in range(min(len(text), max(len(s) for s in STOP_SEQUENCES) - 1), 0, -1):
+        if any(s.startswith(text[-n:]) for s in STOP_SEQUENCES):
+            return n
+    return 0
+
+class AnswerCutter:
+    """
+    Incremental trimming of streamed model output, shared by the sync and async paths:
+    feed() returns the text that is safe to emit and sets `done` once a stop sequence
+    appears or MAX_BULLETS answer lines are complete.
+    """
+    def __init__(self):
+        self.text = ""
+        self.emitted = 0
+        self.done = False
+
+    def feed(self, piece: str) -> str:
+        self.text += piece
+        cuts = [self.text.find(s) for s in STOP_SEQUENCES if s in self.text]
+        end = min(cuts) if cuts else answer_end(self.text)
+        if end < 0:
+            # Hold back a tail that may be the start of a stop sequence spanning two pieces
+            end = len(self.text) - stop_prefix_len(self.text)
+        else:
+            self.done = True
+        out = self.text[self.emitted:end] if end > self.emitted else ""
+        self.emitted = max(self.emitted, end)
+        return out
+
+    def flush(self) -> str:
+        """Whatever was held back, once the backend has finished."""
+        out = self.text[self.emitted:] if not self.done else ""
+        self.emitted = len(self.text)
+        return out
+
+class GenerationTimer:
+    """
+    Splits a streamed generation into prefill (until the first piece arrives) and decode.
+    The durations also go into `stats` (prefill_s, generate_s) for the confidence gate.
+    """
+    def __init__(self, stats: dict = None):
+        self.enabled = metrics.timing()
+        self.stats = stats
+        self.start = time.perf_counter()
+        self.first = None
+
+    def piece(self):
+        if self.first is None:
+            self.first = time.perf_counter()
+
+    def finish(self, text: str):
+        if self.first is None:
+            return
+        end = time.perf_counter()
+        if self.stats is not None:
+            self.stats["prefill_s"] = self.first - self.start
+            self.stats["generate_s"] = end - self.start
+        if not self.enabled:
+            return
+        metrics.record("prefill", self.first - self.start)
+        metrics.record("decode", end - self.first)
+        metrics.record_rate(estimate_tokens(text), end - self.first)
+
+# Static part of every prompt. It comes first and never changes, so backends can keep
+# its KV state cached and only prefill the context and question (see cache_prefix).
+PROMPT_PREFIX = """Using the following context from MIT OCW lecture transcripts, provide a concise answer in bullet points (max 4-5 points) that is crisp and understandable, fully addressing the question. Start with 'Answer:' followed by the bullet points prefixed with '- ' (e.g., - 1st Point, - 2nd Point). Each bullet point in a new line. Synthesize key insights from all provided passages without repeating the question or context verbatim. If relevant information is insufficient, include a bullet explaining the limitation.Ensure the Answer is complete with no loose ending.
 
 Context:
-{context_text}
+"""
+
+def render_prompt(context_text: str, query: str) -> str:
+    """Fill the context and question in after the shared PROMPT_PREFIX."""
+    return PROMPT_PREFIX + f"""{context_text}
 
 Question: {query}
 
 Answer:"""
-        print(f"Passages included: {len(passages)}")
-        return prompt
 
-    def generate_answer(self, query: str, k: int = TOP_K) -> dict:
-        """Retrieve passages and generate a precise paragraph-sized answer using llamafile."""
-        retrieved = self.retriever.get_top_k(query, k=k)
+class RAGQA:
+    def __init__(self, retriever: Retriever, backend: GenerationBackend = None, cache: QueryCache = None,
+                 semantic_cache: SemanticCache = None, batch_wait_ms: float = None,
+                 context_budget: int = CONTEXT_TOKEN_BUDGET, scheduler: GenerationScheduler = None,
+                 gate: ConfidenceGate = None):
+        self.retriever = retriever
+        self.context_budget = context_budget
+        self.scheduler = scheduler  # when set, generations wait for a slot and run under a deadline
+        self.backend = backend if backend is not None else get_backend()
+        self.cache = cache if cache is not None else retriever.cache
+        self.semantic_cache = semantic_cache
+        # With a gate, off-topic questions are answered without the LLM and k is chosen per question
+        self.gate = gate
+        if gate is not None and retriever.mode != "dense":
+            print(f"Confidence gate disabled: it is calibrated on dense distances, the retriever runs in {retriever.mode} mode")
+            self.gate = None
+        elif gate is not None and gate.model_name not in (None, retriever.model_name):
+            print(f"Confidence gate disabled: it was calibrated for {gate.model_name}, not {retriever.model_name}")
+            self.gate = None
+        elif gate is not None and gate.encoder not in (None, retriever.encoder):
+            print(f"Confidence gate disabled: it was calibrated with the {gate.encoder} encoder, the retriever uses {retriever.encoder}")
+            self.gate = None
+        if semantic_cache is not None:
+            semantic_cache.set_index_version(retriever.index_version)
+            retriever.on_swap(semantic_cache.set_index_version)  # a hot-swapped index invalidates cached answers
+        if self.cache is not None and self.cache is not retriever.cache:
+            retriever.on_swap(self.cache.set_index_version)
+        try:
+            self.backend.cache_prefix(PROMPT_PREFIX)
+        except GenerationError as e:
+            print(f"Prompt prefix cache unavailable ({self.backend.name} backend): {e}")
+        # With batch_wait_ms set, retrievals from concurrent threads are grouped into one
+        # embedding pass and FAISS search (see MicroBatcher)
+        self.batcher = None
+        if batch_wait_ms is not None:
+            self.batcher = MicroBatcher(self.lookup_requests, max_wait_ms=batch_wait_ms, name="retrieval-batcher")
+
+    def answer_key(self, query: str, k: int, filters: dict = None) -> str:
+        return filter_key(filters) + self.cache.key(query, k)
+
+    def cached_answer(self, query: str, k: int, filters: dict = None):
+        """Return a previously generated response for this exact (normalized) query and scope, or None."""
+        if self.cache is None:
+            return None
+        response = self.cache.answers.get(self.answer_key(query, k, filters))
+        if response is None:
+            return None
+        return {**response, "question": query, "cached": True}
+
+    def lookup_batch(self, queries: list, k: int, filters: dict = None) -> list:
+        """
+        Retrieve passages for many queries with one embedding pass and one index search.
+        Returns a (retrieved passages, query vector) pair per query; the vector is only
+        computed when the semantic cache needs it.
+        """
+        query_vecs = self.retriever.embed_queries(queries) if self.semantic_cache is not None else None
+        found = self.retriever.get_top_k_batch(queries, k, query_vecs, filters=filters)
+        return [(retrieved, query_vecs[i:i + 1] if query_vecs is not None else None) for i, retrieved in enumerate(found)]
+
+    def lookup_requests(self, requests: list) -> list:
+        """
+        MicroBatcher handler: requests are (query, k, filters) triples, batched per
+        distinct k and filter. Each result also carries the stage timings of the batch it ran in.
+        """
+        results = [None] * len(requests)
+        groups = {}
+        for i, (query, k, filters) in enumerate(requests):
+            groups.setdefault((k, filter_key(filters)), []).append(i)
+        for (k, _), rows in groups.items():
+            with metrics.breakdown() as timings:
+                found = self.lookup_batch([requests[i][0] for i in rows], k, requests[rows[0]][2])
+            for i, result in zip(rows, found):
+                results[i] = (*result, timings)
+        return results
+
+    def check_semantic(self, query: str, retrieved: list, query_vec):
+        """Look the retrieval up in the semantic cache; returns the retrieve() triple."""
+        if query_vec is not None and retrieved:
+            hit = self.semantic_cache.lookup(query_vec, [p["id"] for p in retrieved])
+            if hit is not None:
+                response, similarity = hit
+                return {**response, "question": query, "cached": True, "cache_similarity": round(similarity, 4)}, retrieved, query_vec
+        return None, retrieved, query_vec
+
+    def retrieve(self, query: str, k: int, filters: dict = None):
+        """
+        Check the answer caches and retrieve passages, from the courses / lectures in
+        filters only when given. Returns (cached response or None, retrieved passages, query vector).
+        """
+        with metrics.stage("retrieve"):
+            filters = normalize_filters(filters)
+            cached = self.cached_answer(query, k, filters)
+            if cached is not None:
+                return cached, None, None
+
+            if self.batcher is not None:
+                retrieved, query_vec, batch_timings = self.batcher.submit((query, k, filters))
+                metrics.merge(batch_timings)
+            else:
+                retrieved, query_vec = self.lookup_batch([query], k, filters)[0]
+            return self.check_semantic(query, retrieved, query_vec)
+
+    def retrieve_many(self, queries: list, k: int, filters: dict = None) -> list:
+        """Batch form of retrieve: one retrieve() triple per query, in order."""
+        filters = normalize_filters(filters)
+        results = [None] * len(queries)
+        misses = []
+        for i, query in enumerate(queries):
+            cached = self.cached_answer(query, k, filters)
+            if cached is not None:
+                results[i] = (cached, None, None)
+            else:
+                misses.append(i)
+        if misses:
+            found = self.lookup_batch([queries[i] for i in misses], k, filters)
+            for i, (retrieved, query_vec) in zip(misses, found):
+                results[i] = self.check_semantic(queries[i], retrieved, query_vec)
+        return results
+
+    def store_answer(self, query: str, k: int, query_vec, retrieved: list, response: dict, output: str,
+                     filters: dict = None):
+        # Failed generations are not cached so the next request retries, nor are answers
+        # from an index version that was swapped out while they were generated
+        if output is None or response.get("index_version") != self.retriever.version:
+            return
+        if self.cache is not None:
+            self.cache.answers.put(self.answer_key(query, k, normalize_filters(filters)), response)
+        if self.semantic_cache is not None:
+            self.semantic_cache.put(query_vec, [p["id"] for p in retrieved], response)
+
+    def apply_gate(self, retrieved: list):
+        """
+        Run the confidence gate on retrieved passages. Returns (passages to generate from,
+        gate decision); the decision is None without a gate, and says answer=False when the
+        question should get the no-answer response instead of a generation.
+        """
+        if self.gate is None:
+            return retrieved, None
+        with metrics.stage("gate"):
+            decision = self.gate.decide(retrieved)
+            self.gate.record(decision, len(retrieved))
+        return retrieved[:decision["k"]], decision
+
+    def no_answer(self, query: str, decision: dict, index_version: str = None) -> dict:
+        """Response for a question the gate turned away: same fields as build_response, no generation."""
+        return {
+            "question": query,
+            "answer": NO_ANSWER,
+            "sources": [],
+            "retrieval_count": 0,
+            "prompt_tokens": 0,
+            "prefill": {},
+            "queue_wait_ms": None,
+            "index_version": index_version,
+            "gate": decision,
+            "failed": False,
+            "cached": False
+        }
+
+    def format_prompt(self, query: str, passages: list) -> str:
+        """Format the prompt with the retrieved passages packed into the context token budget."""
+        return self.build_prompt(query, passages)[0]
+
+    def build_prompt(self, query: str, passages: list):
+        """
+        Build the prompt: the best sentences of the retrieved passages, deduplicated and
+        packed into context_budget tokens (see context_packer.py).
+        Returns (prompt, prompt token count).
+        """
+        with metrics.stage("prompt"):
+            context = fit_context(query, passages, self.backend.count_tokens, self.context_budget)
+            prompt = render_prompt(context["text"], query)
+            prompt_tokens = self.backend.count_tokens(prompt)
+        print(f"Passages included: {len(context['passages'])} of {len(passages)} ({context['sentences']} sentences, {prompt_tokens} prompt tokens)")
+        return prompt, prompt_tokens
+
+    def stream_tokens(self, prompt: str, stats: dict = None):
+        """
+        Yield generated text as it arrives, stopping the backend as soon as a stop
+        sequence appears or MAX_BULLETS answer lines are complete.
+        The backend fills `stats` with prefill figures (tokens saved by the prefix cache).
+        With a scheduler, generation first waits for a slot: QueueFull is raised when the
+        queue is full and DeadlineExceeded when the request runs past its deadline.
+        """
+        stats = stats if stats is not None else {}
+        ticket = self.scheduler.admit() if self.scheduler is not None else None
+        try:
+            if ticket is not None:
+                ticket.wait()
+                stats["queue_wait_ms"] = round(ticket.wait_ms, 1)
+                metrics.record("queue", ticket.wait_ms / 1000)
+            yield from self._stream_text(prompt, stats, ticket.cancel_token if ticket is not None else None)
+        except GenerationError as e:
+            if ticket is not None and ticket.cancel_token.reason == "deadline":
+                raise DeadlineExceeded(f"Generation did not finish within {self.scheduler.timeout}s") from e
+            raise
+        except GeneratorExit:
+            # The consumer stopped reading (client disconnected): free the slot right away
+            if ticket is not None:
+                ticket.cancel("client disconnected")
+            raise
+        finally:
+            if ticket is not None:
+                ticket.release()
+
+    def _stream_text(self, prompt: str, stats: dict, cancel):
+        cutter = AnswerCutter()
+        timer = GenerationTimer(stats)
+        stream = self.backend.stream(prompt, stop=STOP_SEQUENCES, stats=stats, cancel=cancel)
+        try:
+            for piece in stream:
+                timer.piece()
+                text = cutter.feed(piece)
+                if text:
+                    yield text
+                if cutter.done:
+                    return
+            text = cutter.flush()
+            if text:
+                yield text
+        finally:
+            stream.close()
+            timer.finish(cutter.text)
+
+    async def astream_tokens(self, prompt: str, stats: dict = None):
+        """stream_tokens() for the asyncio server: slot waits and generation never block the event loop."""
+        stats = stats if stats is not None else {}
+        ticket = self.scheduler.admit() if self.scheduler is not None else None
+        try:
+            if ticket is not None:
+                await ticket.wait_async()
+                stats["queue_wait_ms"] = round(ticket.wait_ms, 1)
+                metrics.record("queue", ticket.wait_ms / 1000)
+            cutter = AnswerCutter()
+            timer = GenerationTimer(stats)
+            stream = self.backend.astream(prompt, stop=STOP_SEQUENCES, stats=stats,
+                                          cancel=ticket.cancel_token if ticket is not None else None)
+            try:
+                async for piece in stream:
+                    timer.piece()
+                    text = cutter.feed(piece)
+                    if text:
+                        yield text
+                    if cutter.done:
+                        return
+                text = cutter.flush()
+                if text:
+                    yield text
+            finally:
+                await stream.aclose()
+                timer.finish(cutter.text)
+        except GenerationError as e:
+            if ticket is not None and ticket.cancel_token.reason == "deadline":
+                raise DeadlineExceeded(f"Generation did not finish within {self.scheduler.timeout}s") from e
+            raise
+        except (GeneratorExit, asyncio.CancelledError):
+            # The client went away: free the slot (or leave the queue) right away
+            if ticket is not None:
+                ticket.cancel("client disconnected")
+            raise
+        finally:
+            if ticket is not None:
+                ticket.release()
+
+    def build_response(self, query: str, output: str, retrieved: list, prompt_tokens: int = None,
+                       prefill: dict = None, index_version: str = None, gate: dict = None) -> dict:
+        """Clean up raw model output and attach the retrieved sources."""
+        with metrics.stage("postprocess"):
+            if output is None:
+                answer = "Generation failed. Check model file and llamafile parameters."
+            else:
+                answer = output.strip().split("Answer:")[-1].strip() #if "Answer:" in output else output.strip()
+                lines = [line.strip() for line in answer.split('\n') if line.strip() and not line.strip().startswith("Answer:")]
+                answer = '\n'.join(lines) if lines else "No response generated."
+        
+            words = answer.split()
+            answer = '\n'.join(answer.split('\n')[:MAX_BULLETS]) if len(words) > 20 else answer if len(words) > 2 else "The retrieved context lacks sufficient relevant information to generate a detailed response."
+
+            prefill = dict(prefill or {})
+            queue_wait_ms = prefill.pop("queue_wait_ms", None)
+            prefill_s, generate_s = prefill.pop("prefill_s", None), prefill.pop("generate_s", None)
+            if self.gate is not None and generate_s is not None:
+                self.gate.observe(generate_s, prefill_s, len(retrieved))
+            sources = [{"id": p["id"], "text_snippet": p["text"][:200] + "..." if len(p["text"]) > 200 else p["text"], "score": p["score"],
+                        **{key: p[key] for key in ("course", "lecture") if key in p}} for p in retrieved]
+        
+            return {
+                "question": query,
+                "answer": answer,
+                "sources": sources,
+                "retrieval_count": len(sources),
+                "prompt_tokens": prompt_tokens,
+                "prefill": prefill,
+                "queue_wait_ms": queue_wait_ms,
+                "index_version": index_version,
+                "gate": gate,
+                "failed": output is None,  # the backend errored; the answer is a placeholder
+                "cached": False
+            }
+
+    def generate_answer(self, query: str, k: int = TOP_K, filters: dict = None) -> dict:
+        """
+        Retrieve passages and generate a precise paragraph-sized answer using the generation backend.
+        filters ({"course": ..., "lectures": [...]}) scope the question to those courses / lectures.
+        """
+        with metrics.stage("total"):
+            return self.answer_retrieved(query, k, *self.retrieve(query, k, filters), filters=filters)
+
+    def generate_answers(self, queries: list, k: int = TOP_K, filters: dict = None) -> list:
+        """
+        Answer several questions: retrieval for all of them is batched, generation
+        then runs one question at a time on the backend.
+        """
+        return [self.answer_retrieved(query, k, *retrieval, filters=filters)
+                for query, retrieval in zip(queries, self.retrieve_many(queries, k, filters))]
+
+    def answer_retrieved(self, query: str, k: int, cached: dict, retrieved: list, query_vec, filters: dict = None) -> dict:
+        """Generate the answer for a query whose retrieve() result is already known."""
+        if cached is not None:
+            return cached
         
         if not retrieved:
             return {"answer": "No relevant information found.", "sources": []}
         
-        prompt = self.format_prompt(query, retrieved)
+        version = self.retriever.version  # the index the passages came from
+        retrieved, gate = self.apply_gate(retrieved)
+        if gate is not None and not gate["answer"]:
+            return self.no_answer(query, gate, version)
+        prompt, prompt_tokens = self.build_prompt(query, retrieved)
         
-        cmd = [
-            LLAMA_FILE_EXE,
-            '--cli',  
-            '-m', MODEL_FILE,  
-            '--prompt', prompt,
-            '--n-predict', str(MAX_NEW_TOKENS),
-            '--temp', str(TEMPERATURE),
-            '--top-k', '50',
-            '--no-display-prompt',
-            '--threads', '4'  
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=None)  
-        
-        if result.returncode != 0:
-            print(f"Generation error (return code {result.returncode}): {result.stderr}")
-            answer = "Generation failed. Check model file and llamafile parameters."
-        else:
-            answer = result.stdout.strip().split("Answer:")[-1].strip() #if "Answer:" in result.stdout else result.stdout.strip()
-            lines = [line.strip() for line in answer.split('\n') if line.strip() and not line.strip().startswith("Answer:")]
-            answer = '\n'.join(lines) if lines else "No response generated."
+        prefill = {}
+        try:
+            output = "".join(self.stream_tokens(prompt, prefill))
+        except GenerationError as e:
+            print(f"Generation error ({self.backend.name} backend): {e}")
+            output = None
         
-        words = answer.split()
-        answer = '\n'.join(answer.split('\n')[:5]) if len(words) > 20 else answer if len(words) > 2 else "The retrieved context lacks sufficient relevant information to generate a detailed response."
+        response = self.build_response(query, output, retrieved, prompt_tokens, prefill, version, gate)
+        self.store_answer(query, k, query_vec, retrieved, response, output, filters)
+        return response
 
-        sources = [{"id": p["id"], "text_snippet": p["text"][:200] + "..." if len(p["text"]) > 200 else p["text"], "score": p["score"]} for p in retrieved]
+    def stream_answer(self, query: str, k: int = TOP_K, filters: dict = None):
+        """
+        Streaming variant of generate_answer. Yields event dicts:
+        {"type": "token", "text": ...} while generating, then one
+        {"type": "done", ...} carrying the same fields as generate_answer.
+        """
+        cached, retrieved, query_vec = self.retrieve(query, k, filters)
+        if cached is not None:
+            yield {"type": "done", **cached}
+            return
         
-        return {
-            "question": query,
-            "answer": answer,
-            "sources": sources,
-            "retrieval_count": len(sources)
-        }
+        if not retrieved:
+            yield {"type": "done", "question": query, "answer": "No relevant information found.", "sources": [], "retrieval_count": 0}
+            return
+        
+        version = self.retriever.version  # the index the passages came from
+        retrieved, gate = self.apply_gate(retrieved)
+        if gate is not None and not gate["answer"]:
+            yield {"type": "done", **self.no_answer(query, gate, version)}
+            return
+        prompt, prompt_tokens = self.build_prompt(query, retrieved)
+        
+        pieces = []
+        prefill = {}
+        tokens = self.stream_tokens(prompt, prefill)
+        try:
+            for piece in tokens:
+                pieces.append(piece)
+                yield {"type": "token", "text": piece}
+            output = "".join(pieces)
+        except GenerationError as e:
+            print(f"Generation error ({self.backend.name} backend): {e}")
+            output = None
+        finally:
+            tokens.close()  # also runs when the client disconnects mid-stream
+        
+        response = self.build_response(query, output, retrieved, prompt_tokens, prefill, version, gate)
+        self.store_answer(query, k, query_vec, retrieved, response, output, filters)
+        yield {"type": "done", **response}
+
+    # Async counterparts for the asyncio server (app_async.py). Retrieval, prompt packing and
+    # cache writes are CPU-bound and run on `executor`; generation is awaited on the event loop.
+
+    async def run_blocking(self, executor, fn, *args):
+        #Run fn on the executor in a copy of this context, so stage timings reach the request's breakdown
+        return await asyncio.get_running_loop().run_in_executor(executor, contextvars.copy_context().run, fn, *args)
+
+    async def aretrieve(self, query: str, k: int, executor=None, filters: dict = None):
+        return await self.run_blocking(executor, self.retrieve, query, k, filters)
+
+    async def agenerate_answer(self, query: str, k: int = TOP_K, executor=None, filters: dict = None) -> dict:
+        """Async generate_answer."""
+        with metrics.stage("total"):
+            return await self.aanswer_retrieved(query, k, *await self.aretrieve(query, k, executor, filters),
+                                                executor=executor, filters=filters)
+
+    async def agenerate_answers(self, queries: list, k: int = TOP_K, executor=None, filters: dict = None) -> list:
+        """Async generate_answers: one batched retrieval, then one generation at a time."""
+        retrievals = await self.run_blocking(executor, self.retrieve_many, queries, k, filters)
+        return [await self.aanswer_retrieved(query, k, *retrieval, executor=executor, filters=filters)
+                for query, retrieval in zip(queries, retrievals)]
+
+    async def aanswer_retrieved(self, query: str, k: int, cached: dict, retrieved: list, query_vec, executor=None,
+                                filters: dict = None) -> dict:
+        if cached is not None:
+            return cached
+
+        if not retrieved:
+            return {"answer": "No relevant information found.", "sources": []}
+
+        version = self.retriever.version  # the index the passages came from
+        retrieved, gate = self.apply_gate(retrieved)
+        if gate is not None and not gate["answer"]:
+            return self.no_answer(query, gate, version)
+        prompt, prompt_tokens = await self.run_blocking(executor, self.build_prompt, query, retrieved)
+
+        prefill = {}
+        try:
+            output = "".join([piece async for piece in self.astream_tokens(prompt, prefill)])
+        except GenerationError as e:
+            print(f"Generation error ({self.backend.name} backend): {e}")
+            output = None
+
+        response = self.build_response(query, output, retrieved, prompt_tokens, prefill, version, gate)
+        await self.run_blocking(executor, self.store_answer, query, k, query_vec, retrieved, response, output, filters)
+        return response
+
+    async def astream_answer(self, query: str, k: int = TOP_K, executor=None, filters: dict = None):
+        """Async stream_answer; yields the same event dicts."""
+        cached, retrieved, query_vec = await self.aretrieve(query, k, executor, filters)
+        if cached is not None:
+            yield {"type": "done", **cached}
+            return
+
+        if not retrieved:
+            yield {"type": "done", "question": query, "answer": "No relevant information found.", "sources": [], "retrieval_count": 0}
+            return
+
+        version = self.retriever.version  # the index the passages came from
+        retrieved, gate = self.apply_gate(retrieved)
+        if gate is not None and not gate["answer"]:
+            yield {"type": "done", **self.no_answer(query, gate, version)}
+            return
+        prompt, prompt_tokens = await self.run_blocking(executor, self.build_prompt, query, retrieved)
+
+        pieces = []
+        prefill = {}
+        tokens = self.astream_tokens(prompt, prefill)
+        try:
+            async for piece in tokens:
+                pieces.append(piece)
+                yield {"type": "token", "text": piece}
+            output = "".join(pieces)
+        except GenerationError as e:
+            print(f"Generation error ({self.backend.name} backend): {e}")
+            output = None
+        finally:
+            await tokens.aclose()  # also runs when the client disconnects mid-stream
+
+        response = self.build_response(query, output, retrieved, prompt_tokens, prefill, version, gate)
+        await self.run_blocking(executor, self.store_answer, query, k, query_vec, retrieved, response, output, filters)
+        yield {"type": "done", **response}
 
 # def main():
 #     try:
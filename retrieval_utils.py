@@ -1,50 +1,380 @@
 import os
 import json
+import hashlib
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import faiss
+from query_cache import QueryCache, normalize_query
+from passage_store import STORE_DIRNAME
+from ann_index import PARAMS_FILE
+from lexical_index import LEXICAL_DIRNAME
+from course_shards import SHARDS_FILE, IndexShard, filter_key, load_shards, normalize_filters
+from index_versions import resolve_index
+import metrics
+from onnx_encoder import ENCODER, load_encoder
 
 INDEX_DIR = "data/index"
 MODEL_NAME = 'all-MiniLM-L6-v2'
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+RETRIEVAL_MODE = "dense"
+FUSION_DEPTH = 50  # candidates taken from each side before hybrid fusion
+RRF_K = 60  # reciprocal-rank fusion constant: score = sum 1 / (RRF_K + rank)
+SEARCH_WORKERS = min(8, os.cpu_count() or 1)  # threads the per-course shard searches fan out on
+
+def index_fingerprint(index_dir: str = INDEX_DIR) -> str:
+    """Short version string that changes whenever the index files (of any course shard) are rebuilt."""
+    shards = load_shards(index_dir)
+    dirs = [""] + [entry["dir"] for entry in (shards or {}).get("courses", [])]
+    parts = []
+    for sub in dirs:
+        for name in (SHARDS_FILE, "kb.index", PARAMS_FILE, os.path.join(STORE_DIRNAME, "text.off"), os.path.join(STORE_DIRNAME, "meta.off"),
+                     os.path.join(LEXICAL_DIRNAME, "params.json")):
+            path = os.path.join(index_dir, sub, name)
+            if not os.path.exists(path):
+                continue
+            stat = os.stat(path)
+            parts.append(f"{os.path.join(sub, name)}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:12]
+
+def reciprocal_rank_fusion(rankings: list, k: int, rrf_k: int = RRF_K) -> tuple:
+    """
+    Merge ranked lists of keys (best first; rows, or (shard, row) pairs) by reciprocal rank.
+    Returns (keys, fused scores) for the top k, best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+    top = sorted(fused.items(), key=lambda item: -item[1])[:k]
+    return [key for key, _ in top], [score for _, score in top]
+
+def merge_hits(per_shard: list, k: int, higher_is_better: bool) -> list:
+    """
+    Merge per-shard results into one top-k per query. per_shard[s][q] is the (rows, scores)
+    pair shard s found for query q. Returns per query a list of ((shard, row), score), best first.
+    """
+    merged = []
+    for hits in zip(*per_shard):
+        candidates = [(float(score), s, int(row)) for s, (rows, scores) in enumerate(hits)
+                      for row, score in zip(rows, scores) if row >= 0]
+        candidates.sort(key=lambda c: -c[0] if higher_is_better else c[0])
+        merged.append([((s, row), score) for score, s, row in candidates[:k]])
+    return merged
+
+class IndexSnapshot:
+    """
+    The shards of one index version: the CURRENT version of a versioned index directory
+    (see index_versions.py) or the unversioned index in it. Searches hold a reference
+    while they run, so a snapshot swapped out by Retriever.reload() is closed only after
+    the last of them has finished.
+    """
+    def __init__(self, index_dir: str, mode: str):
+        #One shard per course (shards.json written by knowledge_base.py), or the single index of an unsharded build.
+        #BM25 indexes are required for lexical and hybrid search, and opened for dense search when present.
+        self.path, version = resolve_index(index_dir)
+        shards = load_shards(self.path)
+        if shards is None:
+            self.shards = [IndexShard(self.path, lexical=mode != "dense")]
+        else:
+            self.shards = [IndexShard(os.path.join(self.path, entry["dir"]), entry["course"], lexical=mode != "dense")
+                           for entry in shards["courses"]]
+        self.has_lexical = all(shard.lexical is not None for shard in self.shards)
+        self.fingerprint = index_fingerprint(self.path)
+        self.version = version or self.fingerprint  # reported with every answer
+        self._refs = 0
+        self._retired = False
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """Take a reference for one search; False once the snapshot has been swapped out."""
+        with self._lock:
+            if self._retired:
+                return False
+            self._refs += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            close = self._retired and self._refs == 0
+        if close:
+            self.close()
+
+    def retire(self):
+        """Called once a newer snapshot is live: close now, or when the last search releases it."""
+        with self._lock:
+            self._retired = True
+            close = self._refs == 0
+        if close:
+            self.close()
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
 
 class Retriever:
-    def __init__(self, index_dir: str = INDEX_DIR, model_name: str = MODEL_NAME):
-        #load FAISS Index
-        index_path = os.path.join(index_dir, "kb.index")
-        if not os.path.exists(index_path):
-            raise FileNotFoundError("FAISS index not found. Run knowledge_base.py first.")
-        self.index = faiss.read_index(index_path)
+    def __init__(self, index_dir: str = INDEX_DIR, model_name: str = MODEL_NAME, cache: QueryCache = None,
+                 mode: str = RETRIEVAL_MODE, encoder: str = ENCODER, encoder_threads: int = None,
+                 search_workers: int = SEARCH_WORKERS):
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}'. Choose from: {', '.join(RETRIEVAL_MODES)}")
+        self.mode = mode
+        self.index_dir = index_dir
+        self.snapshot = IndexSnapshot(index_dir, mode)
+        self._reload_lock = threading.Lock()
+        self._swap_listeners = []
+
+        #Load embedding model: the exported ONNX encoder when there is one (no torch import), else SentenceTransformer
+        self.model_name = model_name
+        self.model = load_encoder(model_name, encoder, threads=encoder_threads)
+        self.encoder = getattr(self.model, "variant", "torch")
+
+        #Shard searches fan out on this pool (threads start on demand); hybrid search also runs BM25 on it while the query is embedded
+        self._pool = ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix="shard-search") if search_workers > 1 else None
+
+        #Optional query cache, bound to this index build (and to the mode and encoder, whose results differ)
+        self._version_suffix = ("" if mode == "dense" else f"-{mode}") + ("" if self.encoder == "torch" else f"-{self.encoder}")
+        self.cache = cache
+        if cache is not None:
+            cache.set_index_version(self.index_version)
 
-        #Load mapping
-        mapping_path = os.path.join(index_dir, "mapping.json")
-        with open(mapping_path, "r", encoding="utf-8") as f:
-            self.mapping = json.load(f)
+    @property
+    def index_version(self) -> str:
+        """Cache binding of the live index: changes with every rebuild, mode and encoder."""
+        return self.snapshot.fingerprint + self._version_suffix
 
-        #Load embedding model 
-        self.model = SentenceTransformer(model_name, device = 'cpu')
+    @property
+    def version(self) -> str:
+        """Name of the live index version (its fingerprint for an unversioned index)."""
+        return self.snapshot.version
+
+    def on_swap(self, listener):
+        """Call listener(index_version) whenever reload() swaps in a new index."""
+        self._swap_listeners.append(listener)
+
+    def reload(self, force: bool = False) -> dict:
+        """
+        Load the CURRENT index version in the calling thread while requests keep being
+        served from the live one, then swap it in with a single assignment. Searches
+        already running finish on the old snapshot, which is closed after the last one.
+        Does nothing if the version has not changed, unless force is set.
+        """
+        with self._reload_lock:
+            old = self.snapshot
+            path, version = resolve_index(self.index_dir)
+            if not force and (version or index_fingerprint(path)) == old.version:
+                return {"swapped": False, "version": old.version}
+            start = time.perf_counter()
+            new = IndexSnapshot(self.index_dir, self.mode)
+            self.snapshot = new
+            old.retire()
+            if self.cache is not None:
+                self.cache.set_index_version(self.index_version)
+            for listener in self._swap_listeners:
+                listener(self.index_version)
+            load_s = round(time.perf_counter() - start, 3)
+            print(f"Swapped index version {old.version} -> {new.version} (loaded in {load_s}s)")
+            return {"swapped": True, "version": new.version, "previous": old.version, "load_s": load_s}
+
+    def acquire_snapshot(self) -> IndexSnapshot:
+        #The live snapshot, referenced; retried if a swap retires it between the read and the acquire
+        while True:
+            snapshot = self.snapshot
+            if snapshot.acquire():
+                return snapshot
+
+    def courses(self) -> list:
+        """Courses that questions can be scoped to, with their passage counts and lectures."""
+        return [{"course": shard.course, "passages": len(shard.store) - len(shard.store.deleted), "lectures": sorted(shard.lectures or [])}
+                for shard in self.snapshot.shards if shard.course is not None]
+
+    def select_shards(self, filters: dict = None, snapshot: IndexSnapshot = None) -> list:
+        """
+        (shard, allowed rows) pairs a query with these filters has to search; rows is None
+        when the whole shard is eligible. Shards of other courses, or holding none of
+        the requested lectures, are pruned before anything is searched.
+        """
+        shards = (snapshot or self.snapshot).shards
+        filters = normalize_filters(filters)
+        if filters is None:
+            return [(shard, None) for shard in shards]
+        courses = filters.get("courses")
+        if courses:
+            known = {shard.course for shard in shards}
+            unknown = [c for c in courses if c not in known]
+            if unknown:
+                raise ValueError(f"Unknown course: {', '.join(unknown)}. Available: {', '.join(sorted(c for c in known if c))}")
+        targets = []
+        for shard in shards:
+            if courses and shard.course not in courses:
+                continue
+            rows = shard.rows(filters.get("lectures"))
+            if rows is not None and not len(rows):
+                continue
+            targets.append((shard, rows))
+        return targets
 
     def embed_query(self, query: str) -> np.ndarray:
         """
         Convert query string into an embedding vector.
         """
-        return self.model.encode([query], convert_to_numpy=True)
-    
-    def get_top_k(self, query: str, k: int) -> list:
+        return self.embed_queries([query])
+
+    def embed_queries(self, queries: list) -> np.ndarray:
+        """
+        Embed many queries at once, one row per query. Queries missing from the
+        embedding cache are encoded together in a single forward pass.
+        """
+        if self.cache is None:
+            with metrics.stage("embed"):
+                return self.model.encode(queries, convert_to_numpy=True)
+        model_key = self.model_name if self.encoder == "torch" else f"{self.model_name}|{self.encoder}"
+        keys = [f"{model_key}|{normalize_query(q)}" for q in queries]
+        rows = [self.cache.embeddings.get(key) for key in keys]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            with metrics.stage("embed"):
+                encoded = self.model.encode([queries[i] for i in missing], convert_to_numpy=True)
+            for j, i in enumerate(missing):
+                rows[i] = encoded[j:j + 1]
+                self.cache.embeddings.put(keys[i], rows[i])
+        return np.vstack(rows)
+
+    def get_top_k(self, query: str, k: int, query_vec: np.ndarray = None, filters: dict = None) -> list:
         """
         Retrieve top-K passages relevant to the query.
-        Returns a list of dicts: {id, text, score}.
+        Pass query_vec when the query has already been embedded.
+        Returns a list of dicts: {id, text, score} plus the passage's course and lecture.
+        """
+        return self.get_top_k_batch([query], k, query_vec, filters=filters)[0]
+
+    def get_top_k_batch(self, queries: list, k: int, query_vecs: np.ndarray = None, mode: str = None,
+                        filters: dict = None) -> list:
+        """
+        Batch form of get_top_k: cache misses are embedded in one forward pass and
+        searched in one FAISS call per shard. Pass query_vecs (one row per query) when
+        the queries have already been embedded. mode overrides the retriever's
+        dense/lexical/hybrid setting for this call; filters ({"course": ..., "lectures": [...]})
+        scope every query of the batch.
+        Returns one result list per query, in order.
+        """
+        mode = mode or self.mode
+        filters = normalize_filters(filters)
+        if self.cache is None:
+            return self.retrieve(queries, k, query_vecs, mode, filters)
+        prefix = ("" if mode == "dense" else f"{mode}|") + filter_key(filters)
+        keys = [prefix + self.cache.key(q, k) for q in queries]
+        results = [self.cache.retrieval.get(key) for key in keys]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            vecs = query_vecs[missing] if query_vecs is not None else None
+            for i, found in zip(missing, self.retrieve([queries[i] for i in missing], k, vecs, mode, filters)):
+                results[i] = found
+                self.cache.retrieval.put(keys[i], found)
+        return [[dict(r) for r in found] for found in results]
+
+    def retrieve(self, queries: list, k: int, query_vecs: np.ndarray = None, mode: str = None, filters: dict = None) -> list:
+        """
+        Uncached retrieval in the given mode over the shards the filters select, merged
+        into one top-k per query. Dense scores are L2 distances (lower is closer),
+        lexical scores are BM25 and hybrid scores are fused reciprocal ranks (higher is
+        better for both).
+        """
+        snapshot = self.acquire_snapshot()
+        try:
+            return self._retrieve(snapshot, queries, k, query_vecs, mode or self.mode, filters)
+        finally:
+            snapshot.release()
+
+    def _retrieve(self, snapshot: IndexSnapshot, queries: list, k: int, query_vecs: np.ndarray, mode: str, filters: dict) -> list:
+        if mode != "dense" and not snapshot.has_lexical:
+            raise FileNotFoundError("Lexical index not found. Run knowledge_base.py first.")
+        targets = self.select_shards(filters, snapshot)
+        if not targets:
+            return [[] for _ in queries]
+        if mode == "lexical":
+            with metrics.stage("lexical"):
+                found = [hits for hits, _ in self._fan_out(self._search_lexical_shard, targets, queries, k)]
+                hits = merge_hits(found, k, higher_is_better=True)
+            with metrics.stage("lookup"):
+                return [self.passages(targets, found) for found in hits]
+        if mode == "dense":
+            vecs = query_vecs if query_vecs is not None else self.embed_queries(queries)
+            with metrics.stage("search"):
+                hits = merge_hits(self._fan_out(self._search_shard, targets, vecs, k), k, higher_is_better=False)
+            with metrics.stage("lookup"):
+                return [self.passages(targets, found) for found in hits]
+
+        #Hybrid: BM25 runs on the pool while this thread embeds the queries, then both sides are fused
+        depth = max(k, FUSION_DEPTH)
+        lexical = [self._submit(self._search_lexical_shard, shard, rows, queries, depth) for shard, rows in targets]
+        vecs = query_vecs if query_vecs is not None else self.embed_queries(queries)
+        with metrics.stage("search"):
+            dense = merge_hits(self._fan_out(self._search_shard, targets, vecs, depth), depth, higher_is_better=False)
+        lexical = [future.result() for future in lexical]
+        metrics.record("lexical", max(elapsed for _, elapsed in lexical))  # the shards ran in parallel: the slowest one counts
+        lexical = merge_hits([found for found, _ in lexical], depth, higher_is_better=True)
+        fused = [reciprocal_rank_fusion([[key for key, _ in dense_hits], [key for key, _ in lexical_hits]], k)
+                 for dense_hits, lexical_hits in zip(dense, lexical)]
+        with metrics.stage("lookup"):
+            return [self.passages(targets, list(zip(keys, scores))) for keys, scores in fused]
+
+    def _submit(self, fn, *args):
+        #Run on the pool when there is one; the returned object only needs .result()
+        if self._pool is not None:
+            return self._pool.submit(fn, *args)
+        done = Future()
+        done.set_result(fn(*args))
+        return done
+
+    def _fan_out(self, fn, targets: list, *args) -> list:
+        """fn(shard, rows, *args) for every target shard, in parallel when there is more than one."""
+        if len(targets) == 1 or self._pool is None:
+            return [fn(shard, rows, *args) for shard, rows in targets]
+        return [future.result() for future in [self._pool.submit(fn, shard, rows, *args) for shard, rows in targets]]
+
+    @staticmethod
+    def _search_shard(shard: IndexShard, rows, query_vecs: np.ndarray, k: int) -> list:
+        return shard.search(np.ascontiguousarray(query_vecs, dtype=np.float32), k, rows)
+
+    @staticmethod
+    def _search_lexical_shard(shard: IndexShard, rows, queries: list, k: int):
+        start = time.perf_counter()
+        found = shard.search_lexical(queries, k, rows)
+        return found, time.perf_counter() - start
+
+    def search(self, query_vec: np.ndarray, k: int, filters: dict = None) -> list:
         """
-        query_vec = self.embed_query(query)
-        D, I = self.index.search(query_vec, k) # D = distances, I = indices
+        Search the index with an already embedded query.
+        """
+        return self.search_batch(query_vec, k, filters)[0]
+
+    def search_batch(self, query_vecs: np.ndarray, k: int, filters: dict = None) -> list:
+        """
+        Search the index with a matrix of embedded queries in one call per shard.
+        """
+        return self.retrieve([None] * len(query_vecs), k, query_vecs, "dense", filters)
+
+    def search_lexical(self, query: str, k: int, filters: dict = None) -> list:
+        """BM25 search over the inverted index."""
+        return self.retrieve([query], k, mode="lexical", filters=filters)[0]
 
+    def passages(self, targets: list, hits: list) -> list:
+        """Look up ((shard, row), score) hits and return [{id, text, score, course, lecture}]."""
         results = []
-        for idx, score in zip(I[0], D[0]):
-            passage = self.mapping[str(idx)]
-            results.append({
+        for (s, row), score in hits:
+            passage = targets[s][0].store.get(int(row))
+            result = {
                 "id": passage["id"],
                 "text": passage["text"],
-                "score": float(score) #Lower Score = closer match
-            })
+                "score": float(score) #Lower Score = closer match (dense)
+            }
+            for key in ("course", "lecture"):
+                if key in passage:
+                    result[key] = passage[key]
+            results.append(result)
         return results
     
 # if __name__ == "__main__":
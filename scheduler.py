@@ -0,0 +1,211 @@
+import os
+import math
+import time
+import asyncio
+import threading
+from collections import deque
+from llm_backend import CancelToken, LLM_THREADS
+
+CPU_COUNT = os.cpu_count() or 1
+GENERATION_SLOTS = max(1, CPU_COUNT // (2 * LLM_THREADS))  # concurrent generations
+MAX_QUEUE = 16  # requests allowed to wait for a slot; more are turned away
+REQUEST_TIMEOUT = 120  # seconds from admission to the end of generation
+RETRY_AFTER = 5  # seconds suggested to rejected clients before any request has finished
+WATCHDOG_INTERVAL = 0.5
+WAIT_SAMPLES = 1000  # recent queue waits kept for the percentiles in stats()
+
+
+class SchedulerError(RuntimeError):
+    """Base class for requests the scheduler refuses or abandons."""
+
+
+class QueueFull(SchedulerError):
+    """Every slot is busy and the wait queue is full; retry after `retry_after` seconds."""
+    def __init__(self, retry_after: int):
+        super().__init__(f"Generation queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(SchedulerError):
+    """The request did not finish (queue wait plus generation) within its timeout."""
+
+
+class RequestCancelled(SchedulerError):
+    """The request was cancelled (usually its client disconnected) while it waited for a slot."""
+
+
+def allocate_threads(cpus: int = CPU_COUNT, slots: int = GENERATION_SLOTS) -> dict:
+    """
+    Split the cores between the query embedder and the LLM so the two never
+    oversubscribe the CPU: a quarter (at least one) for embedding, the rest for
+    generation, divided evenly across slots.
+    """
+    embed = max(1, cpus // 4)
+    llm = max(1, cpus - embed)
+    return {"embed": embed, "llm": llm, "per_slot": max(1, llm // slots)}
+
+def backend_options(mode: str, threads: dict, slots: int = GENERATION_SLOTS) -> dict:
+    """Constructor arguments that size a backend to its share of the cores."""
+    if mode == "server":
+        return {"threads": threads["llm"], "parallel": slots}  # one server, `slots` parallel sequences
+    if mode == "cli":
+        return {"threads": threads["per_slot"]}  # one process per slot
+    return {}
+
+
+class Ticket:
+    """One admitted request: waits in FIFO order for a slot, then holds it until released."""
+    def __init__(self, scheduler, timeout: float):
+        self.scheduler = scheduler
+        self.admitted = time.monotonic()
+        self.deadline = self.admitted + timeout
+        self.cancel_token = CancelToken()
+        self.started = None
+        self.wait_ms = None
+        self.state = "queued"  # queued -> running -> done
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+    def wait(self):
+        """
+        Block until this ticket holds a slot. Raises DeadlineExceeded if the deadline passes
+        first, RequestCancelled if the ticket is cancelled or released while queued.
+        """
+        self.scheduler._wait(self)
+
+    async def wait_async(self):
+        """wait() for asyncio callers: the blocking wait runs on a worker thread, not the event loop."""
+        await asyncio.get_running_loop().run_in_executor(None, self.wait)
+
+    def release(self):
+        self.scheduler._release(self)
+
+    def cancel(self, reason: str = "cancelled"):
+        """Abort the request wherever it is: dequeue it, or stop its running generation."""
+        self.cancel_token.cancel(reason)
+        self.scheduler._cancel(self)
+
+    def __enter__(self):
+        self.wait()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class GenerationScheduler:
+    """
+    Admission control for the generation backend: at most `slots` generations run at
+    once, up to `max_queue` more wait in FIFO order, and anything beyond that is
+    rejected immediately with QueueFull. Every admitted request gets a deadline; a
+    watchdog thread cancels running generations that pass it, which kills the
+    llamafile child or drops the server connection.
+    """
+    def __init__(self, slots: int = GENERATION_SLOTS, max_queue: int = MAX_QUEUE, timeout: float = REQUEST_TIMEOUT):
+        self.slots = slots
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._running = set()
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._service_s = deque(maxlen=WAIT_SAMPLES)
+        self.counts = {"admitted": 0, "rejected": 0, "timed_out": 0, "cancelled": 0, "completed": 0}
+        self._watchdog = threading.Thread(target=self._watch, name="generation-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def admit(self, timeout: float = None) -> Ticket:
+        """Admit a request or raise QueueFull. The returned ticket must be released."""
+        with self._cond:
+            if len(self._running) >= self.slots and len(self._queue) >= self.max_queue:
+                self.counts["rejected"] += 1
+                raise QueueFull(self.retry_after())
+            ticket = Ticket(self, timeout if timeout is not None else self.timeout)
+            self._queue.append(ticket)
+            self.counts["admitted"] += 1
+            return ticket
+
+    def would_reject(self) -> bool:
+        with self._cond:
+            return len(self._running) >= self.slots and len(self._queue) >= self.max_queue
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free: queued work divided across slots at the recent mean service time."""
+        if not self._service_s:
+            return RETRY_AFTER
+        mean_service = sum(self._service_s) / len(self._service_s)
+        return max(1, math.ceil(mean_service * (len(self._queue) + 1) / self.slots))
+
+    def _wait(self, ticket: Ticket):
+        with self._cond:
+            while True:
+                if ticket.cancel_token.cancelled or ticket.state == "done":
+                    # Not a deadline miss: the watchdog only cancels running tickets
+                    raise RequestCancelled(f"Request {ticket.cancel_token.reason or 'released'} while queued")
+                if self._queue and self._queue[0] is ticket and len(self._running) < self.slots:
+                    self._queue.popleft()
+                    self._running.add(ticket)
+                    ticket.state = "running"
+                    ticket.started = time.monotonic()
+                    ticket.wait_ms = (ticket.started - ticket.admitted) * 1000
+                    self._waits.append(ticket.wait_ms)
+                    self._cond.notify_all()  # the next ticket may also fit
+                    return
+                remaining = ticket.deadline - time.monotonic()
+                if remaining <= 0:
+                    self._queue.remove(ticket)
+                    ticket.state = "done"
+                    self.counts["timed_out"] += 1
+                    self._cond.notify_all()
+                    raise DeadlineExceeded(f"No generation slot free within {self.timeout}s")
+                self._cond.wait(remaining)
+
+    def _release(self, ticket: Ticket):
+        with self._cond:
+            if ticket.state == "queued":
+                self._queue.remove(ticket)
+            elif ticket.state == "running":
+                self._running.discard(ticket)
+                self._service_s.append(time.monotonic() - ticket.started)
+                if ticket.cancel_token.reason == "deadline":
+                    self.counts["timed_out"] += 1
+                elif ticket.cancel_token.cancelled:
+                    self.counts["cancelled"] += 1
+                else:
+                    self.counts["completed"] += 1
+            ticket.state = "done"
+            self._cond.notify_all()
+
+    def _cancel(self, ticket: Ticket):
+        with self._cond:
+            if ticket.state == "queued":
+                self._queue.remove(ticket)
+                ticket.state = "done"
+                self.counts["cancelled"] += 1
+            self._cond.notify_all()
+
+    def _watch(self):
+        while True:
+            time.sleep(WATCHDOG_INTERVAL)
+            with self._cond:
+                overdue = [t for t in self._running if t.expired and not t.cancel_token.cancelled]
+            for ticket in overdue:
+                print(f"Generation exceeded its {self.timeout}s deadline, cancelling")
+                ticket.cancel_token.cancel("deadline")
+
+    def stats(self) -> dict:
+        with self._cond:
+            waits = sorted(self._waits)
+            return {
+                "slots": self.slots,
+                "busy": len(self._running),
+                "queue_depth": len(self._queue),
+                "max_queue": self.max_queue,
+                "timeout_s": self.timeout,
+                "wait_ms_p50": round(waits[len(waits) // 2], 1) if waits else 0.0,
+                "wait_ms_p95": round(waits[int(len(waits) * 0.95)], 1) if waits else 0.0,
+                "wait_ms_max": round(waits[-1], 1) if waits else 0.0,
+                **self.counts
+            }
@@ -0,0 +1,107 @@
+import time
+import threading
+import numpy as np
+
+SEMANTIC_CACHE_SIZE = 512
+SIMILARITY_THRESHOLD = 0.9  # minimum cosine similarity between query embeddings
+MIN_ID_OVERLAP = 0.75  # minimum share of retrieved passage ids the two queries must have in common
+SEMANTIC_CACHE_TTL = 24 * 3600  # seconds; None keeps entries until evicted
+
+def id_overlap(a: list, b: list) -> float:
+    """Fraction of retrieved passage ids shared by two result lists."""
+    a, b = set(a), set(b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / max(len(a), len(b))
+
+
+class SemanticCache:
+    """
+    Answer cache for paraphrased questions.
+    Keeps a fixed-size NumPy matrix of normalized query embeddings; each row maps to
+    a cached response and the passage ids it was generated from. A lookup hits when
+    the cosine similarity is above `threshold` and the retrieved ids overlap by at
+    least `min_overlap`. When full, the least recently used entry is evicted.
+    """
+    def __init__(self, capacity: int = SEMANTIC_CACHE_SIZE, threshold: float = SIMILARITY_THRESHOLD,
+                 min_overlap: float = MIN_ID_OVERLAP, ttl: float = SEMANTIC_CACHE_TTL):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.min_overlap = min_overlap
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.index_version = None
+        self._vectors = None  # (capacity, dim), allocated on first put
+        self._entries = [None] * capacity  # {"response", "ids", "created", "last_used"}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(query_vec: np.ndarray) -> np.ndarray:
+        vec = np.asarray(query_vec, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def _live(self, entry: dict, now: float) -> bool:
+        return entry is not None and (self.ttl is None or now - entry["created"] <= self.ttl)
+
+    def lookup(self, query_vec: np.ndarray, retrieved_ids: list):
+        """
+        Return (response, similarity) for the closest cached paraphrase, or None.
+        """
+        with self._lock:
+            if self._vectors is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            sims = self._vectors @ self._normalize(query_vec)
+            for slot in np.argsort(-sims):
+                if sims[slot] < self.threshold:
+                    break
+                entry = self._entries[slot]
+                if not self._live(entry, now):
+                    continue
+                if id_overlap(entry["ids"], retrieved_ids) >= self.min_overlap:
+                    entry["last_used"] = now
+                    self.hits += 1
+                    return entry["response"], float(sims[slot])
+            self.misses += 1
+            return None
+
+    def put(self, query_vec: np.ndarray, retrieved_ids: list, response: dict):
+        with self._lock:
+            vec = self._normalize(query_vec)
+            if self._vectors is None:
+                self._vectors = np.zeros((self.capacity, vec.shape[0]), dtype=np.float32)
+            now = time.time()
+            free = [i for i, entry in enumerate(self._entries) if not self._live(entry, now)]
+            if free:
+                slot = free[0]
+            else:
+                slot = min(range(self.capacity), key=lambda i: self._entries[i]["last_used"])
+            self._vectors[slot] = vec
+            self._entries[slot] = {"response": response, "ids": list(retrieved_ids), "created": now, "last_used": now}
+
+    def clear(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors[:] = 0
+            self._entries = [None] * self.capacity
+
+    def set_index_version(self, version: str):
+        """Cached answers are only valid for the index build they were retrieved from."""
+        if version != self.index_version:
+            self.clear()
+            self.index_version = version
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": sum(entry is not None for entry in self._entries),
+            "max_size": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "threshold": self.threshold,
+            "min_overlap": self.min_overlap
+        }
@@ -0,0 +1,97 @@
+import os
+from retrieval_utils import Retriever
+from course_shards import normalize_filters
+from index_versions import IndexWatcher
+from llm_backend import BACKEND_MODE, GenerationError, get_backend
+from scheduler import GenerationScheduler, allocate_threads, backend_options
+from query_cache import QueryCache
+from semantic_cache import SemanticCache
+from confidence_gate import ConfidenceGate
+import metrics
+import rag
+
+# Startup and response building shared by app.py (Flask) and app_async.py (aiohttp), so both
+# servers answer from the same components with the same JSON contract.
+
+MAX_BATCH_QUESTIONS = 64
+CACHE_ENABLED = os.environ.get('RAG_CACHE', '1') != '0'  # RAG_CACHE=0 turns off the query and semantic caches (e.g. for load tests)
+
+# Cores are split between the query embedder and the LLM so concurrent requests do not oversubscribe the CPU
+threads = allocate_threads()
+
+# Initialize RAGQA instance globally. The generation backend is started once here
+# (see RAG_BACKEND in llm_backend.py) so the model stays resident between requests.
+try:
+    query_cache = QueryCache() if CACHE_ENABLED else None
+    retriever = Retriever(cache=query_cache, encoder_threads=threads["embed"])
+    backend = get_backend(**backend_options(BACKEND_MODE, threads))
+    semantic_cache = SemanticCache() if CACHE_ENABLED else None
+    scheduler = GenerationScheduler()
+    gate = ConfidenceGate.load()  # None until evaluate/calibrate_gate.py has been run
+    rag_instance = rag.RAGQA(retriever, backend=backend, semantic_cache=semantic_cache, batch_wait_ms=rag.BATCH_WAIT_MS,
+                             scheduler=scheduler, gate=gate)
+except (FileNotFoundError, GenerationError) as e:
+    print(f"Error initializing RAGQA: {e}")
+    exit(1)
+
+metrics.register(metrics.Gauge("rag_generation_queue_depth", "Requests waiting for a generation slot.", lambda: scheduler.stats()["queue_depth"]))
+metrics.register(metrics.Gauge("rag_generation_busy_slots", "Generation slots in use.", lambda: scheduler.stats()["busy"]))
+if rag_instance.gate is not None:
+    metrics.register(metrics.Gauge("rag_gate_skipped_total", "Questions answered without generation by the confidence gate.", lambda: rag_instance.gate.stats()["skipped"]))
+    metrics.register(metrics.Gauge("rag_gate_saved_seconds_total", "Estimated generation time saved by the confidence gate.", lambda: rag_instance.gate.stats()["saved_s"]))
+
+# New index versions published by knowledge_base.py are loaded in the background and swapped in
+# (see Retriever.reload); RAG_INDEX_WATCH=0 turns polling off, leaving /api/admin/reload
+watcher = IndexWatcher(retriever.reload).start()
+ADMIN_TOKEN = os.environ.get('RAG_ADMIN_TOKEN')  # when set, /api/admin/reload needs it in the X-Admin-Token header
+
+def request_filters(data: dict):
+    """Scope of a request: {"course": ..., "lectures": [...]}. Raises ValueError for unknown courses."""
+    filters = normalize_filters({key: data.get(key) for key in ("course", "lectures")})
+    retriever.select_shards(filters)
+    return filters
+
+def answer_result(response: dict, timings: dict = None) -> dict:
+    """JSON body of /api/ask; `timings` is the per-stage breakdown asked for with {"timings": true}."""
+    result = {
+        "question": response["question"],
+        "answer": response["answer"],
+        "sources": response["sources"],
+        "retrieval_count": response["retrieval_count"],
+        "prompt_tokens": response.get("prompt_tokens"),
+        "prefill": response.get("prefill", {}),
+        "queue_wait_ms": response.get("queue_wait_ms"),
+        "index_version": response.get("index_version"),
+        "gate": response.get("gate"),
+        "cached": response.get("cached", False)
+    }
+    if timings is not None:
+        result["timings"] = timings
+    return result
+
+def batch_result(query: str, response: dict) -> dict:
+    """One entry of the /api/ask_batch results."""
+    return {
+        "question": query,
+        "answer": response["answer"],
+        "sources": response["sources"],
+        "retrieval_count": response.get("retrieval_count", 0),
+        "prompt_tokens": response.get("prompt_tokens"),
+        "prefill": response.get("prefill", {}),
+        "index_version": response.get("index_version"),
+        "gate": response.get("gate"),
+        "cached": response.get("cached", False)
+    }
+
+def cache_stats() -> dict:
+    if not CACHE_ENABLED:
+        return {"enabled": False, "retrieval_batches": rag_instance.batcher.stats()}
+    return {"enabled": True, **query_cache.stats(), "semantic": semantic_cache.stats(), "retrieval_batches": rag_instance.batcher.stats()}
+
+def index_info() -> dict:
+    """The index version answers are currently served from."""
+    return {"version": retriever.version, "courses": len(retriever.courses())}
+
+def gate_stats() -> dict:
+    """Confidence gate thresholds, questions skipped or shrunk, and the generation time saved."""
+    return rag_instance.gate.stats() if rag_instance.gate is not None else {"enabled": False}
@@ -0,0 +1,57 @@
+import json
+from tokenizers import Tokenizer, models, normalizers, pre_tokenizers
+from preprocess_passages import load_tokenizer, process_text_files, split_into_passages
+from onnx_encoder import CONFIG_FILE, TOKENIZER_FILE
+
+WORDS = ["sort", "sorting", "graph", "graphs", "heap", "tree"]
+
+def save_tokenizer(onnx_dir, model_name="test-model"):
+    #A WordPiece tokenizer saved with fixed padding and truncation, like the hub MiniLM tokenizer.json
+    vocab = {"[UNK]": 0, "[PAD]": 1, "sort": 2, "graph": 3, "heap": 4, "tree": 5, "##ing": 6, "##s": 7}
+    tokenizer = Tokenizer(models.WordPiece(vocab, unk_token="[UNK]"))
+    tokenizer.normalizer = normalizers.BertNormalizer(lowercase=True)
+    tokenizer.pre_tokenizer = pre_tokenizers.BertPreTokenizer()
+    tokenizer.enable_padding(pad_id=1, pad_token="[PAD]", length=128)
+    tokenizer.enable_truncation(max_length=128)
+    tokenizer.save(str(onnx_dir / TOKENIZER_FILE))
+    with open(onnx_dir / CONFIG_FILE, "w", encoding="utf-8") as f:
+        json.dump({"model_name": model_name}, f)
+    return model_name
+
+def token_count(tokenizer, text):
+    return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+def test_passages_are_sized_in_tokens(tmp_path):
+    tokenizer = load_tokenizer(save_tokenizer(tmp_path), str(tmp_path))
+    words = [WORDS[(i * 7) % len(WORDS)] for i in range(1000)]
+    passages = list(split_into_passages(" ".join(words), tokenizer, chunk_tokens=50, overlap_tokens=10))
+
+    counts = [token_count(tokenizer, p) for p in passages]
+    assert max(counts) <= 50
+    assert min(counts[:-1]) >= 40  # padding would have made every word a passage of its own
+    assert passages[0].split()[0] == words[0] and passages[-1].split()[-1] == words[-1]
+
+def test_passages_overlap(tmp_path):
+    tokenizer = load_tokenizer(save_tokenizer(tmp_path), str(tmp_path))
+    words = [WORDS[i % len(WORDS)] for i in range(300)]
+    passages = list(split_into_passages(words, tokenizer, chunk_tokens=30, overlap_tokens=8))
+    for previous, passage in zip(passages, passages[1:]):
+        #Each passage starts with words from the end of the previous one
+        assert " ".join(passage.split()[:2]) in " ".join(previous.split()[-8:])
+
+def test_boilerplate_is_dropped_from_mixed_passages(tmp_path):
+    tokenizer = load_tokenizer(save_tokenizer(tmp_path), str(tmp_path))
+    boilerplate = "The following content is provided under a Creative Commons license. "
+    in_dir, out_dir = tmp_path / "processed", tmp_path / "passages"
+    in_dir.mkdir()
+    (in_dir / "lecture1.txt").write_text(boilerplate + "A heap is a tree. Sorting graphs needs a heap.", encoding="utf-8")
+    (in_dir / "lecture2.txt").write_text(boilerplate + "A graph has nodes. Trees are graphs without cycles.", encoding="utf-8")
+    totals = process_text_files(str(in_dir), str(out_dir), tokenizer=tokenizer, chunk_tokens=100)
+
+    def passages(lecture):
+        with open(out_dir / "default" / f"{lecture}.jsonl", encoding="utf-8") as f:
+            return [json.loads(line)["text"] for line in f]
+    #One passage per lecture, so the boilerplate shares it with lecture text
+    assert passages("lecture1") == [boilerplate + "A heap is a tree. Sorting graphs needs a heap."]
+    assert passages("lecture2") == ["A graph has nodes. Trees are graphs without cycles."]
+    assert totals["exact_duplicates"] == 1